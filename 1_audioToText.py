@@ -1,59 +1,57 @@
 from datetime import datetime
 import json
 import os  # Manejo del sistema de archivos y rutas
+import threading
 import requests  # 🔹 Para hacer la solicitud HTTP al servidor 3_textToJson.py
-from flask import Flask, request, jsonify  # Framework web Flask para manejar peticiones HTTP
-from werkzeug.utils import secure_filename  # Función para asegurar nombres de archivos válidos
-from dotenv import load_dotenv  # Manejo de variables de entorno
-from openai import OpenAI  # Cliente para interactuar con la API de OpenAI
-from flasgger import Swagger  # Generación automática de documentación con API Docs
-from supabase import create_client, Client
-
-# 🔹 Cargar variables de entorno desde un archivo .env
-load_dotenv()
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')  # Clave de API de OpenAI
+from flask import request, jsonify  # Framework web Flask para manejar peticiones HTTP
+
+from appFactory import create_app, openai_client, supabase_client  # App Flask común y clientes perezosos
+from drugIndex import default_index, normalize_count, normalize_dose  # Normalización de nombres y dosis
+from instrumentation import timer, request_headers  # Métricas de latencia por etapa
+import resilience  # Timeouts y circuit breaker frente a Supabase y OpenAI
+import transcriptionCache  # Transcripciones ya hechas por hash (o huella) del audio
+import uploadStream  # Subidas en streaming con validación temprana
+
+# 🔹 Clientes de Supabase y OpenAI: se construyen en el primer uso (o en la precarga en segundo plano)
+supabase = supabase_client()
+client = openai_client()
+
+# 🔹 Configuración de Flask (carga el .env, Swagger, /metrics y perfilado)
+app = create_app(__name__, 'transcribe',
+                 upload_folder='uploads',  # Carpeta donde se guardarán temporalmente los archivos subidos
+                 max_content_length=25 * 1024 * 1024,  # Límite de tamaño de archivo: 25 MB
+                 warm=(client, supabase))
 API_TOKEN = os.getenv('API_TOKEN')  # Token de autenticación para proteger la API
-# Configurar Supabase
-SUPABASE_URL = os.getenv("SUPABASE_URL")  # URL de Supabase
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")  # API Key de Supabase
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 # URL de los servidores
-PHOTO_TO_NAME_SERVER = "http://localhost:5001/img_to_text"
-TEXT_TO_JSON_SERVER = "http://localhost:5002/getPillInfo"
-
-# 🔹 Inicializar cliente de OpenAI con la clave de API cargada
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-# 🔹 Configuración de Flask
-app = Flask(__name__)  # Inicializa la aplicación Flask
-app.config['UPLOAD_FOLDER'] = 'uploads'  # Carpeta donde se guardarán temporalmente los archivos subidos
-app.config['MAX_CONTENT_LENGTH'] = 25 * 1024 * 1024  # Límite de tamaño de archivo: 25 MB
-
-# 🔹 Crea la carpeta de almacenamiento de archivos si no existe
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-# 🔹 Configurar Swagger para generar documentación de la API
-swagger = Swagger(app)
+PHOTO_TO_NAME_SERVER = os.getenv("PHOTO_TO_NAME_SERVER", "http://localhost:5001/img_to_text")
+TEXT_TO_JSON_SERVER = os.getenv("TEXT_TO_JSON_SERVER", "http://localhost:5002/getPillInfo")
 
 # 🔹 Definir las extensiones de archivo permitidas
 ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'wav', 'm4a', 'ogg'}
 ALLOWED_IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+# 🔹 Límites por campo de la subida (el total lo limita MAX_CONTENT_LENGTH)
+UPLOAD_LIMITS = {
+    'audio': uploadStream.FieldLimit(20 * 1024 * 1024, uploadStream.AUDIO_KINDS, to_disk=True,
+                                     extensions=ALLOWED_AUDIO_EXTENSIONS),
+    'photo': uploadStream.FieldLimit(10 * 1024 * 1024, {'jpeg', 'png'}, extensions=ALLOWED_IMAGE_EXTENSIONS),
+}
 
+# 🔹 Medicamentos (nombre canónico, dosis) ya insertados por este proceso: evita filas duplicadas.
+# Solo dentro del proceso: con varios workers aún puede duplicarse la primera inserción de cada
+# medicamento (lo evitaría un índice único (nombre, cantidad_por_dosis) en Supabase con upsert)
+known_medicamentos = set()
+known_medicamentos_lock = threading.Lock()
+SUPABASE_WRITE = resilience.upstream('supabase_write', hedge=False)
 
-def allowed_file(filename, allowed_extensions):
-    """
-    Verifica si el archivo tiene una extensión permitida.
-    """
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
 def insert(data):
     # Definir cada campo por separado
     # Extraer valores del JSON recibido
-    nombre = data.get("nombre_del_medicamento")
-    dosis = data.get("cantidad_por_dosis")
-    cantidad = data.get("numero_de_comprimidos")
+    # 🔹 "lorazepan", "LORAZEPAM 1mg" -> "Lorazepam"; "0,5 mg" -> 0.5; "50 comprimidos" -> 50
+    nombre = default_index().canonical_name(data.get("nombre_del_medicamento"))
+    dosis = normalize_dose(data.get("cantidad_por_dosis"))
+    cantidad = normalize_count(data.get("numero_de_comprimidos"))
     parte_afectada = data.get("parte_afectada")
     frecuencia = data.get("frecuencia")
     fecha_inicio = data.get("primera_ingestion")
@@ -70,7 +68,6 @@ def insert(data):
         "numero_comprimidos": cantidad,
         "parte_afectada": parte_afectada,
     }
-    print(medicamento)
     tratamiento = {
         "nombre_medicamento": nombre,
         "nombre_paciente":"Candela",
@@ -78,12 +75,26 @@ def insert(data):
         "frecuencia":frecuencia,
         "imagen": imagen,
     }
-    print(tratamiento)
     # Insertar en Supabase
-    response = supabase.table("medicamento").insert(medicamento).execute()
-    response = supabase.table("tratamiento").insert(tratamiento).execute()
-
-    print(response)  # Verificar respuesta
+    medicamento_key = (nombre, dosis)
+    with timer('db_insert'):
+        # 🔹 Se reserva la clave antes de insertar: otro request con el mismo medicamento no lo duplica
+        with known_medicamentos_lock:
+            is_new = medicamento_key not in known_medicamentos
+            known_medicamentos.add(medicamento_key)
+        # 🔹 Escrituras con timeout y circuit breaker, sin hedging (no son idempotentes)
+        if is_new:
+            try:
+                response = SUPABASE_WRITE.call(supabase.table("medicamento").insert(medicamento).execute)
+            except resilience.UpstreamTimeout:
+                raise  # la inserción abandonada aún puede confirmarse: la clave sigue reservada
+            except Exception:
+                with known_medicamentos_lock:
+                    known_medicamentos.discard(medicamento_key)  # error seguro: el siguiente request lo reintenta
+                raise
+        response = SUPABASE_WRITE.call(supabase.table("tratamiento").insert(tratamiento).execute)
+    # 🔹 Lo que se ha guardado (ya normalizado), para devolverlo tal cual al cliente
+    return {**data, "nombre_del_medicamento": nombre, "cantidad_por_dosis": dosis, "numero_de_comprimidos": cantidad}
 
 # 🔹 Definir el endpoint para la transcripción de audio
 @app.route('/transcribe', methods=['POST'])
@@ -121,55 +132,36 @@ def transcribe_audio():
       500:
         description: Error interno del servidor
     """
-    # 🔹 Verificar si los argumentos se han sido enviado en la petición
-    if 'audio' not in request.files:
-        return jsonify({'error': 'No se encontró el archivo de audio.'}), 400
-    if 'photo' not in request.files:
-        return jsonify({'error': 'No se encontró la imagen.'}), 400
-
-    # Obtener arg audio
-    audio_file = request.files['audio']
-    image_file = request.files['photo']
-
-    # 🔹 Verificar si el archivo tiene un nombre válido
-    if audio_file.filename == '':
-        return jsonify({'error': 'El nombre del archivo está vacío.'}), 400
-
-    # 🔹 Verificar si el archivo tiene una extensión permitida
-    if not allowed_file(audio_file.filename, ALLOWED_AUDIO_EXTENSIONS):
-        return jsonify({'error': 'Formato de archivo de audio no permitido.'}), 400
-    if not allowed_file(image_file.filename, ALLOWED_IMAGE_EXTENSIONS):
-        return jsonify({'error': 'Formato de archivo de imagen no permitido.'}), 400
-
-    # 🔹 Guardar el archivo de manera segura en el directorio de almacenamiento temporal
-    filename = secure_filename(audio_file.filename)
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    audio_file.save(file_path)
-
-    image_filename = secure_filename(image_file.filename)
-    image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-    image_file.save(image_path)
+    # 🔹 Lectura en streaming: extensión y bytes mágicos comprobados al empezar cada archivo,
+    # límite de tamaño por campo y el audio directamente a disco (nunca entero en memoria)
+    try:
+        with timer('upload_parse'):
+            upload = uploadStream.parse(request, UPLOAD_LIMITS, directory=app.config['UPLOAD_FOLDER'])
+    except uploadStream.UploadRejected as e:
+        return uploadStream.error_response(e)
+    audio_upload = upload.file('audio')
+    photo_upload = upload.file('photo')
+    file_path = audio_upload.path
 
     try:
         # Información de la imagen
-        with open(image_path, 'rb') as image_file:
-            files = {'photo': image_file}  # Enviar la imagen en multipart/form-data
-            event_json_photo = requests.post(PHOTO_TO_NAME_SERVER, files=files).json().get('event_json')
+        with timer('rpc_img_to_text'):
+            files = {'photo': (photo_upload.filename, photo_upload.data)}  # Enviar la imagen en multipart/form-data
+            event_json_photo = requests.post(PHOTO_TO_NAME_SERVER, files=files,
+                                             headers=request_headers()).json().get('event_json')
 
         # 🔹 Abrir el archivo y enviarlo a OpenAI Whisper para su transcripción
-        with open(file_path, 'rb') as audio:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1",  # Modelo de OpenAI para transcripción de audio
-                file=audio  # Archivo de audio a transcribir
-            )
-
-        text = transcription.text
-        print('Transcription: ' + text)
+        # (los audios largos se cortan en silencios y los trozos se transcriben en paralelo).
+        # Si es un reintento de la misma nota (5001/5002 fallaron), el texto sale de la caché
+        with timer('whisper'):
+            text = transcriptionCache.transcribe(client, file_path, audio_upload.sha256)
+
         # 🔹 Eliminar el archivo después de la transcripción para ahorrar espacio
-        os.remove(file_path)
+        upload.remove()
 
         # 🔹 Enviar el texto transcrito al Servidor 2 (3_textToJson.py)
-        response = requests.post(TEXT_TO_JSON_SERVER, json={'transcript': text})
+        with timer('rpc_get_pill_info'):
+            response = requests.post(TEXT_TO_JSON_SERVER, json={'transcript': text}, headers=request_headers())
 
         if response.status_code != 200:
             return jsonify(
@@ -190,20 +182,25 @@ def transcribe_audio():
             #print('event_json_5001' + json.dumps(event_json_5001, indent=4))
 
             merged_json = {**event_json_photo, **event_json_5001}
-            insert(merged_json)
+            stored = insert(merged_json)
         except ValueError:
             return jsonify({'error': 'No se ha podido hacer el merge.'}), 500
+        if 'error' in stored:
+            return jsonify(stored), 400
 
-        return jsonify(merged_json)
+        return jsonify(stored)
 
         # Para probar solo la transcripción
         # return jsonify({"transcript": text})
+    except resilience.CircuitOpen as e:
+        # 🔹 Whisper o Supabase caídos: se falla al instante y el cliente reintenta más tarde
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
     except requests.RequestException as e:
         return jsonify({'error': f'Error en la solicitud al servidor 5001: {str(e)}'}), 500
     except Exception as e:
-        if os.path.exists(file_path):
-            os.remove(file_path)
         return jsonify({'error': f'Error inesperado: {str(e)}'}), 500
+    finally:
+        upload.remove()
 
 
 # 🔹 Ejecutar el servidor Flask en el puerto 5000 si se ejecuta directamente este script
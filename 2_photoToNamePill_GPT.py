@@ -1,39 +1,43 @@
 import base64
-import datetime
 import json
 import os
 import re
 
-import magic
-from dotenv import load_dotenv
-from flasgger import Swagger
-from flask import Flask, request, jsonify
+from flask import request, jsonify
 from flask_httpauth import HTTPTokenAuth
-from openai import OpenAI as openai
 from werkzeug.utils import secure_filename
 
-# Ruta donde se guardarán los archivos JSON
-JSON_FOLDER = "json_files"
-os.makedirs(JSON_FOLDER, exist_ok=True)  # Crea la carpeta si no existe
-
-from cropPhoto import addCroppedPhoto
-
-# Load environment variables
-load_dotenv()
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+import auditLog
+import cropPhoto
+import imagePool
+import instrumentation
+import localOcr
+import prompts
+import resilience
+import uploadStream
+from appFactory import create_app, openai_client
+from instrumentation import timer
+from singleFlight import SingleFlight
+
+client = openai_client()
+
+# 🔹 Tamaño máximo de cada foto y de la petición completa (antes no había límite)
+MAX_IMAGE_BYTES = int(os.getenv('MAX_IMAGE_BYTES', str(10 * 1024 * 1024)))
+PHOTO_LIMIT = uploadStream.FieldLimit(MAX_IMAGE_BYTES, uploadStream.IMAGE_KINDS)
+
+# Flask setup (carga el .env, Swagger, /metrics y perfilado; precarga OpenAI y OpenCV en segundo plano)
+app = create_app(__name__, 'photo_to_name', upload_folder='uploads', max_content_length=25 * 1024 * 1024,
+                 warm=(client, cropPhoto.cv2, cropPhoto.np))
 API_TOKEN = os.getenv('API_TOKEN')
 
-client = openai(api_key=OPENAI_API_KEY)
-
-# Flask setup
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads'
+# 🔹 'tiered': OCR local sobre la caja recortada y modelo de visión solo si no hay confianza suficiente
+#    'model': siempre el modelo de visión
+EXTRACTION_MODE = os.getenv('EXTRACTION_MODE', 'tiered')
+ocr_stats = {'hit': 0, 'miss': 0, 'error': 0}
 
-# Crear carpeta de subida si no existe
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-swagger = Swagger(app)
 auth = HTTPTokenAuth(scheme='Bearer')
+img_to_text_flight = SingleFlight('img_to_text')
+VISION = resilience.upstream('openai_vision')
 
 @auth.verify_token
 def verify_token(token):
@@ -77,105 +81,180 @@ def format_event():
         description: Error interno del servidor al procesar la imagen
     """
 
-    if 'photo' not in request.files:
-        return jsonify({"error": "No se ha proporcionado una imagen en la solicitud."}), 400
-
-    image = request.files['photo']
-    if image.filename == '':
-        return jsonify({'error': 'El archivo de imagen está vacío'}), 400
-
-    img_b64_str = image_to_base64(image)
-    image.seek(0)
-    mime_type = magic.Magic(mime=True)
-    mime = mime_type.from_buffer(image.read())
-    print(mime)
+    # 🔹 Lectura en streaming: tipo por bytes mágicos y límite de tamaño antes de leer todo el cuerpo
+    try:
+        with timer('upload_parse'):
+            upload = uploadStream.parse(request, {'photo': PHOTO_LIMIT})
+    except uploadStream.UploadRejected as e:
+        return uploadStream.error_response(e)
+    photo = upload.file('photo')
+    image_bytes = photo.data
+
+    # 🔹 Peticiones idénticas concurrentes (doble toque, reintentos) comparten la misma llamada al modelo
+    key = photo.sha256  # calculado mientras llegaba la subida
+    try:
+        payload, status = img_to_text_flight.do(key, extract_medicine_info, image_bytes)
+    except imagePool.PoolSaturated as e:
+        # 🔹 Backpressure: el pool de imágenes está lleno, el cliente reintenta más tarde
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except resilience.CircuitOpen as e:
+        # 🔹 El modelo de visión está fallando: se responde al instante sin llamarlo
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    return jsonify(payload), status
 
-    json_template = json.dumps({
-        "nombre_del_medicamento": "<Nombre>",
-        "numero_de_comprimidos": "<Numero entero>",
-        "cantidad_por_dosis": "<Numero real en mg, solo el numero>"
-    }, indent=4)  # 🔹 Convierte el JSON en un string bien formateado
 
-    # Prepare the prompt
-    prompt = f'''
-        A partir de la siguiente imagen, quiero que me extraigas la siguiente información relevante del medicamento de manera ordenada y la presentes en el siguiente formato JSON:
+# 🔹 Máximo de imágenes y de cajas por imagen en /crop_batch
+CROP_BATCH_MAX_IMAGES = int(os.getenv('CROP_BATCH_MAX_IMAGES', '20'))
+CROP_BATCH_MAX_K = 10
 
-            Nombre del medicamento (ejemplo: Paracetamol)
-            Cantidad de dosis del medicamento: (ejemplo: 50 capsulas, solo el numero)
-            Cantidad de cada dosis (ejemplo: 200mg, siempre lo quiero en miligramos)
 
-        Si alguno de los datos no está disponible o no se menciona explícitamente en la imagen ponlo como null. 
+@app.route('/crop_batch', methods=['POST'])
+@auth.login_required
+def crop_batch():
+    """
+    Recorta varias cajas de medicamento de una o varias fotos (p. ej. todas las cajas sobre una mesa)
+    ---
+    consumes:
+      - multipart/form-data
+    parameters:
+      - name: photos
+        in: formData
+        type: file
+        required: true
+        description: Una o varias imágenes (repetir el campo para cada foto)
+      - name: k
+        in: formData
+        type: integer
+        required: false
+        description: Número máximo de cajas a devolver por imagen (por defecto 1, máximo 10)
+    responses:
+      200:
+        description: >
+          {"results": [{"filename", "crops": [{"box": [x, y, w, h], "score", "cropped_image"}]}]}
+          en el orden de subida; las imágenes que no se pueden leer llevan "error" en lugar de "crops".
+      400:
+        description: Faltan imágenes, hay demasiadas o k no es válido
+    """
+    try:
+        with timer('upload_parse'):
+            upload = uploadStream.parse(request, {'photos': uploadStream.FieldLimit(
+                MAX_IMAGE_BYTES, uploadStream.IMAGE_KINDS, max_files=CROP_BATCH_MAX_IMAGES)})
+    except uploadStream.UploadRejected as e:
+        return uploadStream.error_response(e)
+    photos = upload.files['photos']
+    try:
+        k = int(upload.form.get('k', 1))
+    except ValueError:
+        return jsonify({"error": "k debe ser un número entero."}), 400
+    if not 1 <= k <= CROP_BATCH_MAX_K:
+        return jsonify({"error": f"k debe estar entre 1 y {CROP_BATCH_MAX_K}."}), 400
+    images = [photo.data for photo in photos]
+
+    # 🔹 Las imágenes se reparten entre los workers del pool de imágenes (todos los núcleos)
+    try:
+        with timer('crop_batch'):
+            results = cropPhoto.crop_batch(images, k)
+    except imagePool.PoolSaturated as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    return jsonify({"results": [{"filename": photo.filename, **result} for photo, result in zip(photos, results)]})
 
-        El formato JSON debe ser el siguiente:
-        {json_template}
 
-        Instrucciones adicionales:
+def extract_medicine_info(image_bytes):
+    """
+    Extrae la información del medicamento (OCR local o modelo de visión) y devuelve
+    (payload, status) listo para jsonify.
+    """
+    cropped_b64 = crop_box(image_bytes)
+    img_b64_str = base64.b64encode(image_bytes).decode('utf-8')
 
-    Si no hay información suficiente para completar un campo, ponlo como null.
-    Saca la información exclusivamente de la imagen, no añadas nada de tu propio conocimiento
-    Si un campo no es aplicable o no se menciona, omítelo del JSON.
-    El resultado debe ser exclusivamente el JSON solicitado.
-        '''
+    if EXTRACTION_MODE == 'tiered':
+        event_json_final = ocr_fast_path(cropped_b64 or img_b64_str)
+        if event_json_final is not None:
+            event_json_final["cropped_image"] = cropped_b64
+            audit_id = audit_extraction(event_json_final, "ocr")
+            return {"event_json": event_json_final, "audit_id": audit_id, "source": "ocr"}, 200
 
-    # Convert image to base64
-    #{"type": "image_url","image_url": {"url": f"data:image/jpeg;base64,{img_b64_str}"},},],},
-    
     try:
         # Call the OpenAI API with both image and prompt
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpg;base64,{img_b64_str}"}}
-                    ],
-                },
-            ],
-        )
+        with timer('vision_call'):
+            # 🔹 Hedging: si tarda más que el p95 reciente se lanza un duplicado y gana el primero
+            response = VISION.call(
+                client.chat.completions.create,
+                model=prompts.PHOTO_TO_NAME.model,
+                # 🔹 Prompt precompilado (mismo prefijo en todas las llamadas) y la imagen al final
+                messages=prompts.PHOTO_TO_NAME.messages(image_url=f"data:image/jpg;base64,{img_b64_str}"),
+            )
+        prompts.record_usage(prompts.PHOTO_TO_NAME.name, response)
 
         event_json_str = response.choices[0].message.content
 
         event_json_str_clean = clearJson_1(event_json_str)
 
-        # 🔹 3️⃣ Convertir el string limpio en JSON real
+        # 🔹 3️⃣ Convertir el string limpio en JSON real y añadir la caja recortada
         try:
-            new_event_json_str = addCroppedPhoto(event_json_str_clean, img_b64_str)
-            clean_json = clearJson_2(new_event_json_str)
-            event_json_final = json.loads(clean_json)
+            event_json_final = json.loads(clearJson_2(event_json_str_clean))
+            event_json_final["cropped_image"] = cropped_b64
 
         except json.JSONDecodeError as e:
-            return jsonify({'error': f'JSON inválido generado por OpenAI: {str(e)}', 'raw_output': event_json_final}), 500
+            return {'error': f'JSON inválido generado por OpenAI: {str(e)}', 'raw_output': event_json_str_clean}, 500
 
-        json_filename = save_json_to_file(event_json_final)
+        audit_id = audit_extraction(event_json_final, "model")
 
-        return jsonify({
+        return {
             "event_json": event_json_final,
-            "json_file": json_filename  # Retorna la ubicación del archivo guardado
-        })
+            "audit_id": audit_id,  # Id del registro de auditoría (python auditLog.py show <id>)
+            "source": "model"
+        }, 200
 
+    except resilience.CircuitOpen:
+        raise
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
+
 
+def crop_box(image_bytes):
+    """
+    Recorta la caja del medicamento en el pool de imágenes (fuera del hilo del request);
+    None si no se encuentra. PoolSaturated se propaga para responder 503.
+    """
+    try:
+        with timer('crop'):
+            return imagePool.default_pool().run(cropPhoto.crop_medicine_box, image_bytes)
+    except imagePool.PoolSaturated:
+        raise
     except Exception as e:
-        return jsonify({"error": f"Hubo un error al procesar la imagen: {str(e)}"}), 500
+        print(f"No se pudo recortar la imagen: {e}")
+        return None
+
 
-def save_json_to_file(event_json):
-    """ Guarda el JSON en un archivo dentro de la carpeta json_files. """
+def ocr_fast_path(b64_str):
+    """
+    OCR local de la caja. Devuelve el JSON del medicamento si es fiable o None
+    para recurrir al modelo. Registra la tasa de aciertos en /metrics.
+    """
     try:
-        # Crear un nombre de archivo único usando la fecha y hora
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{JSON_FOLDER}/medicamento_{timestamp}.json"
+        with timer('ocr'):
+            info = localOcr.fast_path(base64.b64decode(b64_str))
+        result = 'hit' if info is not None else 'miss'
+    except Exception as e:
+        print(f"Error en el OCR local: {e}")
+        info, result = None, 'error'
 
-        # Guardar el JSON en el archivo
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(event_json, f, indent=4, ensure_ascii=False)
+    ocr_stats[result] += 1
+    instrumentation.inc('omed_ocr_fast_path_total', result=result)
+    instrumentation.set_gauge('omed_ocr_fast_path_hit_ratio', ocr_stats['hit'] / sum(ocr_stats.values()))
+    return info
 
-        print(f"✅ JSON guardado en {filename}")
-        return filename  # Retornar el nombre del archivo para referencia
+
+def audit_extraction(event_json, source):
+    """
+    Añade la extracción al registro de auditoría (escritura en segundo plano; la imagen
+    recortada se guarda por referencia). Devuelve el id del registro o None.
+    """
+    try:
+        return auditLog.default_log().record('img_to_text', {**event_json, 'source': source})
     except Exception as e:
-        print(f"❌ Error guardando el JSON: {e}")
+        print(f"❌ Error registrando la extracción: {e}")
         return None
 
 
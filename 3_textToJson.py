@@ -2,25 +2,26 @@ import datetime
 import os
 import requests # 🔹 Para hacer la solicitud HTTP al servidor 3_textToJson.py
 
-from flask import Flask, request, jsonify
-from dotenv import load_dotenv
-from openai import OpenAI
-from flasgger import Swagger
+from flask import request, jsonify
 from flask_httpauth import HTTPTokenAuth
 import json
 import re
 
-# Cargar variables de entorno
-load_dotenv()
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-API_TOKEN = os.getenv('API_TOKEN')
+import frequencyParser
+import prompts
+import resilience
+from appFactory import create_app, openai_client
+from instrumentation import inc, timer
+from singleFlight import SingleFlight, content_key
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = openai_client()
 
-# Configuración de Flask
-app = Flask(__name__)
-swagger = Swagger(app)
+# Configuración de Flask (carga el .env, Swagger, /metrics y perfilado)
+app = create_app(__name__, 'text_to_json', warm=(client,))
+API_TOKEN = os.getenv('API_TOKEN')
 auth = HTTPTokenAuth(scheme='Bearer')
+pill_info_flight = SingleFlight('getPillInfo')
+CHAT = resilience.upstream('openai_chat')
 
 @auth.verify_token
 def verify_token(token):
@@ -64,51 +65,41 @@ def getPillInfo():
         return jsonify({'error': 'No se proporcionó la transcripción.'}), 400
 
     # Obtener la fecha de hoy en formato "YYYY-MM-DD"
-    today_date = datetime.date.today().isoformat()
-
-    json_template = json.dumps({
-            "event_json": {
-                "frecuencia": "<horas entre cada ingestion (poner solo el número en horas)>",
-                "primera_ingestion": "<Fecha y hora de la primera toma (en formato local date time)>",
-                "parte_afectada": "<Parte del cuerpo afectada (clasificado en uno de estos: HEART_RELATED, DIGESTIVE, GENERAL_BODY, BRAIN_RELATED, PSYCHOLOGICAL)>"
-            }
-    }, indent=4)  # 🔹 Convierte el JSON en un string bien formateado
-
-    today_date = datetime.date.today().isoformat()
-
-    prompt = f'''
-    A partir del siguiente texto de transcripción de un paciente, extrae la siguiente información y devuelve un JSON con estos campos:
-    
-    1. **Frecuencia**: Cada vez que debe tomar la pastilla. Si te dice dos veces al dia será cada 12 horas o si te dice 3 veces al dia serán 8 horas).
-    2. **Día y hora de primera ingestión**: Fecha y hora en formato "DD/MM/YYYY HH:MM" si está disponible, o solo "DD/MM/YYYY". Para referirse a este punto, la transcripción puede decir frases como "Empezaré..." "La primera pastilla la tomaré...". En resumen toda frase que implique empezar a tomar las pastillas seguidas de una fecha. Ten en cuenta que hoy es {today_date}
-    3. **Parte del cuerpo afectada**: Indicar la parte del cuerpo a la que se refiere el medicamento. Es importante que se meta en alguna de estas categorías:**
-    - HEART_RELATED
-    - DIGESTIVE
-    - GENERAL_BODY
-    - BRAIN_RELATED
-    - PSYCHOLOGICAL
-    
-    **Notas importantes:**
-    - La transcripción proviene de personas mayores o con dificultades de accesibilidad, por lo que el audio puede tener errores.
-    - Si no es posible extraer la información de un campo, devuelve "null_NoEspecify" en su lugar, excepto en "Parte del cuerpo afectada", que hay que poner "GENERAL_BODY"".
-    - Extrae exclusivamente la información mencionada en el audio sin añadir suposiciones.
-    - Devuelve **únicamente** un JSON válido con la estructura especificada.
-    
-    Plantilla de JSON esperado:
-    {json_template}
-    
-    **Texto de transcripción:**
-    "{transcript}"
-    '''
+    today = datetime.date.today()
+    today_date = today.isoformat()
+
+    # 🔹 Las frases habituales ("cada 8 horas, empiezo mañana a las 9") se resuelven sin modelo
+    if os.getenv('TRANSCRIPT_PARSER', 'on') != 'off':
+        with timer('rule_parser'):
+            parsed = frequencyParser.parse(transcript, today)
+        if parsed.confidence >= frequencyParser.MIN_CONFIDENCE:
+            inc('omed_rule_parser_total', result='hit')
+            return jsonify(parsed.as_response()), 200
+        inc('omed_rule_parser_total', result='fallback')
+
+    # 🔹 Transcripciones idénticas concurrentes comparten la misma llamada al modelo
+    key = content_key(transcript, today_date)
+    try:
+        payload, status = pill_info_flight.do(key, extract_event, transcript, today_date)
+    except resilience.CircuitOpen as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    return jsonify(payload), status
 
+
+def extract_event(transcript, today_date):
+    """
+    Llama al modelo de texto con la transcripción y devuelve (payload, status) listo para jsonify.
+    """
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Eres un asistente experto en interpretar instrucciones médicas de reconocimientode medicamentos desde transcripciones de audio. Tienes que tener en cuenta que el audio lo realiza una "},
-                {"role": "user", "content": prompt}
-            ]
-        )
+        with timer('text_extraction'):
+            # 🔹 Hedging y circuit breaker del modelo de texto
+            response = CHAT.call(
+                client.chat.completions.create,
+                model=prompts.TEXT_TO_JSON.model,
+                # 🔹 Instrucciones fijas primero (prefijo cacheable), fecha y transcripción al final
+                messages=prompts.TEXT_TO_JSON.messages(today_date=today_date, transcript=transcript)
+            )
+        prompts.record_usage(prompts.TEXT_TO_JSON.name, response)
 
         event_json = response.choices[0].message.content
         # 🔹 1️⃣ Eliminar los bloques ```json ... ```
@@ -119,15 +110,16 @@ def getPillInfo():
         # 🔹 3️⃣ Convertir el string limpio en JSON real
         try:
             event_json = json.loads(clean_json_str)
-            print('Output' + json.dumps(event_json, indent=4))
         except json.JSONDecodeError as e:
-            return jsonify({'error': f'JSON inválido generado por OpenAI: {str(e)}', 'raw_output': clean_json_str}), 500
+            return {'error': f'JSON inválido generado por OpenAI: {str(e)}', 'raw_output': clean_json_str}, 500
 
 
-        return jsonify(event_json)
+        return event_json, 200
 
+    except resilience.CircuitOpen:
+        raise
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
 
 
 if __name__ == '__main__':
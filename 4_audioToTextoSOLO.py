@@ -1,38 +1,30 @@
+import json
 import os  # Manejo del sistema de archivos y rutas
-from flask import Flask, request, jsonify  # Framework web Flask para manejar peticiones HTTP
-from werkzeug.utils import secure_filename  # Función para asegurar nombres de archivos válidos
-from dotenv import load_dotenv  # Manejo de variables de entorno
-from openai import OpenAI  # Cliente para interactuar con la API de OpenAI
-from flasgger import Swagger  # Generación automática de documentación con API Docs
+from flask import Response, request, jsonify, stream_with_context  # Framework web Flask para manejar peticiones HTTP
 from flask_httpauth import HTTPTokenAuth  # Manejo de autenticación basada en tokens
 
-# 🔹 Cargar variables de entorno desde un archivo .env
-load_dotenv()
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')  # Clave de API de OpenAI
+import chunkedWhisper  # Transcripción por trozos en paralelo para audios largos
+from appFactory import create_app, openai_client  # App Flask común y cliente perezoso de OpenAI
+from instrumentation import timer  # Métricas de latencia por etapa
+import resilience  # Circuit breaker de Whisper (CircuitOpen -> 503)
+import transcriptionCache  # Transcripciones ya hechas por hash (o huella) del audio
+import uploadStream  # Subidas en streaming con validación temprana
+
+# 🔹 Cliente de OpenAI: se construye en el primer uso (o en la precarga en segundo plano)
+client = openai_client()
+
+# 🔹 Configuración de Flask (carga el .env, Swagger, /metrics y perfilado)
+app = create_app(__name__, 'audio_to_text',
+                 upload_folder='uploads',  # Carpeta donde se guardarán temporalmente los archivos subidos
+                 max_content_length=25 * 1024 * 1024,  # Límite de tamaño de archivo: 25 MB
+                 warm=(client,))
 API_TOKEN = os.getenv('API_TOKEN')  # Token de autenticación para proteger la API
 
-# 🔹 Inicializar cliente de OpenAI con la clave de API cargada
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-# 🔹 Configuración de Flask
-app = Flask(__name__)  # Inicializa la aplicación Flask
-app.config['UPLOAD_FOLDER'] = 'uploads'  # Carpeta donde se guardarán temporalmente los archivos subidos
-app.config['MAX_CONTENT_LENGTH'] = 25 * 1024 * 1024  # Límite de tamaño de archivo: 25 MB
-
-# 🔹 Crea la carpeta de almacenamiento de archivos si no existe
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-# 🔹 Configurar Swagger para generar documentación de la API
-swagger = Swagger(app)
-
 # 🔹 Definir las extensiones de archivo permitidas para la subida de audios
 ALLOWED_EXTENSIONS = {'mp3', 'wav', 'm4a', 'ogg'}
-
-def allowed_file(filename):
-    """
-    Verifica si el archivo tiene una extensión permitida.
-    """
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+# 🔹 Límite y tipos (bytes mágicos) del audio; se guarda en disco mientras llega
+AUDIO_LIMIT = uploadStream.FieldLimit(20 * 1024 * 1024, uploadStream.AUDIO_KINDS, to_disk=True,
+                                      extensions=ALLOWED_EXTENSIONS)
 
 # 🔹 Definir el endpoint para la transcripción de audio
 @app.route('/transcribe', methods=['POST'])
@@ -65,43 +57,99 @@ def transcribe_audio():
       500:
         description: Error interno del servidor
     """
-    # 🔹 Verificar si el archivo ha sido enviado en la petición
-    if 'audio' not in request.files:
-        return jsonify({'error': 'No se encontró el archivo de audio.'}), 400
-
-    audio_file = request.files['audio']  # Obtener el archivo desde la solicitud HTTP
-
-    # 🔹 Verificar si el archivo tiene un nombre válido
-    if audio_file.filename == '':
-        return jsonify({'error': 'El nombre del archivo está vacío.'}), 400
-
-    # 🔹 Verificar si el archivo tiene una extensión permitida
-    if not allowed_file(audio_file.filename):
-        return jsonify({'error': 'Formato de archivo no permitido. Solo se permiten MP3, WAV, M4A y OGG.'}), 400
-
-    # 🔹 Guardar el archivo de manera segura en el directorio de almacenamiento temporal
-    filename = secure_filename(audio_file.filename)
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    audio_file.save(file_path)
+    audio, error = save_audio()
+    if error:
+        return error
+    file_path = audio.path
 
     try:
-        # 🔹 Abrir el archivo y enviarlo a OpenAI Whisper para su transcripción
-        with open(file_path, 'rb') as audio:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1",  # Modelo de OpenAI para transcripción de audio
-                file=audio  # Archivo de audio a transcribir
-            )
-
-        # 🔹 Eliminar el archivo después de la transcripción para ahorrar espacio
-        os.remove(file_path)
+        # 🔹 Enviar el audio a OpenAI Whisper (entero o por trozos en paralelo), salvo si ya está en caché
+        with timer('whisper'):
+            text = transcriptionCache.transcribe(client, file_path, audio.sha256)
 
         # 🔹 Retornar el texto transcrito como respuesta en formato JSON
-        return jsonify(transcription.text)
+        return jsonify(text)
 
+    except resilience.CircuitOpen as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
-        # 🔹 Si ocurre un error, eliminar el archivo temporal y devolver un mensaje de error
-        os.remove(file_path)
         return jsonify({'error': str(e)}), 500
+    finally:
+        # 🔹 Eliminar el archivo después de la transcripción para ahorrar espacio
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+@app.route('/transcribe/stream', methods=['POST'])
+def transcribe_audio_stream():
+    """
+    Transcribe un audio por trozos y envía las transcripciones parciales por SSE.
+    ---
+    consumes:
+      - multipart/form-data
+    produces:
+      - text/event-stream
+    parameters:
+      - name: audio
+        in: formData
+        type: file
+        required: true
+        description: Archivo de audio (MP3, WAV, M4A, OGG)
+    responses:
+      200:
+        description: >
+          Eventos `partial` ({"index", "total", "text", "transcript"}) en orden y un evento
+          final `done` ({"transcript"}), o `error` ({"error"}) si falla la transcripción.
+      400:
+        description: Error de validación (archivo incorrecto o faltante)
+    """
+    audio, error = save_audio()
+    if error:
+        return error
+    file_path = audio.path
+
+    def events():
+        parts = []
+        try:
+            # 🔹 Ya transcrita (reintento): solo el evento final
+            cached, fingerprint = transcriptionCache.lookup(audio.sha256, file_path)
+            if cached is not None:
+                yield sse('done', {'transcript': cached})
+                return
+            with timer('whisper'):
+                for index, text, total in chunkedWhisper.iter_transcribe(client, file_path):
+                    parts.append(text)
+                    yield sse('partial', {'index': index, 'total': total, 'text': text,
+                                          'transcript': chunkedWhisper.stitch(parts)})
+            transcript = chunkedWhisper.stitch(parts)
+            transcriptionCache.store(audio.sha256, transcript, fingerprint)
+            yield sse('done', {'transcript': transcript})
+        except Exception as e:
+            yield sse('error', {'error': str(e)})
+        finally:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def save_audio():
+    """
+    Lee el audio de la petición en streaming (extensión y bytes mágicos comprobados al empezar,
+    límite de tamaño mientras llega) directamente a la carpeta de subida.
+    Devuelve (archivo subido, None) o (None, respuesta de error).
+    """
+    try:
+        with timer('upload_parse'):
+            upload = uploadStream.parse(request, {'audio': AUDIO_LIMIT}, directory=app.config['UPLOAD_FOLDER'])
+    except uploadStream.UploadRejected as e:
+        return None, uploadStream.error_response(e)
+    return upload.file('audio'), None
 
 # 🔹 Ejecutar el servidor Flask en el puerto 5000 si se ejecuta directamente este script
 if __name__ == '__main__':
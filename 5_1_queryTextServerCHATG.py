@@ -2,22 +2,20 @@ import base64
 import os
 from datetime import datetime
 
-from flask import Flask, request, jsonify
-from dotenv import load_dotenv
-from openai import OpenAI
-from flasgger import Swagger
+from flask import request, jsonify
 from flask_httpauth import HTTPTokenAuth
 
-# Cargar variables de entorno
-load_dotenv()
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-API_TOKEN = os.getenv('API_TOKEN')
+import compactSchedule
+import franjas
+import prompts
+from appFactory import create_app, openai_client
+from instrumentation import timer
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = openai_client()
 
-# Configuración de Flask
-app = Flask(__name__)
-swagger = Swagger(app)
+# Configuración de Flask (carga el .env, Swagger, /metrics y perfilado)
+app = create_app(__name__, 'day_summary', warm=(client,))
+API_TOKEN = os.getenv('API_TOKEN')
 auth = HTTPTokenAuth(scheme='Bearer')
 
 @auth.verify_token
@@ -38,7 +36,9 @@ def getDayInfo():
           properties:
             schedule:
               type: object
-              description: JSON con las tomas de medicamentos por franja horaria
+              description: >
+                JSON con las tomas de medicamentos por franja horaria, completo o en el formato
+                compacto de /medicamentos?format=compact
     responses:
       200:
         description: Resumen del día generado correctamente
@@ -50,11 +50,19 @@ def getDayInfo():
         return jsonify({"error": "No se encontró la clave 'schedule' en la solicitud."}), 400
 
     schedule = data["schedule"]
+    # 🔹 Se acepta directamente el formato compacto de /medicamentos?format=compact
+    if compactSchedule.is_compact(schedule):
+        try:
+            schedule = compactSchedule.expand(schedule)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
     # Generar un resumen estructurado para OpenAI
     summary_text = "**Resumen del Día**\n\n"
 
-    for franja, tomas in schedule.items():
+    # 🔹 Franjas en orden cronológico (el JSON de /medicamentos llega ordenado alfabéticamente)
+    for franja in sorted(schedule, key=franjas.DEFAULT_TABLE.sort_key):
+        tomas = schedule[franja]
         if tomas:
             summary_text += f"**{franja.replace('_', ' ').title()}**\n"
             for toma in tomas:
@@ -67,40 +75,32 @@ def getDayInfo():
                 )
 
     hour = datetime.now().strftime("%H:%M")
-    print(hour)
-    # Generar `prompt` para OpenAI
-    prompt = f"""
-    A partir del siguiente listado de tomas de medicamentos del día de hoy, genera un texto sencillo hablando sobre los medicamentos del dia de hoy a modo de resumen para el paciente. Quiero que hagas alusion unicamente a que pastillas que va a tomar y brevemente a su propósito. No hace falta que hables de las dosis distante y refiere al paciente como su nombre de ser necesario. Tambien  quiero que hagas alusion al dia como algo que va a ocurrir, por ello solo habla de las pastillas que ocurran luego de la hora actual: {hour}
-
-    {summary_text}
-    """
-
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system",
-                 "content": "Eres un asistente experto en salud y bienestar con confianza como para tutear a tus pacientes. Hablas correctamente y formal"},
-                {"role": "user", "content": prompt}
-            ]
-        )
+        with timer('summary_call'):
+            response = client.chat.completions.create(
+                model=prompts.DAY_SUMMARY.model,
+                # 🔹 Instrucciones fijas primero (prefijo cacheable), hora y horario al final
+                messages=prompts.DAY_SUMMARY.messages(hour=hour, summary_text=summary_text)
+            )
+        prompts.record_usage(prompts.DAY_SUMMARY.name, response)
 
         resume = response.choices[0].message.content
 
         # Intentar generar audio con OpenAI TTS
-        try:
-            tts_response = client.audio.speech.create(
-                model="tts-1",
-                voice="alloy",
-                input=resume
-            )
-        except Exception as e:
-            print(f"Error con tts-1: {e}, intentando con tts-1-hd")
-            tts_response = client.audio.speech.create(
-                model="tts-1-hd",
-                voice="alloy",
-                input=resume
-            )
+        with timer('tts'):
+            try:
+                tts_response = client.audio.speech.create(
+                    model="tts-1",
+                    voice="alloy",
+                    input=resume
+                )
+            except Exception as e:
+                print(f"Error con tts-1: {e}, intentando con tts-1-hd")
+                tts_response = client.audio.speech.create(
+                    model="tts-1-hd",
+                    voice="alloy",
+                    input=resume
+                )
 
         # Guardar audio en un archivo temporal
         audio_file = "output_audio.mp3"
@@ -111,10 +111,12 @@ def getDayInfo():
         with open(audio_file, "rb") as f:
             audio_base64 = base64.b64encode(f.read()).decode('utf-8')
 
-        return jsonify({"summary": resume, "audio_base64": audio_base64})
+        return compactSchedule.compress_response(jsonify({"summary": resume, "audio_base64": audio_base64}),
+                                                 request.headers.get('Accept-Encoding'))
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# 🔹 Puerto 5007: el 5000 lo usa 1_audioToText.py (en producción: python serve.py day_summary)
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    app.run(debug=True, port=5007)
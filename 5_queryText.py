@@ -1,42 +1,41 @@
-from supabase import create_client
-import os
-from dotenv import load_dotenv
-from flask import Flask, jsonify
-from flasgger import Swagger
+from flask import jsonify, request
 
-# Cargar credenciales de Supabase
-load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+import compactSchedule
+import franjas
+import replica
+import resilience
+from appFactory import create_app, supabase_client
+from instrumentation import timer
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Cliente de Supabase (credenciales del .env, se construye en el primer uso)
+supabase = supabase_client()
 
 # Configuración de Flask
-app = Flask(__name__)
-swagger = Swagger(app)
-
-# 🔹 Definimos las franjas horarias según lo solicitado
-FRANJAS_HORARIAS = {
-    "JUSTAWAKE": ("06:00:00", "07:00:00"),
-    "BEFOREBREAKFAST": ("07:00:00", "08:00:00"),
-    "AFTERBREAKFAST": ("08:00:00", "10:30:00"),
-    "MIDDAY": ("10:30:00", "12:30:00"),
-    "BEFORELUNCH": ("12:30:00", "13:30:00"),
-    "AFTERLUNCH": ("13:30:00", "15:30:00"),
-    "MIDAFTERNOON": ("15:30:00", "17:30:00"),
-    "BEFOREDINNER": ("17:30:00", "19:30:00"),
-    "AFTERDINNER": ("19:30:00", "21:30:00"),
-    "PREVIOUSTOSLEEP": ("21:    30:00", "23:59:59"),
-}
+app = create_app(__name__, 'query_text', warm=(supabase,))
+
+# 🔹 Franjas horarias: definidas y validadas en franjas.py (intervalos [inicio, fin), configurables por paciente)
+FRANJAS_HORARIAS = franjas.DEFAULT_FRANJAS
+DIA_COMPLETO = ("00:00:00", "24:00:00")
+# 🔹 Lectura idempotente: timeout, hedging tras el p95 y circuit breaker
+SUPABASE_READ = resilience.upstream('supabase_read')
+# 🔹 REPLICA=sqlite: las tomas se calculan en una réplica local sincronizada en segundo plano
+REPLICA = replica.default_replica(supabase) if replica.MODE == 'sqlite' else None
 
 # 🔹 Función para llamar a Supabase y obtener los medicamentos por franja
-def get_medicamentos_por_franja(franja_inicio, franja_fin):
+def get_medicamentos_por_franja(franja_inicio, franja_fin, paciente=None):
+    if REPLICA is not None and REPLICA.ready:
+        # Microsegundos y sin depender de que Supabase responda (sirve lo último sincronizado)
+        with timer('replica_tomas_por_franja'):
+            return REPLICA.tomas_por_franja(franja_inicio, franja_fin, paciente=paciente)
     try:
-        response = supabase.rpc("get_tomas_por_franja", {
-            "start_time": franja_inicio,
-            "end_time": franja_fin
-        }).execute()
+        with timer('rpc_get_tomas_por_franja'):
+            response = SUPABASE_READ.call(supabase.rpc("get_tomas_por_franja", {
+                "start_time": franja_inicio,
+                "end_time": franja_fin
+            }).execute)
         return response.data  # ✅ Retornamos solo los datos sin metadatos extra
+    except resilience.CircuitOpen:
+        raise
     except Exception as e:
         return {"error": f"Error al ejecutar Supabase RPC: {str(e)}"}
 
@@ -46,16 +45,46 @@ def get_medicamentos():
     """
     Obtiene los medicamentos según la franja horaria definida.
     ---
+    parameters:
+      - name: paciente
+        in: query
+        type: string
+        required: false
+        description: Solo las tomas de este paciente (con sus franjas si tiene configuración propia)
+      - name: format
+        in: query
+        type: string
+        enum: [full, compact]
+        required: false
+        description: compact envía la tabla de medicamentos una vez y por franja [med_id, hora_toma, dosis_restantes]
     responses:
       200:
         description: Retorna los medicamentos organizados por franja horaria
+      500:
+        description: Error al consultar Supabase
+      503:
+        description: Supabase no disponible (circuito abierto), con cabecera Retry-After
     """
-    resultado = {}
+    # 🔹 Una sola llamada con todas las tomas del día; se agrupan aquí por franja (bisect)
+    paciente = request.args.get('paciente')
+    try:
+        tomas = get_medicamentos_por_franja(*DIA_COMPLETO, paciente=paciente)
+    except resilience.CircuitOpen as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    if isinstance(tomas, dict) and "error" in tomas:
+        return jsonify(tomas), 500
+
+    with timer('bucket_franjas'):
+        if paciente:
+            resultado = franjas.table_for(paciente).bucket(t for t in tomas or [] if t.get('paciente') == paciente)
+        else:
+            resultado = franjas.bucket_by_patient(tomas or [])
 
-    for franja, (inicio, fin) in FRANJAS_HORARIAS.items():
-        resultado[franja] = get_medicamentos_por_franja(inicio, fin)
+    # 🔹 ?format=compact: tabla de medicamentos una sola vez y [med_id, hora, restantes] por franja
+    if request.args.get('format') == 'compact':
+        resultado = compactSchedule.compact(resultado)
 
-    return jsonify(resultado)
+    return compactSchedule.compress_response(jsonify(resultado), request.headers.get('Accept-Encoding'))
 
 # 🔹 Iniciar servidor Flask
 if __name__ == '__main__':
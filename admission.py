@@ -0,0 +1,338 @@
+"""
+Control de admisión de los requests de cada servicio.
+
+Cada servicio corre en su propio proceso (y con varios workers, en varios), así que las
+lecturas interactivas (/resumeDay, /medicamentos) y las subidas por lotes (/transcribe,
+/crop_batch) nunca comparten una cola en memoria. Lo que sí comparten es la máquina: la cuota
+de OpenAI y la CPU. Por eso hay dos niveles:
+
+- En el host: HOST_ROUTES (las entradas que llaman a OpenAI o recortan imágenes) piden uno de
+  ADMISSION_HOST_SLOTS huecos comunes a todos los procesos (un flock por hueco en
+  ADMISSION_HOST_DIR; si el proceso muere, el sistema lo libera). Las rutas interactivas
+  pueden usar todos; las demás dejan libres ADMISSION_HOST_RESERVED, así que una ráfaga de
+  subidas nunca deja a /resumeDay sin hueco. Es prioridad por reserva, no una cola ordenada.
+- En el proceso: límite por ruta para las subidas pesadas (ADMISSION_LIMITS="/transcribe=2,/crop_batch=1",
+  por defecto la mitad de los hilos) y, solo si se indica ADMISSION_CAPACITY, una capacidad
+  total por debajo de los hilos del servidor (con la capacidad igual a los hilos nunca hay cola:
+  los requests de más esperan en el servidor, antes de llegar a Flask).
+
+Si la espera supera el plazo de su prioridad (más corto para las subidas) o la cola de esa
+prioridad está llena, se descarta con 503 y Retry-After en lugar de dejarlo esperando.
+/metrics publica la profundidad de la cola, los requests en curso, la espera y los descartes.
+
+Las llamadas internas (/img_to_text, /getPillInfo desde /transcribe) no piden hueco en el host:
+las hace un request que ya tiene el suyo y, si esperasen, podrían bloquearse entre sí.
+"""
+import bisect
+import itertools
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows (serve.py --server waitress): sin huecos de host
+    fcntl = None
+
+import instrumentation
+
+ENABLED = os.getenv('ADMISSION', 'on') != 'off'
+# 🔹 0 = sin capacidad total en el proceso (la limita el número de hilos del servidor)
+CAPACITY = int(os.getenv('ADMISSION_CAPACITY', '0'))
+THREADS = int(os.getenv('ADMISSION_THREADS', os.getenv('OMED_THREADS', '8')))  # concurrencia por worker
+
+INTERACTIVE, DEFAULT, BATCH = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', DEFAULT: 'default', BATCH: 'batch'}
+
+PRIORITIES = {
+    '/medicamentos': INTERACTIVE,
+    '/resumeDay': INTERACTIVE,
+    '/transcribe': BATCH,
+    '/transcribe/stream': BATCH,
+    '/crop_batch': BATCH,
+}
+# 🔹 Espera máxima en cola (s): mejor descartar una subida que hacer esperar al paciente
+DEADLINES = {
+    INTERACTIVE: float(os.getenv('ADMISSION_DEADLINE_INTERACTIVE', '10')),
+    DEFAULT: float(os.getenv('ADMISSION_DEADLINE_DEFAULT', '5')),
+    BATCH: float(os.getenv('ADMISSION_DEADLINE_BATCH', '2')),
+}
+# 🔹 Máximo de requests esperando por prioridad (más allá se descarta sin esperar). Con workers
+# de hilos cada request en cola ocupa un hilo: pocas subidas en espera dejan hilos a las lecturas
+MAX_QUEUE = {
+    INTERACTIVE: int(os.getenv('ADMISSION_MAX_QUEUE', '64')),
+    DEFAULT: int(os.getenv('ADMISSION_MAX_QUEUE', '64')),
+    BATCH: int(os.getenv('ADMISSION_MAX_QUEUE_BATCH', '2')),
+}
+RETRY_AFTER = {INTERACTIVE: 1, DEFAULT: 2, BATCH: 5}
+
+# 🔹 Huecos compartidos por todos los servicios de la máquina (0 los desactiva)
+HOST_SLOTS = int(os.getenv('ADMISSION_HOST_SLOTS', '8'))
+HOST_RESERVED = int(os.getenv('ADMISSION_HOST_RESERVED', '2'))
+HOST_DIR = os.getenv('ADMISSION_HOST_DIR', os.path.join(tempfile.gettempdir(), 'omed-admission'))
+HOST_ROUTES = ('/transcribe', '/transcribe/stream', '/resumeDay', '/crop_batch')
+HOST_POLL_SECONDS = 0.02
+# 🔹 Rutas que nunca esperan (métricas y documentación)
+EXEMPT_PREFIXES = ('/metrics', '/apidocs', '/apispec', '/flasgger_static')
+
+
+def _parse_limits(value):
+    """ "/transcribe=2,/crop_batch=1" -> {'/transcribe': 2, '/crop_batch': 1}. """
+    limits = {}
+    for item in (value or '').split(','):
+        route, _, limit = item.strip().partition('=')
+        if route and limit:
+            limits[route.strip()] = int(limit)
+    return limits
+
+
+def default_limits(capacity=CAPACITY):
+    """ Las rutas por lotes pueden ocupar como mucho la mitad de la capacidad (o de los hilos). """
+    limits = {route: max(1, (capacity or THREADS) // 2) for route, priority in PRIORITIES.items() if priority == BATCH}
+    limits.update(_parse_limits(os.getenv('ADMISSION_LIMITS')))
+    return limits
+
+
+class Shed(Exception):
+    """ El request se descarta (cola llena o plazo de espera superado). """
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('route', 'priority', 'admitted')
+
+    def __init__(self, route, priority):
+        self.route = route
+        self.priority = priority
+        self.admitted = False
+
+
+class AdmissionController:
+    def __init__(self, capacity=CAPACITY, limits=None, priorities=None, deadlines=None,
+                 max_queue=None, clock=time.monotonic):
+        self.capacity = capacity or float('inf')
+        self.limits = default_limits(capacity) if limits is None else limits
+        self.priorities = PRIORITIES if priorities is None else priorities
+        self.deadlines = DEADLINES if deadlines is None else deadlines
+        self.max_queue = MAX_QUEUE if max_queue is None else max_queue
+        self.clock = clock
+        self.active = 0
+        self.active_by_route = {}
+        self._queue = []  # [(prioridad, orden de llegada, _Waiter)] ordenada
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def priority_for(self, route):
+        return self.priorities.get(route, DEFAULT)
+
+    def _fits(self, route):
+        return self.active < self.capacity and \
+            self.active_by_route.get(route, 0) < self.limits.get(route, self.capacity)
+
+    def _take(self, route):
+        self.active += 1
+        self.active_by_route[route] = self.active_by_route.get(route, 0) + 1
+
+    def _dispatch(self):
+        """
+        Admite, en orden de prioridad, a los que esperan y caben. Un request que no cabe por el
+        límite de su ruta no bloquea a los de otras rutas que vienen detrás.
+        """
+        admitted = False
+        for entry in list(self._queue):
+            if self.active >= self.capacity:
+                break
+            waiter = entry[2]
+            if self._fits(waiter.route):
+                self._queue.remove(entry)
+                self._take(waiter.route)
+                waiter.admitted = True
+                admitted = True
+        if admitted:
+            self._cond.notify_all()
+
+    def acquire(self, route):
+        """
+        Espera un hueco para `route` y devuelve los segundos de espera; lanza Shed si la cola
+        de su prioridad está llena o se supera el plazo.
+        """
+        priority = self.priority_for(route)
+        with self._cond:
+            # 🔹 Los que esperan no caben (se admiten en cuanto se libera un hueco), así que
+            # si este cabe no se está colando por delante de nadie
+            if self._fits(route):
+                self._take(route)
+                return 0.0
+            if sum(1 for entry in self._queue if entry[0] == priority) >= self.max_queue.get(priority, 0):
+                raise Shed(f'Servicio saturado: cola {PRIORITY_NAMES[priority]} llena.', RETRY_AFTER[priority])
+
+            waiter = _Waiter(route, priority)
+            entry = (priority, next(self._seq), waiter)
+            bisect.insort(self._queue, entry)  # el orden de llegada es único: no se comparan los _Waiter
+            start = self.clock()
+            deadline = start + self.deadlines.get(priority, DEADLINES[DEFAULT])
+            while not waiter.admitted:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    self._queue.remove(entry)
+                    self._dispatch()  # puede haber hueco para otra ruta detrás
+                    raise Shed(f'Servicio saturado: {self.clock() - start:.1f} s en cola.',
+                               RETRY_AFTER[priority])
+                self._cond.wait(remaining)
+            return self.clock() - start
+
+    def release(self, route):
+        with self._cond:
+            self.active -= 1
+            self.active_by_route[route] -= 1
+            self._dispatch()
+
+    def queue_depth(self):
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _, _ in self._queue:
+                depth[PRIORITY_NAMES[priority]] += 1
+            return depth
+
+
+class HostSlots:
+    """
+    Semáforo de la máquina: `capacity` ficheros de bloqueo y un flock exclusivo por hueco ocupado.
+    Los requests interactivos pueden usar todos los huecos (empiezan por los reservados); el
+    resto solo los `capacity - reserved` primeros. Se espera sondeando cada HOST_POLL_SECONDS.
+    """
+
+    def __init__(self, directory=HOST_DIR, capacity=HOST_SLOTS, reserved=HOST_RESERVED,
+                 poll=HOST_POLL_SECONDS, clock=time.monotonic):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.capacity = capacity
+        self.reserved = min(reserved, capacity - 1)
+        self.poll = poll
+        self.clock = clock
+        self.held = 0  # huecos ocupados por este proceso
+        self._held_lock = threading.Lock()
+
+    def _slots(self, priority):
+        if priority == INTERACTIVE:
+            return range(self.capacity - 1, -1, -1)
+        return range(self.capacity - self.reserved)
+
+    def _try(self, slot):
+        fd = os.open(os.path.join(self.directory, f'slot-{slot}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def acquire(self, priority, timeout):
+        """ Devuelve el descriptor del hueco (para `release`) o lanza Shed al agotar `timeout`. """
+        start = self.clock()
+        while True:
+            for slot in self._slots(priority):
+                fd = self._try(slot)
+                if fd is not None:
+                    with self._held_lock:
+                        self.held += 1
+                    return fd, self.clock() - start
+            if self.clock() - start >= timeout:
+                raise Shed(f'Servicio saturado: sin hueco en la máquina tras {timeout:.1f} s.',
+                           RETRY_AFTER[priority])
+            time.sleep(self.poll)
+
+    def release(self, fd):
+        with self._held_lock:
+            self.held -= 1
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+_controller = None
+_controller_lock = threading.Lock()
+_host_slots = None
+
+
+def default_controller():
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+    return _controller
+
+
+@instrumentation.register_collector
+def _admission_samples():
+    if _controller is None:
+        return []
+    samples = [('omed_admission_queue_depth', {'priority': name}, depth)
+               for name, depth in _controller.queue_depth().items()]
+    samples.append(('omed_admission_active', {}, _controller.active))
+    if _controller.capacity != float('inf'):
+        samples.append(('omed_admission_capacity', {}, _controller.capacity))
+    if _host_slots is not None:
+        samples.append(('omed_admission_host_slots_held', {}, _host_slots.held))
+        samples.append(('omed_admission_host_slots', {}, _host_slots.capacity))
+    return samples
+
+
+def install(app):
+    """
+    Añade el control de admisión a la app Flask (después de instrumentation.install, para que
+    la latencia del request incluya la espera en cola). ADMISSION=off lo desactiva.
+    """
+    if not ENABLED:
+        return app
+    from flask import g, jsonify, request
+
+    global _host_slots
+    controller = default_controller()
+    if HOST_SLOTS > 0 and fcntl is not None and _host_slots is None:
+        _host_slots = HostSlots()
+
+    def _shed(e, rule, priority, level):
+        instrumentation.inc('omed_admission_shed_total', route=rule, priority=priority, level=level)
+        response = jsonify({'error': str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+
+    @app.before_request
+    def _admit():
+        rule = request.url_rule.rule if request.url_rule is not None else request.path
+        if rule.startswith(EXEMPT_PREFIXES):
+            return None
+        level = controller.priority_for(rule)
+        priority = PRIORITY_NAMES[level]
+        try:
+            waited = controller.acquire(rule)
+        except Shed as e:
+            return _shed(e, rule, priority, 'process')
+        g.admission_route = rule
+        if _host_slots is not None and rule in HOST_ROUTES:
+            # 🔹 El plazo de la prioridad cubre las dos esperas
+            try:
+                g.admission_host_slot, host_waited = _host_slots.acquire(
+                    level, max(0.0, controller.deadlines.get(level, DEADLINES[DEFAULT]) - waited))
+            except Shed as e:
+                return _shed(e, rule, priority, 'host')  # teardown libera el hueco del proceso
+            waited += host_waited
+        instrumentation.histogram('omed_admission_queue_wait_seconds', priority=priority).observe(waited)
+        return None
+
+    @app.teardown_request
+    def _release(exc):
+        slot = g.pop('admission_host_slot', None)
+        if slot is not None:
+            _host_slots.release(slot)
+        route = g.pop('admission_route', None)
+        if route is not None:
+            controller.release(route)
+
+    return app
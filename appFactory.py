@@ -0,0 +1,122 @@
+"""
+Fábrica común de las apps Flask de los servicios.
+
+Los servicios se escalan a cero entre ráfagas, así que el arranque en frío importa:
+OpenAI, Supabase, OpenCV y NumPy se cargan de forma perezosa (Lazy) y, si
+OMED_WARMUP no es 0, se precargan en segundo plano justo después de arrancar.
+
+    python appFactory.py photo_to_name     # desglose del tiempo de import/arranque
+"""
+import os
+import sys
+import time
+
+_started = time.perf_counter()
+
+from flask import Flask
+
+import admission
+import instrumentation
+import profiler
+import resilience
+from lazy import IMPORT_TIMES, Lazy, timed_import, warm_in_background
+
+IMPORT_TIMES['import:flask'] = time.perf_counter() - _started
+
+
+def openai_client(timeout=resilience.TIMEOUT, max_retries=0):
+    """
+    Cliente de OpenAI que se construye (e importa `openai`) en el primer uso.
+    Con el timeout de resilience y sin reintentos propios (los hace resilience con hedging):
+    si no, una llamada abandonada por timeout seguiría ocupando un hilo hasta 600 s x 3 intentos.
+    """
+    return Lazy('openai_client', lambda: timed_import('openai').OpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'), timeout=timeout, max_retries=max_retries))
+
+
+def supabase_client(timeout=resilience.TIMEOUT):
+    """ Cliente de Supabase que se construye (e importa `supabase`) en el primer uso, con timeout de PostgREST. """
+    def build():
+        supabase = timed_import('supabase')
+        return supabase.create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'),
+                                      options=supabase.ClientOptions(postgrest_client_timeout=timeout))
+
+    return Lazy('supabase_client', build)
+
+
+def _load_dotenv():
+    try:
+        timed_import('dotenv').load_dotenv()
+    except ImportError:
+        pass
+
+
+@instrumentation.register_collector
+def _import_time_samples():
+    return [('omed_import_seconds', {'target': target}, f'{seconds:.6f}')
+            for target, seconds in sorted(IMPORT_TIMES.items())]
+
+
+def create_app(import_name, service, upload_folder=None, max_content_length=None, warm=()):
+    """
+    Crea la app Flask de un servicio con la configuración común: variables de entorno,
+    carpeta de subida, Swagger, métricas, perfilado y precarga en segundo plano de `warm`.
+    """
+    _load_dotenv()
+
+    app = Flask(import_name)
+    if upload_folder:
+        app.config['UPLOAD_FOLDER'] = upload_folder
+        os.makedirs(upload_folder, exist_ok=True)
+    if max_content_length:
+        app.config['MAX_CONTENT_LENGTH'] = max_content_length
+
+    # 🔹 Flask no permite registrar blueprints después del primer request, así que Swagger
+    # se registra aquí; el spec ya lo genera flasgger bajo demanda. SWAGGER_ENABLED=0 evita el import.
+    if os.getenv('SWAGGER_ENABLED', '1') != '0':
+        start = time.perf_counter()
+        timed_import('flasgger').Swagger(app)
+        IMPORT_TIMES['init:swagger'] = time.perf_counter() - start
+
+    instrumentation.install(app, service)
+    admission.install(app)
+    profiler.install(app)
+
+    if warm and os.getenv('OMED_WARMUP', '1') != '0':
+        warm_in_background(*warm)
+
+    IMPORT_TIMES['startup:create_app'] = time.perf_counter() - _started
+    return app
+
+
+def import_report(service):
+    """
+    Importa un servicio sin precarga y devuelve el desglose de tiempos de arranque.
+    """
+    from services import BASE_DIR, load_service
+
+    os.environ['OMED_WARMUP'] = '0'
+    start = time.perf_counter()
+    load_service(service)
+    total = time.perf_counter() - start
+
+    report = dict(IMPORT_TIMES)
+    report['startup:load_service'] = total
+    # 🔹 Lo que el primer request pagaría si no hay precarga
+    for loaded in list(sys.modules.values()):
+        if not (getattr(loaded, '__file__', None) or '').startswith(BASE_DIR):
+            continue
+        for value in list(vars(loaded).values()):
+            if isinstance(value, Lazy) and not value.loaded:
+                value.warm()
+    for key, seconds in IMPORT_TIMES.items():
+        report.setdefault(key, seconds)
+    return report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('Uso: python appFactory.py <servicio>')
+        sys.exit(1)
+    for target, seconds in sorted(import_report(sys.argv[1]).items(), key=lambda item: -item[1]):
+        print(f'{seconds * 1000:10.1f} ms  {target}')
@@ -0,0 +1,293 @@
+"""
+Registro de auditoría de las extracciones (antes un json_files/medicamento_<ts>.json por petición).
+
+- Un único fichero JSON Lines (AUDIT_DIR/audit.jsonl) en modo append, escrito por un hilo aparte.
+- Al superar AUDIT_MAX_BYTES se rota a audit-<ts>.jsonl.gz; se conservan AUDIT_KEEP ficheros.
+- Las imágenes (base64) se guardan una sola vez en AUDIT_DIR/images/<sha256>.png y el registro
+  solo lleva la referencia "sha256:<hash>". Al borrar ficheros rotados se borran también las
+  imágenes que ya no referencia ningún registro conservado.
+- Los workers de gunicorn comparten el directorio: cada lote (imágenes, append, rotación y
+  limpieza) se escribe con un flock sobre AUDIT_DIR/.lock.
+
+    python auditLog.py query --name lorazepam --source ocr --since 2025-02-01
+    python auditLog.py show <id>
+"""
+import argparse
+import atexit
+import base64
+import contextlib
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows (serve.py --server waitress): un solo proceso, basta con el hilo
+    fcntl = None
+
+import instrumentation
+
+AUDIT_DIR = os.getenv('AUDIT_DIR', 'audit_log')
+AUDIT_MAX_BYTES = int(os.getenv('AUDIT_MAX_BYTES', str(10 * 1024 * 1024)))
+AUDIT_KEEP = int(os.getenv('AUDIT_KEEP', '20'))
+# 🔹 Registros pendientes de escribir; si la cola se llena se descartan (nunca se bloquea el request)
+AUDIT_QUEUE = int(os.getenv('AUDIT_QUEUE', '1000'))
+CURRENT_FILE = 'audit.jsonl'
+LOCK_FILE = '.lock'
+IMAGE_PREFIX = 'sha256:'
+
+
+class AuditLog:
+    def __init__(self, directory=AUDIT_DIR, max_bytes=AUDIT_MAX_BYTES, keep=AUDIT_KEEP, queue_size=AUDIT_QUEUE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    os.makedirs(os.path.join(self.directory, 'images'), exist_ok=True)
+                    self._thread = threading.Thread(target=self._run, name='omed-audit', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def record(self, kind, data, image_fields=('cropped_image',)):
+        """
+        Encola un registro y devuelve su id. Los campos de imagen de `data` se sustituyen
+        por su referencia; la escritura (JSON e imágenes) ocurre en el hilo del registro.
+        """
+        self._start()
+        data = dict(data)
+        images = {}
+        for field in image_fields:
+            value = data.get(field)
+            if isinstance(value, str) and value:
+                digest = hashlib.sha256(value.encode('ascii', 'ignore')).hexdigest()
+                images[digest] = value
+                data[field] = IMAGE_PREFIX + digest
+
+        record_id = uuid.uuid4().hex[:16]
+        entry = {'id': record_id, 'ts': datetime.datetime.now().isoformat(timespec='milliseconds'),
+                 'kind': kind, 'request_id': instrumentation.current_request_id(), 'data': data}
+        try:
+            self._queue.put_nowait((entry, images))
+        except queue.Full:
+            instrumentation.inc('omed_audit_records_total', result='dropped')
+            return None
+        return record_id
+
+    def flush(self, timeout=5.0):
+        """ Espera a que se escriban los registros pendientes. """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+                instrumentation.inc('omed_audit_records_total', len(batch), result='written')
+            except Exception as e:
+                print(f"❌ Error escribiendo el registro de auditoría: {e}")
+                instrumentation.inc('omed_audit_records_total', len(batch), result='error')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        # 🔹 Un lote a la vez entre procesos: nadie rota ni limpia mientras otro escribe
+        with _locked(self.directory):
+            self._write_locked(batch)
+
+    def _write_locked(self, batch):
+        for _, images in batch:
+            for digest, b64 in images.items():
+                path = image_path(digest, self.directory)
+                if not os.path.exists(path):
+                    tmp = f'{path}.tmp'
+                    with open(tmp, 'wb') as f:
+                        f.write(base64.b64decode(b64))
+                    os.replace(tmp, path)
+
+        current = os.path.join(self.directory, CURRENT_FILE)
+        with open(current, 'a', encoding='utf-8') as f:
+            for entry, _ in batch:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+        if os.path.getsize(current) >= self.max_bytes:
+            self._rotate(current)
+
+    def _rotate(self, current):
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        rotated = os.path.join(self.directory, f'audit-{stamp}.jsonl')
+        os.replace(current, rotated)
+        with open(rotated, 'rb') as src, gzip.open(f'{rotated}.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        rotated_files = sorted(glob.glob(os.path.join(self.directory, 'audit-*.jsonl.gz')))
+        old_files = rotated_files[:-self.keep] if self.keep > 0 else []
+        for old in old_files:
+            os.remove(old)
+        if old_files:
+            prune_images(self.directory)
+
+
+@contextlib.contextmanager
+def _locked(directory):
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def image_path(digest, directory=AUDIT_DIR):
+    return os.path.join(directory, 'images', f'{digest}.png')
+
+
+def referenced_images(directory=AUDIT_DIR):
+    """ Hashes de las imágenes que referencia algún registro de los ficheros conservados. """
+    digests = set()
+    for entry in read_records(directory):
+        for value in entry.get('data', {}).values():
+            if isinstance(value, str) and value.startswith(IMAGE_PREFIX):
+                digests.add(value[len(IMAGE_PREFIX):])
+    return digests
+
+
+def prune_images(directory=AUDIT_DIR):
+    """
+    Borra las imágenes que ya no referencia ningún registro conservado (se llama al borrar
+    ficheros rotados, con el lock del directorio; sin esto images/ crecería sin límite).
+    Solo las anteriores al fichero conservado más antiguo: las de los ficheros borrados lo son
+    y una más reciente puede ser de un registro que aún no se ha escrito. Devuelve cuántas se borraron.
+    """
+    files = log_files(directory)
+    if not files:
+        return 0
+    cutoff = os.path.getmtime(files[0])
+    keep = referenced_images(directory)
+    removed = 0
+    for path in glob.glob(os.path.join(directory, 'images', '*.png')):
+        if os.path.basename(path)[:-len('.png')] not in keep and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            removed += 1
+    if removed:
+        instrumentation.inc('omed_audit_images_pruned_total', removed)
+    return removed
+
+
+def log_files(directory=AUDIT_DIR):
+    """ Ficheros del registro del más antiguo al más reciente (los rotados y el actual al final). """
+    files = sorted(glob.glob(os.path.join(directory, 'audit-*.jsonl.gz')))
+    current = os.path.join(directory, CURRENT_FILE)
+    return files + ([current] if os.path.exists(current) else [])
+
+
+def read_records(directory=AUDIT_DIR):
+    for path in log_files(directory):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def query(directory=AUDIT_DIR, since=None, until=None, name=None, source=None, kind=None):
+    """ Registros que cumplen los filtros (fechas ISO, nombre parcial sin mayúsculas). """
+    for entry in read_records(directory):
+        if since and entry['ts'] < since:
+            continue
+        if until and entry['ts'] >= until:
+            continue
+        if kind and entry.get('kind') != kind:
+            continue
+        data = entry.get('data', {})
+        if source and data.get('source') != source:
+            continue
+        if name and name.lower() not in str(data.get('nombre_del_medicamento') or '').lower():
+            continue
+        yield entry
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_log():
+    """ Registro compartido del proceso (AUDIT_DIR). """
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = AuditLog()
+    return _default
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Consulta del registro de auditoría de extracciones.')
+    parser.add_argument('--dir', default=AUDIT_DIR)
+    sub = parser.add_subparsers(dest='command', required=True)
+    q = sub.add_parser('query', help='Lista las extracciones que cumplen los filtros')
+    q.add_argument('--since', help='Fecha/hora ISO mínima (p. ej. 2025-02-01)')
+    q.add_argument('--until', help='Fecha/hora ISO máxima (excluida)')
+    q.add_argument('--name', help='Parte del nombre del medicamento')
+    q.add_argument('--source', choices=['ocr', 'model'])
+    q.add_argument('--kind')
+    q.add_argument('--limit', type=int, default=50, help='Últimos N resultados (0 = todos)')
+    q.add_argument('--json', action='store_true', help='Una línea JSON por registro')
+    s = sub.add_parser('show', help='Muestra un registro completo')
+    s.add_argument('id')
+    args = parser.parse_args(argv)
+
+    if args.command == 'show':
+        for entry in read_records(args.dir):
+            if entry['id'] == args.id:
+                print(json.dumps(entry, indent=4, ensure_ascii=False))
+                for value in entry.get('data', {}).values():
+                    if isinstance(value, str) and value.startswith(IMAGE_PREFIX):
+                        print(f"Imagen: {image_path(value[len(IMAGE_PREFIX):], args.dir)}")
+                return 0
+        print(f'No se encontró el registro {args.id}')
+        return 1
+
+    results = list(query(args.dir, args.since, args.until, args.name, args.source, args.kind))
+    if args.limit:
+        results = results[-args.limit:]
+    for entry in results:
+        if args.json:
+            print(json.dumps(entry, ensure_ascii=False))
+            continue
+        data = entry.get('data', {})
+        print(f"{entry['ts']}  {entry['id']}  {data.get('source', '-'):5}  "
+              f"{data.get('nombre_del_medicamento')}  {data.get('cantidad_por_dosis')} mg  "
+              f"x{data.get('numero_de_comprimidos')}")
+    print(f'{len(results)} registros')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"""
+Benchmark offline de los servicios con backends falsos (ver fakes.py).
+
+Cada escenario llama a un endpoint de principio a fin con los ficheros de Examples/,
+a varios niveles de concurrencia, y cada combinación se ejecuta en un subproceso
+propio para que el pico de RSS sea el de ese escenario.
+
+Uso:
+    python bench.py                                  # todos los escenarios
+    python bench.py -s img_to_text getPillInfo -c 1 8 -n 100 --model-latency 0.5
+    python bench.py --compare bench_results/antes.json bench_results/despues.json
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import fakes
+import instrumentation
+from services import BASE_DIR, load_service, use_fake_credentials
+
+EXAMPLES = os.path.join(BASE_DIR, 'Examples')
+RESULTS_FOLDER = os.path.join(BASE_DIR, 'bench_results')
+IMAGES = ['pill.jpg', 'lorazepan.jpg', 'loreParte2.jpeg']
+
+
+def _read_example(name):
+    with open(os.path.join(EXAMPLES, name), 'rb') as f:
+        return f.read()
+
+
+class Scenario:
+    def __init__(self, name, service, method, path, build, needs=()):
+        self.name = name
+        self.service = service
+        self.method = method
+        self.path = path
+        self.build = build  # (i, distinct) -> kwargs para test_client.open
+        self.needs = needs  # servicios adicionales a los que llama (orquestador)
+
+
+def _build_img_to_text(i, distinct):
+    name = IMAGES[i % len(IMAGES)]
+    data = _read_example(name)
+    if distinct:
+        # 🔹 Los decodificadores JPEG ignoran bytes tras el final: evita que el single-flight agrupe
+        data += f'#{i}'.encode()
+    return {'data': {'photo': (io.BytesIO(data), name)}, 'content_type': 'multipart/form-data'}
+
+
+def _build_get_pill_info(i, distinct):
+    entries = fakes.load_transcripts()
+    transcript = entries[i % len(entries)]['transcript']
+    if distinct:
+        transcript += f' ({i})'
+    return {'json': {'transcript': transcript}}
+
+
+def _build_transcribe(i, distinct):
+    image = IMAGES[i % len(IMAGES)]
+    image_data = _read_example(image)
+    if distinct:
+        image_data += f'#{i}'.encode()
+    return {
+        'data': {
+            'audio': (io.BytesIO(_read_example('Prueba_1.ogg')), f'{i}_Prueba_1.ogg'),
+            'photo': (io.BytesIO(image_data), f'{i}_{image}'),
+        },
+        'content_type': 'multipart/form-data',
+    }
+
+
+def _build_audio_only(i, distinct):
+    return {'data': {'audio': (io.BytesIO(_read_example('Prueba_1.ogg')), f'{i}_Prueba_1.ogg')},
+            'content_type': 'multipart/form-data'}
+
+
+def _build_resume_day(i, distinct):
+    return {'json': {'schedule': fakes.load_schedule()}}
+
+
+SCENARIOS = {
+    s.name: s for s in [
+        Scenario('img_to_text', 'photo_to_name', 'POST', '/img_to_text', _build_img_to_text),
+        Scenario('getPillInfo', 'text_to_json', 'POST', '/getPillInfo', _build_get_pill_info),
+        Scenario('transcribe', 'transcribe', 'POST', '/transcribe', _build_transcribe,
+                 needs=('photo_to_name', 'text_to_json')),
+        Scenario('transcribe_solo', 'audio_to_text', 'POST', '/transcribe', _build_audio_only),
+        Scenario('medicamentos', 'query_text', 'GET', '/medicamentos', lambda i, d: {}),
+        Scenario('resumeDay', 'day_summary', 'POST', '/resumeDay', _build_resume_day),
+    ]
+}
+
+
+def _percentile(samples, q):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def setup_services(scenario, args):
+    """
+    Importa los servicios del escenario y sustituye sus clientes por los fakes.
+    """
+    use_fake_credentials()
+    openai = fakes.FakeOpenAI(latency=args.model_latency, jitter=args.jitter,
+                              error_rate=args.error_rate, seed=args.seed,
+                              tail_rate=args.tail_rate, tail_latency=args.tail_latency)
+    supabase = fakes.FakeSupabase(latency=args.db_latency, jitter=args.jitter,
+                                  error_rate=args.error_rate, seed=args.seed)
+    modules = {}
+    for name in (scenario.service,) + scenario.needs:
+        modules[name] = fakes.install(load_service(name), openai=openai, supabase=supabase)
+
+    if scenario.needs:
+        main = modules[scenario.service]
+        http = fakes.FakeHttp({
+            main.PHOTO_TO_NAME_SERVER: (modules['photo_to_name'].app, '/img_to_text'),
+            main.TEXT_TO_JSON_SERVER: (modules['text_to_json'].app, '/getPillInfo'),
+        })
+        fakes.install(main, http=http)
+    return modules[scenario.service].app
+
+
+def run_scenario(scenario, concurrency, args):
+    app = setup_services(scenario, args)
+
+    def one(i):
+        kwargs = scenario.build(i, args.distinct)
+        with app.test_client() as http:
+            start = time.perf_counter()
+            response = http.open(scenario.path, method=scenario.method, **kwargs)
+            elapsed = time.perf_counter() - start
+        return elapsed, response.status_code
+
+    one(-1)  # 🔹 Calentamiento (imports perezosos, cachés de Flask)
+    instrumentation.reset()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - started
+
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = [elapsed for elapsed, _ in results]
+    errors = sum(1 for _, status in results if status >= 400)
+    return {
+        'scenario': scenario.name,
+        'concurrency': concurrency,
+        'requests': args.requests,
+        'errors': errors,
+        'wall_seconds': wall,
+        'throughput_rps': args.requests / wall if wall else 0.0,
+        'latency': {
+            'mean': sum(latencies) / len(latencies) if latencies else 0.0,
+            'p50': _percentile(latencies, 0.5),
+            'p95': _percentile(latencies, 0.95),
+            'p99': _percentile(latencies, 0.99),
+            'max': max(latencies) if latencies else 0.0,
+        },
+        'stages': instrumentation.stage_summary(),
+        'peak_python_alloc_bytes': traced_peak,
+        # 🔹 ru_maxrss está en KB en Linux y en bytes en macOS
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _worker_args(args, scenario, concurrency):
+    return [sys.executable, os.path.abspath(__file__), '--worker', scenario, '-c', str(concurrency),
+            '-n', str(args.requests), '--model-latency', str(args.model_latency),
+            '--db-latency', str(args.db_latency), '--jitter', str(args.jitter),
+            '--error-rate', str(args.error_rate), '--seed', str(args.seed),
+            '--tail-rate', str(args.tail_rate), '--tail-latency', str(args.tail_latency)] + (['--distinct'] if args.distinct else [])
+
+
+def print_table(results, header=True):
+    if header:
+        print(f"{'escenario':<16}{'conc':>5}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err':>5}{'RSS MB':>9}")
+    for r in results:
+        lat = r['latency']
+        print(f"{r['scenario']:<16}{r['concurrency']:>5}{r['throughput_rps']:>9.1f}{lat['p50'] * 1000:>9.1f}"
+              f"{lat['p95'] * 1000:>9.1f}{lat['p99'] * 1000:>9.1f}{r['errors']:>5}{r['peak_rss_bytes'] / 2**20:>9.1f}")
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = {(r['scenario'], r['concurrency']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'escenario':<16}{'conc':>5}{'rps':>16}{'p50 ms':>18}{'p95 ms':>18}")
+    for r in new['results']:
+        before = old.get((r['scenario'], r['concurrency']))
+        if before is None:
+            continue
+
+        def delta(a, b):
+            return f"{b:.1f} ({(b - a) / a * 100:+.0f}%)" if a else f"{b:.1f}"
+
+        print(f"{r['scenario']:<16}{r['concurrency']:>5}"
+              f"{delta(before['throughput_rps'], r['throughput_rps']):>16}"
+              f"{delta(before['latency']['p50'] * 1000, r['latency']['p50'] * 1000):>18}"
+              f"{delta(before['latency']['p95'] * 1000, r['latency']['p95'] * 1000):>18}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline de los servicios con backends falsos.')
+    parser.add_argument('-s', '--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('-c', '--concurrency', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('-n', '--requests', type=int, default=50, help='Peticiones por escenario y concurrencia')
+    parser.add_argument('--model-latency', type=float, default=0.2, help='Latencia inyectada en OpenAI (s)')
+    parser.add_argument('--db-latency', type=float, default=0.02, help='Latencia inyectada en Supabase (s)')
+    parser.add_argument('--jitter', type=float, default=0.3, help='Variación relativa de la latencia')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fracción de llamadas que fallan')
+    parser.add_argument('--tail-rate', type=float, default=0.0, help='Fracción de llamadas a OpenAI muy lentas')
+    parser.add_argument('--tail-latency', type=float, default=5.0, help='Latencia de esas llamadas lentas (s)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--distinct', action='store_true', help='Entradas distintas en cada petición')
+    parser.add_argument('--output', help='Fichero JSON de resultados (por defecto bench_results/<fecha>_<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('ANTES', 'DESPUES'), help='Compara dos resultados guardados')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.worker:
+        # 🔹 Subproceso: un único escenario y concurrencia, resultado en JSON por stdout
+        result = run_scenario(SCENARIOS[args.worker], args.concurrency[0], args)
+        sys.stdout.write('\n' + json.dumps(result) + '\n')
+        return
+
+    results = []
+    for name in args.scenarios:
+        for concurrency in args.concurrency:
+            proc = subprocess.run(_worker_args(args, name, concurrency), cwd=BASE_DIR,
+                                  capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"❌ {name} (c={concurrency}) falló:\n{proc.stderr[-2000:]}")
+                continue
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            print_table(results[-1:], header=len(results) == 1)
+
+    commit = _git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('worker', 'compare', 'output')},
+        },
+        'results': results,
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        output = os.path.join(RESULTS_FOLDER, f'{stamp}_{commit}.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Resultados guardados en {output}")
+
+
+if __name__ == '__main__':
+    main()
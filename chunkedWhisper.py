@@ -0,0 +1,166 @@
+"""
+Transcripción por trozos para notas de voz largas.
+
+El audio se decodifica a PCM mono de 16 bits, se corta en los silencios más cercanos
+a WHISPER_CHUNK_SECONDS y los trozos se envían a whisper-1 en paralelo; el texto se une
+en orden. Con `iter_transcribe` se pueden emitir transcripciones parciales (SSE) según
+van llegando los trozos, sin esperar al archivo completo.
+"""
+import io
+import os
+import shutil
+import subprocess
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import resilience
+from instrumentation import timer
+from lazy import lazy_module
+
+np = lazy_module('numpy')
+
+# 🔹 'chunked' corta los audios largos en silencios y transcribe los trozos en paralelo; 'whole' envía el archivo entero
+MODE = os.getenv('WHISPER_MODE', 'chunked')
+SAMPLE_RATE = 16000
+# 🔹 Duración máxima de cada trozo; los audios más cortos se envían enteros como antes
+CHUNK_SECONDS = float(os.getenv('WHISPER_CHUNK_SECONDS', '30'))
+MIN_CHUNK_SECONDS = CHUNK_SECONDS / 3
+# 🔹 Llamadas simultáneas a Whisper compartidas por todos los requests del proceso
+CONCURRENCY = int(os.getenv('WHISPER_CONCURRENCY', '4'))
+FRAME_SECONDS = 0.03
+# Un frame es silencio si su RMS está SILENCE_DB por debajo del frame más fuerte
+SILENCE_DB = float(os.getenv('WHISPER_SILENCE_DB', '-35'))
+WHISPER = resilience.upstream('openai_whisper')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix='omed-whisper')
+    return _executor
+
+
+def decode(path):
+    """
+    Devuelve (muestras int16 mono, frecuencia). Los WAV PCM se leen con `wave`;
+    el resto de formatos (ogg, mp3, m4a) necesitan ffmpeg. Lanza ValueError si no se puede.
+    """
+    if path.lower().endswith('.wav'):
+        try:
+            with wave.open(path, 'rb') as wav:
+                if wav.getsampwidth() == 2:
+                    samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+                    channels = wav.getnchannels()
+                    if channels > 1:
+                        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+                    return samples, wav.getframerate()
+        except wave.Error:
+            pass
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise ValueError('ffmpeg no está disponible para decodificar el audio.')
+    result = subprocess.run([ffmpeg, '-nostdin', '-v', 'error', '-i', path, '-f', 's16le', '-ac', '1',
+                             '-ar', str(SAMPLE_RATE), '-'], capture_output=True)
+    if result.returncode != 0:
+        raise ValueError(f'ffmpeg no pudo decodificar el audio: {result.stderr.decode(errors="ignore").strip()}')
+    return np.frombuffer(result.stdout, dtype=np.int16), SAMPLE_RATE
+
+
+def split_points(samples, rate, chunk_seconds=CHUNK_SECONDS, min_chunk_seconds=MIN_CHUNK_SECONDS):
+    """
+    Índices de muestra donde cortar. En cada ventana [mínimo, máximo] se corta en el
+    centro del tramo de silencio más largo; si no hay silencio, en el frame más bajo.
+    """
+    frame = max(int(rate * FRAME_SECONDS), 1)
+    count = len(samples) // frame
+    if count == 0:
+        return []
+    frames = samples[:count * frame].reshape(count, frame).astype(np.float32)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    silent = rms <= max(float(rms.max()) * 10 ** (SILENCE_DB / 20), 1.0)
+
+    max_frames = int(chunk_seconds / FRAME_SECONDS)
+    min_frames = int(min_chunk_seconds / FRAME_SECONDS)
+    cuts = []
+    start = 0
+    while count - start > max_frames:
+        low, high = start + min_frames, start + max_frames
+        window = silent[low:high]
+        if window.any():
+            # 🔹 Tramos de silencio consecutivos dentro de la ventana: (inicio, fin)
+            edges = np.diff(np.concatenate(([0], window.astype(np.int8), [0])))
+            runs = np.stack((np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)), axis=1)
+            run_start, run_end = max(runs, key=lambda run: (run[1] - run[0], run[0]))
+            cut = low + (int(run_start) + int(run_end)) // 2
+        else:
+            cut = low + int(np.argmin(rms[low:high]))
+        cuts.append(cut * frame)
+        start = cut
+    return cuts
+
+
+def to_wav(samples, rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def _transcribe_chunk(client, index, data):
+    with timer('whisper_chunk'):
+        # 🔹 Hedging y circuit breaker de Whisper (el trozo en memoria se puede reenviar tal cual)
+        return WHISPER.call(client.audio.transcriptions.create, model="whisper-1",
+                            file=(f'chunk_{index}.wav', data, 'audio/wav')).text
+
+
+def _send_whole(client, path):
+    with open(path, 'rb') as audio:
+        return client.audio.transcriptions.create(model="whisper-1", file=audio).text
+
+
+def transcribe_whole(client, path):
+    """ Transcribe el archivo entero en una sola llamada (cada intento lo vuelve a abrir). """
+    return WHISPER.call(_send_whole, client, path)
+
+
+def iter_transcribe(client, path, chunk_seconds=CHUNK_SECONDS):
+    """
+    Genera (índice, texto, total_trozos) en orden. Los trozos se transcriben en paralelo
+    y cada uno se emite en cuanto él y todos los anteriores han terminado.
+    Si el audio es corto o no se puede decodificar, se envía el archivo entero.
+    """
+    try:
+        samples, rate = decode(path)
+    except ValueError:
+        samples, rate = None, SAMPLE_RATE
+    if samples is None or len(samples) <= chunk_seconds * rate:
+        yield 0, transcribe_whole(client, path).strip(), 1
+        return
+
+    bounds = [0, *split_points(samples, rate, chunk_seconds, chunk_seconds / 3), len(samples)]
+    futures = [_pool().submit(_transcribe_chunk, client, i, to_wav(samples[a:b], rate))
+               for i, (a, b) in enumerate(zip(bounds, bounds[1:]))]
+    try:
+        for i, future in enumerate(futures):
+            yield i, future.result().strip(), len(futures)
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def stitch(parts):
+    return ' '.join(part for part in parts if part)
+
+
+def transcribe(client, path, chunk_seconds=CHUNK_SECONDS):
+    """ Transcripción completa (trozos en paralelo, unidos en orden). """
+    return stitch(text for _, text, _ in iter_transcribe(client, path, chunk_seconds))
@@ -0,0 +1,108 @@
+"""
+Formato compacto del horario de tomas (/medicamentos?format=compact y /resumeDay).
+
+El formato completo repite paciente, medicamento, parte afectada, fecha de inicio y dosis
+en cada toma de cada franja. El compacto envía una tabla de medicamentos una sola vez y,
+por franja, solo [med_id, hora_toma, dosis_restantes]:
+
+    {"format": "compact-v1",
+     "meds": [{"paciente": "Candela", "medicamento": "Lorazepam", "parte_afectada": "DIGESTIVE",
+               "fecha_inicio": "2025-02-25T09:30:00", "cantidad_por_dosis": 0.5}],
+     "slots": {"AFTERDINNER": [[0, "21:30:00", 42]], "MIDDAY": []}}
+
+Además, `compress_response` comprime la respuesta con brotli o gzip según Accept-Encoding.
+"""
+import gzip
+
+FORMAT = 'compact-v1'
+MED_FIELDS = ('paciente', 'medicamento', 'parte_afectada', 'fecha_inicio', 'cantidad_por_dosis')
+# 🔹 Por debajo de este tamaño comprimir no compensa
+MIN_COMPRESS_BYTES = 512
+
+try:
+    import brotli  # Opcional: si no está instalado se usa gzip
+except ImportError:
+    brotli = None
+
+
+def is_compact(schedule):
+    return isinstance(schedule, dict) and schedule.get('format') == FORMAT
+
+
+def compact(schedule):
+    """ Horario completo {franja: [toma, ...]} -> formato compacto. """
+    meds, index, slots = [], {}, {}
+    for franja, tomas in schedule.items():
+        rows = []
+        for toma in tomas or []:
+            med = tuple(toma.get(field) for field in MED_FIELDS)
+            med_id = index.get(med)
+            if med_id is None:
+                med_id = index[med] = len(meds)
+                meds.append(dict(zip(MED_FIELDS, med)))
+            rows.append([med_id, toma.get('hora_toma'), toma.get('dosis_restantes')])
+        slots[franja] = rows
+    return {'format': FORMAT, 'meds': meds, 'slots': slots}
+
+
+def expand(payload):
+    """ Formato compacto -> horario completo. Lanza ValueError si no es válido. """
+    if not is_compact(payload):
+        raise ValueError(f"El horario no está en formato {FORMAT}.")
+    meds = payload.get('meds') or []
+    slots = payload.get('slots') or {}
+    if not isinstance(meds, list) or not isinstance(slots, dict):
+        raise ValueError("'meds' debe ser una lista y 'slots' un objeto.")
+    schedule = {}
+    for franja, rows in slots.items():
+        if not isinstance(rows, list):
+            raise ValueError(f"Las tomas de {franja} deben ser una lista.")
+        tomas = []
+        for row in rows:
+            try:
+                med_id, hora_toma, dosis_restantes = row
+            except (TypeError, ValueError):
+                raise ValueError(f"Toma no válida en {franja}: {row!r}")
+            # 🔹 Sin índices negativos (-1 sería el último medicamento) ni bool (es un int)
+            if not isinstance(med_id, int) or isinstance(med_id, bool) or not 0 <= med_id < len(meds):
+                raise ValueError(f"Medicamento no válido en {franja}: {row!r}")
+            med = meds[med_id]
+            if not isinstance(med, dict):
+                raise ValueError(f"Medicamento {med_id} no válido: {med!r}")
+            tomas.append({**med, 'hora_toma': hora_toma, 'dosis_restantes': dosis_restantes})
+        schedule[franja] = tomas
+    return schedule
+
+
+def negotiate(accept_encoding):
+    """ 'br', 'gzip' o None según la cabecera Accept-Encoding (respetando q=0). """
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress_response(response, accept_encoding):
+    """ Comprime el cuerpo de una respuesta Flask si el cliente lo acepta y merece la pena. """
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(accept_encoding)
+    body = response.get_data()
+    if encoding is None or len(body) < MIN_COMPRESS_BYTES:
+        return response
+    body = brotli.compress(body, quality=5) if encoding == 'br' else gzip.compress(body, compresslevel=6)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
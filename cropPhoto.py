@@ -1,110 +1,174 @@
-import json
-import cv2
-import numpy as np
 import base64
-import pyperclip
+import json
+import os
 
+import imagePool
+from instrumentation import timer
+from lazy import lazy_module
 
-def crop_medicine_box(base64_string):
-    print("Iniciando el proceso de recorte de la imagen...")
+# 🔹 OpenCV y NumPy se importan en el primer uso (arranque en frío más rápido)
+cv2 = lazy_module('cv2')
+np = lazy_module('numpy')
 
-    # Convertir base64 a imagen
-    try:
-        image_data = base64.b64decode(base64_string)
-        image_np = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
-    except Exception as e:
-        print(f"Error al decodificar la imagen base64: {e}")
-        return None
 
-    print("Imagen cargada correctamente.")
+# 🔹 Parámetros de la detección de cajas
+MIN_AREA = 1000             # Área mínima (px²) de un contorno para considerarlo
+ASPECT_RANGE = (1.5, 2.5)   # Relación lado largo / lado corto típica de una caja de medicamento
+PADDING = 15                # Margen alrededor de la caja recortada
+MAX_OVERLAP = 0.6           # Solapamiento máximo entre dos cajas devueltas
+# 🔹 CROP_DEBUG=1 guarda gray/edges/contours/buffer.png en el directorio actual
+DEBUG = os.getenv('CROP_DEBUG', '0') == '1'
 
-    # Convertir a escala de grises
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    cv2.imwrite("gray.png", gray)  # Guarda la imagen de bordes en el disco
 
-    contrast_factor = 2.0  # Puedes aumentar este valor para mayor contraste
-    contrast_image = cv2.convertScaleAbs(gray, alpha=contrast_factor, beta=0)
+def decode_image(image_data):
+    """
+    Bytes, memoryview (memoria compartida del pool, sin copia) o base64 de una imagen
+    -> imagen BGR de OpenCV; None si no se puede decodificar.
+    """
+    if isinstance(image_data, str):
+        image_data = base64.b64decode(image_data)
+    with timer('image_decode'):
+        return cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
 
-    # Aplicar un filtro bilateral para reducir el ruido sin perder bordes
-    gray = cv2.bilateralFilter(gray, 9, 75, 75)
 
-    # Usar Canny para detección de bordes
+def find_contours(image):
+    """ Escala de grises, filtro bilateral y Canny; devuelve los contornos externos. """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = cv2.bilateralFilter(gray, 9, 75, 75)  # Reduce el ruido sin perder bordes
     edges = cv2.Canny(gray, 20, 20, apertureSize=3)
-    cv2.imwrite("edges.png", edges)  # Guarda la imagen de bordes en el disco
-    print("Imagen de bordes guardada como 'edges.png'.")
-
-    # Encontrar contornos
+    if DEBUG:
+        cv2.imwrite("gray.png", gray)
+        cv2.imwrite("edges.png", edges)
     contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    print(f"Contornos encontrados: {len(contours)}")
-
-    print(f"Total de contornos encontrados: {len(contours)}")
-    for c in contours:
-        epsilon = 0.04 * cv2.arcLength(c, True)
-        approx = cv2.approxPolyDP(c, epsilon, True)
-        x, y, w, h = cv2.boundingRect(approx)
-        aspect_ratio = float(w) / h
-        print(f"Contorno: Área = {cv2.contourArea(c)}, Relación de aspecto = {aspect_ratio}")
-
-    # Filtrar contornos por área y forma (evitar ruido)
-    filtered_contours = [c for c in contours if cv2.contourArea(c) > 1000]
-    print(f"Contornos después de filtrar por área: {len(filtered_contours)}")
-
-    '''if not filtered_contours:
-        print("No se encontraron contornos válidos.")
-        return None  # No se encontró una caja clara'''
-
-    # Filtrar por una mejor relación de aspecto (más rectangular)
-    best_contour = None
-    max_aspect_ratio = 0
-
-    for c in filtered_contours:
-        # Aproximar el contorno a un polígono
-        epsilon = 0.04 * cv2.arcLength(c, True)
-        approx = cv2.approxPolyDP(c, epsilon, True)
-
-        # Calcular la relación de aspecto (ancho/alto)
-        x, y, w, h = cv2.boundingRect(approx)
-        aspect_ratio = float(w) / h
-        print(
-            f"Área: {cv2.contourArea(c)}, Relación de aspecto: {aspect_ratio}")  # Ver valores de área y relación de aspecto
-
-        if 1.5 < aspect_ratio < 2.5:  # Relación de aspecto entre 1.5 y 2.5
-            if cv2.contourArea(c) > cv2.contourArea(best_contour) if best_contour is not None else 0:
-                best_contour = c
-
-    '''if best_contour is None:
-        print("No se encontró un contorno adecuado.")
-        return None  # No se encontró un buen contorno'''
-
-    # Obtener el rectángulo delimitador
-    x, y, w, h = cv2.boundingRect(best_contour)
-
-    # Expandir un poco el área para evitar recortes excesivos
-    padding = 15
-    x = max(x - padding, 0)
-    y = max(y - padding, 0)
+    return contours
+
+
+def score_contours(contours, image_shape):
+    """
+    Puntúa todos los contornos a la vez con NumPy. Devuelve (cajas, puntuaciones) con
+    cajas como array (n, 4) de x, y, w, h.
+
+    Puntuación = fracción de la imagen que ocupa el contorno * rectangularidad
+    (área / área del rectángulo delimitador) * ajuste de la relación de aspecto.
+    """
+    if not contours:
+        return np.zeros((0, 4), np.int64), np.zeros(0)
+
+    # 🔹 Todos los puntos concatenados y el índice donde empieza cada contorno
+    lengths = np.array([len(c) for c in contours])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    x, y = points[:, 0], points[:, 1]
+
+    min_x, max_x = np.minimum.reduceat(x, starts), np.maximum.reduceat(x, starts)
+    min_y, max_y = np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)
+    w, h = max_x - min_x + 1, max_y - min_y + 1
+
+    # Área por la fórmula del polígono (shoelace): el siguiente del último punto es el primero
+    following = np.arange(len(points)) + 1
+    following[starts + lengths - 1] = starts
+    area = np.abs(np.add.reduceat(x * y[following] - x[following] * y, starts)) / 2
+
+    rectangularity = area / (w * h)
+    aspect = np.maximum(w, h) / np.minimum(w, h)
+    low, high = ASPECT_RANGE
+    # 1 dentro del rango; decae con la distancia relativa fuera de él
+    distance = np.maximum(low - aspect, 0) / low + np.maximum(aspect - high, 0) / high
+    aspect_fit = 1 / (1 + 4 * distance)
+
+    scores = (area / (image_shape[0] * image_shape[1])) * rectangularity * aspect_fit
+    scores[area < MIN_AREA] = 0
+    boxes = np.stack((min_x, min_y, w, h), axis=1).astype(np.int64)
+    return boxes, scores
+
+
+def select_boxes(boxes, scores, k):
+    """ Las k cajas con mayor puntuación, descartando las que se solapan con una mejor. """
+    selected = []
+    for i in np.argsort(-scores):
+        if scores[i] <= 0 or len(selected) == k:
+            break
+        x, y, w, h = boxes[i]
+        if selected:
+            kept = boxes[selected]
+            inter_w = np.minimum(x + w, kept[:, 0] + kept[:, 2]) - np.maximum(x, kept[:, 0])
+            inter_h = np.minimum(y + h, kept[:, 1] + kept[:, 3]) - np.maximum(y, kept[:, 1])
+            inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+            smaller = np.minimum(w * h, kept[:, 2] * kept[:, 3])
+            if (inter / smaller > MAX_OVERLAP).any():
+                continue
+        selected.append(i)
+    return [(tuple(int(v) for v in boxes[i]), float(scores[i])) for i in selected]
+
+
+def crop_region(image, box, padding=PADDING):
+    """ Recorta la caja con un margen para evitar recortes excesivos. """
+    x, y, w, h = box
+    x, y = max(x - padding, 0), max(y - padding, 0)
     w = min(w + 2 * padding, image.shape[1] - x)
     h = min(h + 2 * padding, image.shape[0] - y)
+    return image[y:y + h, x:x + w]
 
-    # Recortar la imagen
-    cropped_image = image[y:y + h, x:x + w]
-    print(f"Imagen recortada con dimensiones: {cropped_image.shape}")
 
-    # Convertir de OpenCV a base64
-    _, buffer = cv2.imencode(".png", cropped_image)
-    base64_cropped = base64.b64encode(buffer).decode("utf-8")
+def to_base64_png(image):
+    _, buffer = cv2.imencode(".png", image)
+    return base64.b64encode(buffer).decode("utf-8")
 
-    # Dibuja los contornos en la imagen original
-    image_with_contours = image.copy()
-    cv2.drawContours(image_with_contours, filtered_contours, -1, (0, 255, 0), 2)
-    cv2.imwrite("contours.png", image_with_contours)  # Guarda la imagen con contornos dibujados
-    print("Imagen con contornos guardada como 'contours.png'.")
 
-    cv2.imwrite("buffer.png", cropped_image)  # Guarda la imagen de bordes en el disco
+def crop_candidates(image_data, k=1):
+    """
+    Detecta hasta k cajas en una imagen (bytes o base64) y devuelve una lista de
+    {"box": [x, y, w, h], "score": float, "cropped_image": base64} ordenada por puntuación.
+    """
+    image = decode_image(image_data)
+    if image is None:
+        raise ValueError("No se pudo decodificar la imagen.")
+    boxes, scores = score_contours(find_contours(image), image.shape)
+    return [{"box": list(box), "score": round(score, 6), "cropped_image": to_base64_png(crop_region(image, box))}
+            for box, score in select_boxes(boxes, scores, k)]
 
 
-    return base64_cropped
+def crop_medicine_box(base64_string):
+    """ Recorta la caja con mejor puntuación; None si la imagen no se puede leer o no hay ninguna. """
+    try:
+        image = decode_image(base64_string)
+    except Exception as e:
+        print(f"Error al decodificar la imagen base64: {e}")
+        return None
+    if image is None:
+        print("Error al decodificar la imagen base64.")
+        return None
+
+    contours = find_contours(image)
+    boxes, scores = score_contours(contours, image.shape)
+    best = select_boxes(boxes, scores, 1)
+    if not best:
+        print(f"No se encontró un contorno adecuado entre {len(contours)} contornos.")
+        return None  # No se encontró una caja clara
+
+    cropped_image = crop_region(image, best[0][0])
+    if DEBUG:
+        image_with_contours = image.copy()
+        cv2.drawContours(image_with_contours, contours, -1, (0, 255, 0), 2)
+        cv2.imwrite("contours.png", image_with_contours)
+        cv2.imwrite("buffer.png", cropped_image)
+    return to_base64_png(cropped_image)
+
+
+def _crop_worker(image_bytes, k):
+    """ Se ejecuta en el pool de imágenes: nunca lanza, devuelve {"crops"} o {"error"}. """
+    try:
+        return {"crops": crop_candidates(image_bytes, k)}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def crop_batch(images, k=1):
+    """
+    Recorta hasta k cajas de cada imagen repartiendo las imágenes entre los workers
+    del pool de imágenes. Devuelve una lista con el resultado de cada imagen, en el mismo orden.
+    """
+    return imagePool.default_pool().map(_crop_worker, images, k)
 
 
 def addCroppedPhoto(event_json, img_b64_str):
@@ -125,7 +189,8 @@ def addCroppedPhoto(event_json, img_b64_str):
             print(f"Error al parsear JSON: {e}")
             return json.dumps({"error": "Formato JSON inválido"})
 
-    cropped_b64 = crop_medicine_box(img_b64_str)
+    with timer('crop'):
+        cropped_b64 = crop_medicine_box(img_b64_str)
 
     if cropped_b64 is None:
         print("No se pudo procesar la imagen.")
@@ -137,10 +202,10 @@ def addCroppedPhoto(event_json, img_b64_str):
     return json.dumps(event_json, indent=4)  # Retornar el JSON con formato bonito
 
 
-import os
-
 
 def main():
+    import pyperclip  # Solo se usa en este script de prueba
+
     print("Iniciando el script...")
     # Ruta de la imagen en la misma carpeta que el script .py
     image_path = os.path.join(os.path.dirname(__file__),
@@ -1,44 +1,255 @@
-# Requires "requests" to be installed (see python-requests.org)
+"""
+Recorte del fondo de la foto del medicamento (PNG con transparencia).
+
+Dos backends (CUTOUT_BACKEND):
+
+- 'local' (por defecto): GrabCut de OpenCV sembrado con la caja que detecta
+  `cropPhoto` (la caja es primer plano probable y su centro, primer plano seguro).
+  Sin red ni coste por imagen.
+- 'removebg': la API de remove.bg (REMOVE_KEY), con timeout y circuit breaker.
+
+Los resultados se guardan por hash del contenido en CUTOUT_CACHE_DIR: la misma foto no
+se vuelve a procesar ni a pagar.
+
+    python cropper_v2.py foto.jpg salida.png [--backend removebg]
+    python cropper_v2.py --bench                # latencia y calidad de máscara en Examples/
+"""
+import argparse
+import glob
+import hashlib
 import os
-import requests
-from dotenv import load_dotenv
+import statistics
+import time
+
+import cropPhoto
+import resilience
+from instrumentation import timer
+from lazy import lazy_module
+
+cv2 = lazy_module('cv2')
+np = lazy_module('numpy')
+requests = lazy_module('requests')
+
+BACKEND = os.getenv('CUTOUT_BACKEND', 'local')
+BACKENDS = ('local', 'removebg')
+CACHE_DIR = os.getenv('CUTOUT_CACHE_DIR', 'cutout_cache')
+REMOVE_BG_URL = "https://api.remove.bg/v1.0/removebg"
+REMOVE_BG_TIMEOUT = float(os.getenv('REMOVE_BG_TIMEOUT', '30'))
+# 🔹 GrabCut trabaja sobre la imagen reducida a este lado máximo; la máscara se reescala
+MAX_SIDE = int(os.getenv('CUTOUT_MAX_SIDE', '800'))
+GRABCUT_ITERATIONS = 5
+SURE_FOREGROUND = 0.25  # Fracción de la caja que se recorta por cada lado para el primer plano seguro
+
+# 🔹 Cada llamada a remove.bg se paga: timeout y breaker, pero nunca peticiones duplicadas
+REMOVE_BG = resilience.upstream('removebg', hedge=False, timeout=REMOVE_BG_TIMEOUT)
+
+
+def _seed_mask(image):
+    """
+    Máscara inicial de GrabCut: fondo seguro fuera de la caja con margen, primer plano
+    probable dentro de la caja y seguro en su centro. Sin caja, todo salvo un borde del 5 %.
+    """
+    h, w = image.shape[:2]
+    mask = np.full((h, w), cv2.GC_BGD, np.uint8)
+    boxes, scores = cropPhoto.score_contours(cropPhoto.find_contours(image), image.shape)
+    best = cropPhoto.select_boxes(boxes, scores, 1)
+    if not best:
+        mx, my = max(1, w // 20), max(1, h // 20)
+        mask[my:h - my, mx:w - mx] = cv2.GC_PR_FGD
+        return mask, None
+
+    x, y, bw, bh = best[0][0]
+    pad = cropPhoto.PADDING
+    mask[max(y - pad, 0):y + bh + pad, max(x - pad, 0):x + bw + pad] = cv2.GC_PR_BGD
+    mask[y:y + bh, x:x + bw] = cv2.GC_PR_FGD
+    sx, sy = int(bw * SURE_FOREGROUND), int(bh * SURE_FOREGROUND)
+    mask[y + sy:y + bh - sy, x + sx:x + bw - sx] = cv2.GC_FGD
+    # 🔹 GrabCut necesita muestras de fondo aunque la caja llene la foto: el borde siempre es fondo
+    mask[[0, -1], :] = cv2.GC_BGD
+    mask[:, [0, -1]] = cv2.GC_BGD
+    return mask, (x, y, bw, bh)
+
+
+def local_mask(image):
+    """ Máscara alfa (uint8 0-255, tamaño de `image`) del objeto principal con GrabCut. """
+    h, w = image.shape[:2]
+    scale = min(1.0, MAX_SIDE / max(h, w))
+    small = cv2.resize(image, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA) \
+        if scale < 1 else image
+
+    mask, _ = _seed_mask(small)
+    background, foreground = np.zeros((1, 65), np.float64), np.zeros((1, 65), np.float64)
+    cv2.grabCut(small, mask, None, background, foreground, GRABCUT_ITERATIONS, cv2.GC_INIT_WITH_MASK)
+    alpha = np.where((mask == cv2.GC_FGD) | (mask == cv2.GC_PR_FGD), 255, 0).astype(np.uint8)
+    if scale < 1:
+        alpha = cv2.resize(alpha, (w, h), interpolation=cv2.INTER_LINEAR)  # bordes suaves al reescalar
+    return alpha
+
+
+def local_cutout(image_bytes):
+    """ PNG RGBA con el fondo transparente (mismo formato que remove.bg); None si no se puede leer. """
+    image = cropPhoto.decode_image(image_bytes)
+    if image is None:
+        print("Error al decodificar la imagen.")
+        return None
+    with timer('cutout_local'):
+        alpha = local_mask(image)
+    rgba = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    rgba[:, :, 3] = alpha
+    _, buffer = cv2.imencode('.png', rgba)
+    return buffer.tobytes()
 
-load_dotenv()
 
-CROPPER_API = os.getenv('REMOVE_KEY')
+def remote_cutout(image_bytes, api_key=None):
+    """ PNG de remove.bg; None si la API responde con error. """
+    api_key = api_key or os.getenv('REMOVE_KEY')
+    with timer('cutout_removebg'):
+        response = REMOVE_BG.call(requests.post, REMOVE_BG_URL, files={"image_file": ("image", image_bytes)},
+                                  data={"size": "auto"}, headers={"X-Api-Key": api_key},
+                                  timeout=REMOVE_BG_TIMEOUT)
+    if response.status_code != 200:
+        print(f"Error: {response.status_code}, {response.text}")
+        return None
+    return response.content
 
-# Función para usar la API de Remove.bg
-def remove_background(image_path, output_path, api_key=CROPPER_API):
-    # URL de la API de Remove.bg
-    url = "https://api.remove.bg/v1.0/removebg"
 
-    # Abrir la imagen
+def _cache_path(image_bytes, backend):
+    return os.path.join(CACHE_DIR, f"{hashlib.sha256(image_bytes).hexdigest()}_{backend}.png")
+
+
+def cutout(image_bytes, backend=None, api_key=None, use_cache=True):
+    """
+    PNG con el fondo eliminado (bytes) o None. El resultado se cachea por hash del
+    contenido y backend; los fallos no se cachean.
+    """
+    backend = backend or BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend desconocido: {backend}. Opciones: {', '.join(BACKENDS)}")
+    path = _cache_path(image_bytes, backend)
+    if use_cache and os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    result = local_cutout(image_bytes) if backend == 'local' else remote_cutout(image_bytes, api_key)
+    if result is not None and use_cache:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(result)
+        os.replace(tmp, path)  # 🔹 Escritura atómica: nunca se lee un PNG a medias
+    return result
+
+
+def remove_background(image_path, output_path=None, api_key=None, backend=None):
+    """
+    Elimina el fondo de la imagen en `image_path` y devuelve el PNG (bytes) o None.
+    Si se indica `output_path`, también lo guarda allí.
+    """
     with open(image_path, "rb") as image_file:
-        files = {"image_file": image_file}
+        result = cutout(image_file.read(), backend=backend, api_key=api_key)
+    if result is None:
+        return None
+    print("Fondo eliminado correctamente.")
+    if output_path:
+        with open(output_path, "wb") as out_file:
+            out_file.write(result)
+        print(f"Imagen recortada guardada en: {output_path}")
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+def _alpha(png_bytes, shape):
+    image = cv2.imdecode(np.frombuffer(png_bytes, np.uint8), cv2.IMREAD_UNCHANGED)
+    alpha = image[:, :, 3] if image.ndim == 3 and image.shape[2] == 4 else np.full(image.shape[:2], 255, np.uint8)
+    if alpha.shape != shape:
+        alpha = cv2.resize(alpha, (shape[1], shape[0]), interpolation=cv2.INTER_LINEAR)
+    return alpha > 127
+
+
+def _iou(a, b):
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def benchmark(paths, runs=3, api_key=None):
+    """
+    Latencia (mediana de `runs`, sin caché) de cada backend y calidad de la máscara local:
+    IoU frente a remove.bg si hay REMOVE_KEY y, siempre, la fracción de la caja sembrada
+    que queda en primer plano y la fracción de primer plano fuera de ella.
+    """
+    api_key = api_key or os.getenv('REMOVE_KEY')
+    rows = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        image = cropPhoto.decode_image(data)
+        if image is None:
+            continue
+        row = {'image': os.path.basename(path), 'size': f"{image.shape[1]}x{image.shape[0]}"}
+
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            local = cutout(data, 'local', use_cache=False)
+            timings.append(time.perf_counter() - start)
+        row['local_ms'] = statistics.median(timings) * 1000
+        mask = _alpha(local, image.shape[:2])
+
+        _, box = _seed_mask(image)
+        if box is not None:
+            x, y, bw, bh = box
+            inside = np.zeros_like(mask)
+            inside[y:y + bh, x:x + bw] = True
+            row['box_coverage'] = float(mask[inside].mean())
+            row['outside_box'] = float(mask[~inside].sum() / max(mask.sum(), 1))
+
+        if api_key:
+            start = time.perf_counter()
+            remote = cutout(data, 'removebg', api_key=api_key, use_cache=False)
+            row['removebg_ms'] = (time.perf_counter() - start) * 1000
+            if remote is not None:
+                row['iou_vs_removebg'] = _iou(mask, _alpha(remote, image.shape[:2]))
+        rows.append(row)
+    return rows
+
+
+def _print_benchmark(rows):
+    def fmt(value, pattern):
+        return format(value, pattern) if value is not None else '-'
 
-        # Enviar la solicitud a la API de Remove.bg
-        response = requests.post(url, files=files, data={"size": "auto"}, headers={"X-Api-Key": api_key})
+    print(f"{'imagen':<18}{'tamaño':>11}{'local ms':>10}{'remove.bg ms':>14}{'IoU':>7}{'caja cubierta':>15}{'fuera caja':>12}")
+    for r in rows:
+        print(f"{r['image']:<18}{r['size']:>11}{fmt(r['local_ms'], '.0f'):>10}"
+              f"{fmt(r.get('removebg_ms'), '.0f'):>14}{fmt(r.get('iou_vs_removebg'), '.2f'):>7}"
+              f"{fmt(r.get('box_coverage'), '.0%'):>15}{fmt(r.get('outside_box'), '.0%'):>12}")
 
-        # Verificar si la solicitud fue exitosa
-        if response.status_code == 200:
-            print("Fondo eliminado correctamente.")
 
-            # Guardar la imagen recortada
-            '''with open(output_path, "wb") as out_file:
-                out_file.write(response.content)'''
-            print(f"Imagen recortada guardada en: {output_path}")
-            return response.content
-        else:
-            print(f"Error: {response.status_code}, {response.text}")
+def main():
+    parser = argparse.ArgumentParser(description='Elimina el fondo de la foto del medicamento.')
+    parser.add_argument('image', nargs='?', help='Imagen de entrada')
+    parser.add_argument('output', nargs='?', default='cropped_image.png', help='PNG de salida')
+    parser.add_argument('--backend', choices=BACKENDS, default=None)
+    parser.add_argument('--bench', action='store_true', help='Compara los backends con las imágenes de Examples/')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
 
-# Ruta de la imagen original
-image_path = 'cerca.jpeg'  # Sustituir por la ruta de tu imagen
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
 
-# Ruta de salida para la imagen recortada
-output_path = 'cropped_image.png'  # Puedes cambiar el formato si es necesario
+    if args.bench:
+        examples = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Examples')
+        paths = sorted(p for ext in ('jpg', 'jpeg', 'png') for p in glob.glob(os.path.join(examples, f'*.{ext}')))
+        _print_benchmark(benchmark(paths, args.runs))
+        return
+    if not args.image:
+        parser.error('Indica una imagen o --bench')
+    remove_background(args.image, args.output, backend=args.backend)
 
-# Tu clave API de Remove.bg
-api_key = CROPPER_API  # Sustituir con tu clave API
 
-# Llamar a la función para eliminar el fondo
-remove_background(image_path, output_path)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Índice local de nombres de medicamentos para normalizar lo que devuelve el modelo
+de visión o el OCR ("LORAZEPAM 1mg", "lorazepan", "Orfidal" -> "Lorazepam") antes
+de insertarlo, y normalización de dosis ("0,5 mg" -> 0.5) y cantidades ("50 comprimidos" -> 50).
+
+Búsqueda: índice invertido de trigramas para obtener candidatos y distancia de
+Levenshtein acotada para elegir el mejor. Solo se corrige una errata (≤ MAX_EDITS) y si
+ningún otro medicamento queda cerca: muchos principios activos se parecen (Oxazepam y
+Lorazepam, Pravastatina y Simvastatina) y cambiar uno que no está en el catálogo por otro
+parecido es peor que dejar el nombre tal cual.
+"""
+import os
+import re
+import threading
+import unicodedata
+
+CATALOG_PATH = os.getenv('DRUG_CATALOG', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                      'data', 'catalogo_medicamentos.txt'))
+# 🔹 Ediciones máximas para corregir una errata ("lorazepan" -> "Lorazepam") y ventaja mínima
+# (en ediciones) sobre el siguiente medicamento candidato
+MAX_EDITS = 1
+MIN_MARGIN = 2
+# Nombres más cortos solo se aceptan exactos: una edición ya los convierte en otro
+MIN_FUZZY_LENGTH = 6
+MAX_CANDIDATES = 8
+
+# 🔹 "1.000 mg" (punto de miles) o "0,5 mg" / "0.5 mg" (coma o punto decimal)
+_THOUSANDS = r"[1-9]\d{0,2}(?:\.\d{3})+(?:,\d+)?"
+_DOSE_RE = re.compile(rf"({_THOUSANDS}(?![.\d])|\d+(?:[.,]\d+)?)\s*([a-zµ%]+)?(\s*/\s*m?l\b)?", re.IGNORECASE)
+_COUNT_RE = re.compile(r"(\d+)")
+_NOISE_RE = re.compile(r"\b\d+(?:[.,]\d+)?\s*(mg|g|gr|mcg|µg|ug|ml|%)?\b|\b(comprimidos?|capsulas?|efg|"
+                       r"recubiertos?|con|pelicula|sobres?|grageas?|oral|solucion)\b")
+_UNIT_TO_MG = {None: 1.0, 'mg': 1.0, 'g': 1000.0, 'gr': 1000.0, 'mcg': 0.001, 'µg': 0.001, 'ug': 0.001,
+               'miligramo': 1.0, 'miligramos': 1.0, 'gramo': 1000.0, 'gramos': 1000.0,
+               'microgramo': 0.001, 'microgramos': 0.001}
+
+
+def normalize_text(text):
+    """ Minúsculas, sin tildes y sin signos: 'Ácido Acetilsalicílico' -> 'acido acetilsalicilico'. """
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(re.sub(r"[^a-z0-9%.,µ ]+", ' ', text).split())
+
+
+def strip_dose(text):
+    """ Quita dosis, cantidades y palabras de formato: 'lorazepam 1mg 50 comprimidos' -> 'lorazepam'. """
+    return ' '.join(_NOISE_RE.sub(' ', text).split())
+
+
+def _trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _levenshtein(a, b, limit):
+    """ Distancia de edición con corte: devuelve limit + 1 si se supera. """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        best = i
+        for j, cb in enumerate(b, 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            current.append(value)
+            best = min(best, value)
+        if best > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class DrugIndex:
+    def __init__(self, entries=()):
+        self._canonical = {}   # clave normalizada (nombre o alias) -> nombre canónico
+        self._postings = {}    # trigrama -> claves normalizadas
+        for canonical, aliases in entries:
+            self.add(canonical, aliases)
+
+    @classmethod
+    def load(cls, path=CATALOG_PATH):
+        entries = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                names = [name.strip() for name in line.split('|') if name.strip()]
+                entries.append((names[0], names[1:]))
+        return cls(entries)
+
+    def __len__(self):
+        return len(set(self._canonical.values()))
+
+    def add(self, canonical, aliases=()):
+        for name in (canonical, *aliases):
+            key = normalize_text(name)
+            if key in self._canonical:
+                continue
+            self._canonical[key] = canonical
+            for gram in _trigrams(key):
+                self._postings.setdefault(gram, []).append(key)
+
+    def lookup(self, raw_name):
+        """
+        Devuelve (nombre_canónico, similitud) o None si no está en el catálogo. La similitud es
+        1.0 si coincide exacto con un nombre o alias, y menor si se ha corregido una errata.
+        """
+        if not raw_name:
+            return None
+        query = strip_dose(normalize_text(str(raw_name)))
+        if not query:
+            return None
+        exact = self._canonical.get(query)
+        if exact is not None:
+            return exact, 1.0
+        if len(query) < MIN_FUZZY_LENGTH:
+            return None
+
+        # 🔹 Candidatos: claves que comparten más trigramas con la consulta
+        grams = _trigrams(query)
+        shared = {}
+        for gram in grams:
+            for key in self._postings.get(gram, ()):
+                shared[key] = shared.get(key, 0) + 1
+        candidates = sorted(shared, key=lambda key: -shared[key])[:MAX_CANDIDATES]
+
+        # 🔹 Mejor distancia por medicamento (sus alias cuentan como el mismo)
+        limit = MAX_EDITS + MIN_MARGIN - 1
+        distances = {}
+        for key in candidates:
+            distance = _levenshtein(query, key, limit)
+            canonical = self._canonical[key]
+            if distance <= limit and distance < distances.get(canonical, limit + 1):
+                distances[canonical] = distance
+        ranked = sorted(distances.items(), key=lambda item: item[1])
+        if not ranked or ranked[0][1] > MAX_EDITS:
+            return None
+        if len(ranked) > 1 and ranked[1][1] - ranked[0][1] < MIN_MARGIN:
+            return None  # ambiguo: se parece igual a dos medicamentos
+        canonical, distance = ranked[0]
+        return canonical, 1 - distance / max(len(query), len(normalize_text(canonical)))
+
+    def exact_name(self, raw_name):
+        """ Nombre canónico solo si coincide exacto con un nombre o alias del catálogo; si no, None. """
+        match = self.lookup(raw_name)
+        return match[0] if match and match[1] == 1.0 else None
+
+    def canonical_name(self, raw_name):
+        """ Nombre canónico si está en el catálogo (o a una errata); si no, el nombre original sin cambios. """
+        match = self.lookup(raw_name)
+        return match[0] if match else raw_name
+
+
+def normalize_dose(value):
+    """
+    Dosis en mg como float: 0.5, '0.5mg', '0,5 mg', '1 g' -> 1000.0, '1.000 mg' -> 1000.0.
+    None si no se entiende o la unidad no es de masa ('5 ml', '2 %', '10 mg/ml').
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _DOSE_RE.search(str(value))
+    if not match:
+        return None
+    unit = match.group(2).lower() if match.group(2) else None
+    if unit not in _UNIT_TO_MG or match.group(3):
+        return None  # volumen o concentración (mg/ml), no una dosis en mg
+    number = match.group(1)
+    if re.fullmatch(_THOUSANDS, number):
+        number = number.replace('.', '')
+    return round(float(number.replace(',', '.')) * _UNIT_TO_MG[unit], 4)
+
+
+def normalize_count(value):
+    """ Número de comprimidos como int: 50, '50', '50 comprimidos' -> 50. None si no se entiende. """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = _COUNT_RE.search(str(value))
+    return int(match.group(1)) if match else None
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_index():
+    """ Índice del catálogo local, cargado una vez por proceso. """
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = DrugIndex.load()
+    return _default
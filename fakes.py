@@ -0,0 +1,394 @@
+"""
+Backends falsos de OpenAI y Supabase para el benchmark y las pruebas locales.
+Imitan la forma de las respuestas de los SDK reales (solo lo que usan los servicios)
+y permiten inyectar latencia y errores.
+"""
+import io
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+EXAMPLES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Examples')
+
+
+class FakeUpstreamError(Exception):
+    pass
+
+
+class Latency:
+    """
+    Latencia inyectada: `base` segundos con un `jitter` relativo, una fracción
+    `error_rate` de llamadas que fallan y una fracción `tail_rate` de llamadas lentas
+    que tardan `tail_latency` segundos (la cola de latencia de OpenAI).
+    """
+
+    def __init__(self, base=0.0, jitter=0.0, error_rate=0.0, seed=None, tail_rate=0.0, tail_latency=0.0):
+        self.base = base
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def wait(self, name):
+        with self._lock:
+            self.calls += 1
+            delay = self.base * (1 + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.error_rate
+            if self._random.random() < self.tail_rate:
+                delay = self.tail_latency
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise FakeUpstreamError(f'Error inyectado en {name}')
+
+
+def load_transcripts(path=None):
+    with open(path or os.path.join(EXAMPLES_FOLDER, 'transcripts.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_schedule(path=None):
+    with open(path or os.path.join(EXAMPLES_FOLDER, 'ExampleOutputQuerysOfTheDay'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _chat_response(content, prompt_tokens=0, completion_tokens=0, cached_tokens=0):
+    usage = SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+    )
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+class _FakeCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, messages, **kwargs):
+        owner = self._owner
+        parts = []
+        has_image = False
+        for message in messages:
+            content = message['content']
+            if isinstance(content, list):
+                for item in content:
+                    if item.get('type') == 'image_url':
+                        has_image = True
+                    else:
+                        parts.append(item.get('text', ''))
+            else:
+                parts.append(content)
+        prompt = '\n'.join(parts)
+        if has_image:
+            owner.vision_latency.wait('vision')
+        else:
+            owner.chat_latency.wait('chat')
+
+        if has_image:
+            content = '```json\n' + json.dumps(owner.medicine, ensure_ascii=False) + '\n```'
+        elif 'transcripción' in prompt:
+            event = owner.event_for(prompt)
+            content = '```json\n' + json.dumps({'event_json': event}, ensure_ascii=False) + '\n```'
+        else:
+            content = 'Hoy tomarás Lorazepam por la tarde y Paracetamol por la noche.'
+        prompt_tokens = len(prompt) // 4
+        return _chat_response(content, prompt_tokens=prompt_tokens, completion_tokens=len(content) // 4,
+                              cached_tokens=owner.cached_tokens(prompt, prompt_tokens))
+
+
+class _FakeTranscriptions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, file, **kwargs):
+        self._owner.whisper_latency.wait('whisper')
+        # 🔹 El SDK acepta un archivo abierto o una tupla (nombre, bytes, tipo)
+        name = file[0] if isinstance(file, tuple) else os.path.basename(getattr(file, 'name', '') or '')
+        text = self._owner.transcript_for(name)
+        return SimpleNamespace(text=text)
+
+
+class _FakeSpeech:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, voice, input, **kwargs):
+        self._owner.tts_latency.wait('tts')
+        # 🔹 Cabecera ID3 + relleno proporcional a la longitud del texto
+        return SimpleNamespace(content=b'ID3' + b'\x00' * (len(input) * 40))
+
+
+class FakeOpenAI:
+    """
+    Sustituto del cliente `OpenAI` con las rutas que usan los servicios:
+    chat.completions, audio.transcriptions y audio.speech.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, transcripts=None, seed=None,
+                 tail_rate=0.0, tail_latency=0.0):
+        tail = dict(tail_rate=tail_rate, tail_latency=tail_latency)
+        self.chat_latency = Latency(latency, jitter, error_rate, seed, **tail)
+        self.vision_latency = Latency(latency, jitter, error_rate, seed, **tail)
+        self.whisper_latency = Latency(latency, jitter, error_rate, seed, **tail)
+        self.tts_latency = Latency(latency, jitter, error_rate, seed, **tail)
+        self.transcripts = transcripts if transcripts is not None else load_transcripts()
+        self.medicine = {
+            "nombre_del_medicamento": "Lorazepam",
+            "numero_de_comprimidos": 50,
+            "cantidad_por_dosis": 0.5,
+        }
+        self._prompts = deque(maxlen=32)
+        self._prompts_lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_FakeCompletions(self))
+        self.audio = SimpleNamespace(transcriptions=_FakeTranscriptions(self), speech=_FakeSpeech(self))
+
+    def cached_tokens(self, prompt, prompt_tokens):
+        """
+        Simula el prompt caching de OpenAI: con 1024 tokens o más, se cachea el prefijo común
+        con prompts anteriores en bloques de 128 tokens (~4 caracteres por token).
+        """
+        with self._prompts_lock:
+            common = max((len(os.path.commonprefix((prompt, seen))) for seen in self._prompts), default=0)
+            self._prompts.append(prompt)
+        if prompt_tokens < 1024:
+            return 0
+        return (common // 4) // 128 * 128
+
+    def transcript_for(self, audio_name):
+        for entry in self.transcripts:
+            if entry.get('audio') and entry['audio'] == audio_name:
+                return entry['transcript']
+        return self.transcripts[0]['transcript']
+
+    def event_for(self, prompt):
+        for entry in self.transcripts:
+            if entry['transcript'] in prompt:
+                return dict(entry['expected'])
+        return {"frecuencia": "8", "primera_ingestion": "26/02/2025 08:00", "parte_afectada": "GENERAL_BODY"}
+
+
+def _split_filters(text):
+    """ Separa por las comas que no están dentro de paréntesis ni comillas. """
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(text):
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char in '()':
+            depth += 1 if char == '(' else -1
+        elif not quoted and char == ',' and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    return parts + [text[start:]]
+
+
+def _condition(text):
+    column, op, value = text.split('.', 2)
+    if value.startswith('"'):
+        value = value[1:-1]
+    else:
+        value = int(value) if value.lstrip('-').isdigit() else value
+    if op == 'gt':
+        return lambda row: row.get(column) is not None and row[column] > value
+    if op == 'eq':
+        return lambda row: row.get(column) == value
+    raise ValueError(f'Operador no soportado por el fake: {op}')
+
+
+class _FakeQuery:
+    """ Subconjunto del query builder de Supabase: insert, select, gt, or_, order y limit. """
+
+    def __init__(self, owner, table):
+        self._owner = owner
+        self._table = table
+        self._op = None
+        self._payload = None
+        self._filters = []
+        self._order = []
+        self._limit = None
+
+    def insert(self, row):
+        self._op = 'insert'
+        self._payload = row
+        return self
+
+    def select(self, columns='*'):
+        self._op = 'select'
+        self._payload = None if columns == '*' else [c.strip() for c in columns.split(',')]
+        return self
+
+    def gt(self, column, value):
+        self._filters.append(lambda row: row.get(column) is not None and row[column] > value)
+        return self
+
+    def or_(self, filters):
+        """ Solo lo que usa la réplica: condiciones col.gt.valor / col.eq.valor y and(...), separadas por comas. """
+        alternatives = [[_condition(part) for part in _split_filters(alternative[4:-1])]
+                        if alternative.startswith('and(') else [_condition(alternative)]
+                        for alternative in _split_filters(filters)]
+        self._filters.append(lambda row: any(all(c(row) for c in conditions) for conditions in alternatives))
+        return self
+
+    def order(self, column, desc=False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def execute(self):
+        self._owner.latency.wait(f'table:{self._table}')
+        if self._op == 'insert':
+            rows = self._payload if isinstance(self._payload, list) else [self._payload]
+            inserted = self._owner.insert_rows(self._table, rows)
+            return SimpleNamespace(data=inserted)
+        with self._owner._lock:
+            rows = [row for row in self._owner.tables.get(self._table, []) if all(f(row) for f in self._filters)]
+        for column, desc in reversed(self._order):  # sort estable: la primera columna manda
+            rows.sort(key=lambda row: row.get(column), reverse=desc)
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        if self._payload is not None:
+            rows = [{column: row.get(column) for column in self._payload} for row in rows]
+        return SimpleNamespace(data=[dict(row) for row in rows])
+
+
+class _FakeRpc:
+    def __init__(self, owner, name, params):
+        self._owner = owner
+        self._name = name
+        self._params = params
+
+    def execute(self):
+        self._owner.latency.wait(f'rpc:{self._name}')
+        if self._name != 'get_tomas_por_franja':
+            raise FakeUpstreamError(f'RPC desconocida: {self._name}')
+        start, end = self._params['start_time'], self._params['end_time']
+        data = [toma for toma in self._owner.tomas if start <= toma['hora_toma'] < end]
+        return SimpleNamespace(data=data)
+
+
+class FakeSupabase:
+    """
+    Sustituto del cliente de Supabase: inserciones en memoria y la RPC
+    `get_tomas_por_franja` servida desde el ejemplo de Examples/.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, schedule=None, seed=None,
+                 tail_rate=0.0, tail_latency=0.0):
+        self.latency = Latency(latency, jitter, error_rate, seed, tail_rate=tail_rate, tail_latency=tail_latency)
+        self.tables = {}
+        self._lock = threading.Lock()
+        self._next_ids = {}  # 🔹 Secuencia de id por tabla, como en Postgres
+        schedule = schedule if schedule is not None else load_schedule()
+        # 🔹 Las tomas del ejemplo aparecen repetidas en varias franjas: se deduplican
+        unique = {}
+        for tomas in schedule.values():
+            for toma in tomas:
+                unique[(toma['medicamento'], toma['paciente'], toma['hora_toma'])] = toma
+        self.tomas = sorted(unique.values(), key=lambda t: t['hora_toma'])
+        self._seed_tables()
+
+    def _seed_tables(self):
+        """
+        Filas de `medicamento` y `tratamiento` coherentes con el ejemplo: la frecuencia es
+        la menor separación entre las tomas de cada medicamento (réplica local, recordatorios).
+        """
+        groups = {}
+        for toma in self.tomas:
+            groups.setdefault((toma['medicamento'], toma['paciente']), []).append(toma)
+        for (medicamento, paciente), tomas in groups.items():
+            hours = sorted(int(t['hora_toma'][:2]) * 60 + int(t['hora_toma'][3:5]) for t in tomas)
+            gaps = [b - a for a, b in zip(hours, hours[1:]) if b > a]
+            first = tomas[0]
+            self.insert_rows('medicamento', [{
+                "nombre": medicamento,
+                "cantidad_por_dosis": first['cantidad_por_dosis'],
+                "numero_comprimidos": first['dosis_restantes'],
+                "parte_afectada": first['parte_afectada'],
+            }])
+            self.insert_rows('tratamiento', [{
+                "nombre_medicamento": medicamento,
+                "nombre_paciente": paciente,
+                "fecha_inicio": first['fecha_inicio'].replace('T', ' '),
+                "frecuencia": min(gaps) / 60 if gaps else 24,
+                "imagen": None,
+            }])
+
+    def insert_rows(self, table, rows):
+        inserted = []
+        with self._lock:
+            for row in rows:
+                next_id = self._next_ids.get(table, 1)
+                self._next_ids[table] = next_id + 1
+                row = {"id": next_id, **row}
+                self.tables.setdefault(table, []).append(row)
+                inserted.append(row)
+        return inserted
+
+    def table(self, name):
+        return _FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        return _FakeRpc(self, name, params)
+
+
+class _FakeHttpResponse:
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.content = response.get_data()
+        self.headers = dict(response.headers)
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeHttp:
+    """
+    Sustituto del módulo `requests` para el orquestador: enruta las URLs
+    conocidas a los `test_client` de Flask de los otros servicios, en proceso.
+    """
+
+    class RequestException(Exception):
+        pass
+
+    def __init__(self, routes):
+        self.routes = routes  # {url: (flask_app, path)}
+
+    def post(self, url, files=None, json=None, headers=None, **kwargs):
+        if url not in self.routes:
+            raise self.RequestException(f'URL no enrutada: {url}')
+        app, path = self.routes[url]
+        with app.test_client() as http:
+            if files is not None:
+                # 🔹 Como `requests`: archivo abierto o tupla (nombre, bytes[, tipo])
+                data = {name: (io.BytesIO(f[1]), f[0]) if isinstance(f, tuple)
+                        else (f, os.path.basename(getattr(f, 'name', name))) for name, f in files.items()}
+                response = http.post(path, data=data, headers=headers, content_type='multipart/form-data')
+            else:
+                response = http.post(path, json=json, headers=headers)
+        return _FakeHttpResponse(response)
+
+
+def install(module, openai=None, supabase=None, http=None):
+    """
+    Sustituye los clientes globales de un servicio ya importado.
+    """
+    if openai is not None and hasattr(module, 'client'):
+        module.client = openai
+    if supabase is not None and hasattr(module, 'supabase'):
+        module.supabase = supabase
+        if getattr(module, 'REPLICA', None) is not None:
+            module.REPLICA.supabase = supabase  # la réplica se sincroniza contra el fake
+    if http is not None and hasattr(module, 'requests'):
+        module.requests = http
+    return module
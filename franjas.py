@@ -0,0 +1,184 @@
+"""
+Franjas horarias del día para agrupar las tomas.
+
+Las horas se validan al cargar y se precompilan a segundos desde medianoche, así
+`slot_for('17:30:00')` es una búsqueda binaria (bisect) sin comparar strings.
+Los intervalos son [inicio, fin): una toma a las 17:30 cae solo en BEFOREDINNER.
+
+Franjas por paciente (p. ej. turnos de noche): fichero JSON en FRANJAS_CONFIG
+(por defecto data/franjas_pacientes.json, opcional) con el formato
+
+    {"Candela": {"JUSTAWAKE": ["14:00", "15:00"], "PREVIOUSTOSLEEP": ["23:00", "07:00"], ...}}
+
+Una franja puede cruzar la medianoche (fin < inicio).
+"""
+import json
+import os
+import threading
+from bisect import bisect_right
+from typing import NamedTuple
+
+DAY_SECONDS = 24 * 3600
+
+DEFAULT_FRANJAS = {
+    "JUSTAWAKE": ("06:00:00", "07:00:00"),
+    "BEFOREBREAKFAST": ("07:00:00", "08:00:00"),
+    "AFTERBREAKFAST": ("08:00:00", "10:30:00"),
+    "MIDDAY": ("10:30:00", "12:30:00"),
+    "BEFORELUNCH": ("12:30:00", "13:30:00"),
+    "AFTERLUNCH": ("13:30:00", "15:30:00"),
+    "MIDAFTERNOON": ("15:30:00", "17:30:00"),
+    "BEFOREDINNER": ("17:30:00", "19:30:00"),
+    "AFTERDINNER": ("19:30:00", "21:30:00"),
+    "PREVIOUSTOSLEEP": ("21:30:00", "24:00:00"),
+}
+
+FRANJAS_CONFIG = os.getenv('FRANJAS_CONFIG', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          'data', 'franjas_pacientes.json'))
+
+
+def parse_time(value):
+    """
+    'HH:MM' o 'HH:MM:SS' (también 'HH:MM:SS.ffffff' y '24:00') -> segundos desde medianoche.
+    Lanza ValueError si el formato no es válido.
+    """
+    if isinstance(value, (int, float)):
+        seconds = int(value)
+    else:
+        parts = str(value).split(':')
+        if len(parts) not in (2, 3) or not all(p.replace('.', '', 1).isdigit() for p in parts):
+            raise ValueError(f"Hora no válida: {value!r}")
+        hours, minutes = int(parts[0]), int(parts[1])
+        secs = int(float(parts[2])) if len(parts) == 3 else 0
+        if minutes > 59 or secs > 59:
+            raise ValueError(f"Hora no válida: {value!r}")
+        seconds = hours * 3600 + minutes * 60 + secs
+    if not 0 <= seconds <= DAY_SECONDS:
+        raise ValueError(f"Hora fuera del día: {value!r}")
+    return seconds
+
+
+def format_time(seconds):
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class Slot(NamedTuple):
+    name: str
+    start: int  # segundos desde medianoche
+    end: int    # exclusivo; puede ser menor que start si cruza la medianoche
+
+    @property
+    def bounds(self):
+        """ (inicio, fin) como 'HH:MM:SS', el formato del RPC get_tomas_por_franja. """
+        return format_time(self.start), format_time(self.end)
+
+
+class SlotTable:
+    """
+    Franjas validadas y precompiladas: `starts` ordenado para bisect y, para cada
+    posición, el fin del tramo y el nombre de la franja.
+    """
+
+    def __init__(self, slots):
+        self.slots = list(slots)
+        self.order = [slot.name for slot in self.slots]
+        if len(set(self.order)) != len(self.order):
+            raise ValueError("Hay franjas con el nombre repetido.")
+
+        segments = []
+        for slot in self.slots:
+            if slot.start == slot.end:
+                raise ValueError(f"La franja {slot.name} está vacía.")
+            if slot.start < slot.end:
+                segments.append((slot.start, slot.end, slot.name))
+            else:  # 🔹 Cruza la medianoche: dos tramos con el mismo nombre
+                segments.append((slot.start, DAY_SECONDS, slot.name))
+                if slot.end:
+                    segments.append((0, slot.end, slot.name))
+        segments.sort()
+        for (_, end, name), (start, _, other) in zip(segments, segments[1:]):
+            if start < end:
+                raise ValueError(f"Las franjas {name} y {other} se solapan.")
+
+        self.starts = [start for start, _, _ in segments]
+        self.ends = [end for _, end, _ in segments]
+        self.names = [name for _, _, name in segments]
+
+    @classmethod
+    def from_dict(cls, franjas):
+        """ {'NOMBRE': ('HH:MM:SS', 'HH:MM:SS'), ...} -> SlotTable (ValueError si no es válido). """
+        slots = []
+        for name, bounds in franjas.items():
+            if len(bounds) != 2:
+                raise ValueError(f"La franja {name} debe tener inicio y fin.")
+            start, end = parse_time(bounds[0]), parse_time(bounds[1])
+            slots.append(Slot(name, start, end))
+        return cls(slots)
+
+    def slot_for(self, value):
+        """ Nombre de la franja que contiene la hora ('HH:MM:SS' o segundos), o None. O(log n). """
+        seconds = parse_time(value) if not isinstance(value, int) else value
+        i = bisect_right(self.starts, seconds) - 1
+        if i >= 0 and seconds < self.ends[i]:
+            return self.names[i]
+        return None
+
+    def bucket(self, tomas, key='hora_toma'):
+        """
+        Agrupa las tomas por franja en el orden de la tabla. Las que no caen en ninguna
+        franja (o no tienen una hora válida) se descartan.
+        """
+        result = {name: [] for name in self.order}
+        for toma in tomas:
+            try:
+                name = self.slot_for(toma[key])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if name is not None:
+                result[name].append(toma)
+        return result
+
+    def sort_key(self, name):
+        """ Para ordenar nombres de franja cronológicamente (las desconocidas al final). """
+        return self.order.index(name) if name in self.order else len(self.order)
+
+
+DEFAULT_TABLE = SlotTable.from_dict(DEFAULT_FRANJAS)
+
+_patient_tables = None
+_patient_lock = threading.Lock()
+
+
+def load_patient_tables(path=FRANJAS_CONFIG):
+    """ Tablas por paciente del fichero de configuración ({} si no existe). Valida todas al cargar. """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    return {patient: SlotTable.from_dict(franjas) for patient, franjas in config.items()}
+
+
+def bucket_by_patient(tomas, key='hora_toma', patient_key='paciente'):
+    """
+    Agrupa tomas de varios pacientes, cada una con la tabla de franjas de su paciente.
+    Las claves siguen el orden de la tabla por defecto; las franjas propias de un paciente se añaden al final.
+    """
+    result = {name: [] for name in DEFAULT_TABLE.order}
+    for toma in tomas:
+        try:
+            name = table_for(toma.get(patient_key)).slot_for(toma[key])
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+        if name is not None:
+            result.setdefault(name, []).append(toma)
+    return result
+
+
+def table_for(patient=None):
+    """ Tabla de franjas del paciente o la tabla por defecto. """
+    global _patient_tables
+    if _patient_tables is None:
+        with _patient_lock:
+            if _patient_tables is None:
+                _patient_tables = load_patient_tables()
+    return _patient_tables.get(patient, DEFAULT_TABLE) if patient else DEFAULT_TABLE
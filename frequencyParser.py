@@ -0,0 +1,248 @@
+"""
+Parser determinista de las frases más habituales de las transcripciones
+("dos veces al día, empiezo mañana a las 9", "cada 8 horas", "el 1 de marzo a las 8 y media").
+
+Devuelve la misma estructura que 3_textToJson.py pide al modelo
+(frecuencia / primera_ingestion / parte_afectada) y una confianza; si la confianza es
+baja el servicio recurre al modelo.
+
+    python frequencyParser.py      # precisión y latencia sobre Examples/transcripts.json
+"""
+import datetime
+import json
+import os
+import re
+import time
+import unicodedata
+
+NULL_VALUE = "null_NoEspecify"
+DEFAULT_BODY_PART = "GENERAL_BODY"
+# 🔹 Confianza mínima para responder sin llamar al modelo (frecuencia + fecha + hora = 1.0)
+MIN_CONFIDENCE = float(os.getenv('PARSER_MIN_CONFIDENCE', '0.9'))
+
+NUMBERS = {
+    'un': 1, 'una': 1, 'uno': 1, 'dos': 2, 'tres': 3, 'cuatro': 4, 'cinco': 5, 'seis': 6, 'siete': 7,
+    'ocho': 8, 'nueve': 9, 'diez': 10, 'once': 11, 'doce': 12, 'trece': 13, 'catorce': 14, 'quince': 15,
+    'dieciseis': 16, 'diecisiete': 17, 'dieciocho': 18, 'diecinueve': 19, 'veinte': 20, 'veintiuno': 21,
+    'veintidos': 22, 'veintitres': 23, 'veinticuatro': 24, 'treinta': 30, 'treintaiuno': 31,
+}
+MONTHS = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6, 'julio': 7,
+    'agosto': 8, 'septiembre': 9, 'setiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12,
+}
+WEEKDAYS = {'lunes': 0, 'martes': 1, 'miercoles': 2, 'jueves': 3, 'viernes': 4, 'sabado': 5, 'domingo': 6}
+
+# Palabras clave (sin tildes) de cada categoría de parte afectada
+BODY_PARTS = {
+    "HEART_RELATED": ('corazon', 'tension', 'hipertension', 'presion arterial', 'colesterol', 'arritmia',
+                      'cardi', 'circulacion', 'sintrom', 'infarto'),
+    "DIGESTIVE": ('estomago', 'digest', 'intestin', 'acidez', 'reflujo', 'diarrea', 'estrenimiento',
+                  'gastr', 'nauseas', 'vomito', 'barriga', 'tripa'),
+    "BRAIN_RELATED": ('cabeza', 'migrana', 'cerebr', 'memoria', 'epilepsia', 'parkinson', 'alzheimer',
+                      'mareo', 'vertigo', 'neurolog'),
+    "PSYCHOLOGICAL": ('nervios', 'ansiedad', 'depresion', 'insomnio', 'dormir', 'estres', 'animo',
+                      'angustia', 'panico', 'psicolog', 'psiquiatr'),
+}
+
+# 🔹 El número termina en límite de palabra: "a la dosis" no es "a la dos"
+_NUM = r"(\d+|" + "|".join(sorted(NUMBERS, key=len, reverse=True)) + r")(?!\w)"
+_FREQ_HOURS_RE = re.compile(rf"\bcada\s+{_NUM}\s+horas?\b")
+_FREQ_TIMES_RE = re.compile(rf"\b{_NUM}\s+veces\s+(?:al|por|cada|a\s+el)\s+dia\b|\b{_NUM}\s+veces\s+diarias\b")
+_FREQ_DAILY_RE = re.compile(r"\b(?:una\s+vez\s+(?:al|por)\s+dia|una\s+vez\s+diaria|cada\s+dia|todos\s+los\s+dias|"
+                            r"diariamente)\b")
+_FREQ_DAYS_RE = re.compile(rf"\bcada\s+{_NUM}\s+dias\b")
+
+_TODAY_RE = re.compile(r"\bhoy\b")
+_DAY_AFTER_RE = re.compile(r"\bpasado\s+manana\b")
+# "mañana" como día, no "por/de la mañana"
+_TOMORROW_RE = re.compile(r"(?<!la )(?<!pasado )\bmanana\b")
+_NUMERIC_DATE_RE = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b")
+_TEXT_DATE_RE = re.compile(rf"\b(?:el\s+)?(?:dia\s+)?{_NUM}\s+de\s+({'|'.join(MONTHS)})(?:\s+(?:de|del)\s+(\d{{4}}))?\b")
+_WEEKDAY_RE = re.compile(rf"\bel\s+(?:proximo\s+)?({'|'.join(WEEKDAYS)})\b")
+_TIME_RE = re.compile(rf"\ba\s+la(?:s)?\s+{_NUM}(?::(\d{{2}})|\s+y\s+(media|cuarto)|\s+menos\s+cuarto)?"
+                      r"(?:\s+(?:de|por)\s+la\s+(manana|tarde|noche))?")
+_PERIOD_RE = re.compile(r"\b(?:de|por)\s+la\s+(tarde|noche)\b")
+
+
+def normalize(text):
+    """ Minúsculas y sin tildes ('mañana' -> 'manana'), conservando ':' y '/'. """
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(re.sub(r"[^a-z0-9:/ ]+", ' ', text).split())
+
+
+def _number(token):
+    return int(token) if token.isdigit() else NUMBERS.get(token)
+
+
+class ParseResult:
+    def __init__(self, event, confidence, matched):
+        self.event = event
+        self.confidence = confidence
+        self.matched = matched  # campos reconocidos (para métricas y depuración)
+
+    def as_response(self):
+        """ Mismo formato que devuelve el modelo en 3_textToJson.py. """
+        return {"event_json": dict(self.event)}
+
+
+def parse_frequency(text):
+    """ Horas entre tomas como int, o None. Devuelve también cuántas reglas distintas coincidieron. """
+    found = set()
+    for match in _FREQ_HOURS_RE.finditer(text):
+        found.add(_number(match.group(1)))
+    for match in _FREQ_TIMES_RE.finditer(text):
+        times = _number(match.group(1) or match.group(2))
+        if times:
+            found.add(round(24 / times))
+    if _FREQ_DAILY_RE.search(text):
+        found.add(24)
+    for match in _FREQ_DAYS_RE.finditer(text):
+        found.add(24 * _number(match.group(1)))
+    found.discard(None)
+    found.discard(0)
+    if len(found) == 1:
+        return found.pop(), 1
+    return None, len(found)
+
+
+def parse_date(text, today):
+    candidates = []
+    if _DAY_AFTER_RE.search(text):
+        candidates.append(today + datetime.timedelta(days=2))
+    if _TOMORROW_RE.search(_DAY_AFTER_RE.sub(' ', text)):
+        candidates.append(today + datetime.timedelta(days=1))
+    if _TODAY_RE.search(text):
+        candidates.append(today)
+    for match in _NUMERIC_DATE_RE.finditer(text):
+        day, month, year = int(match.group(1)), int(match.group(2)), match.group(3)
+        year = int(year) + (2000 if year and len(year) == 2 else 0) if year else today.year
+        try:
+            candidates.append(datetime.date(year, month, day))
+        except ValueError:
+            pass
+    for match in _TEXT_DATE_RE.finditer(text):
+        day, month = _number(match.group(1)), MONTHS[match.group(2)]
+        year = int(match.group(3)) if match.group(3) else today.year
+        try:
+            date = datetime.date(year, month, day)
+        except (TypeError, ValueError):
+            continue
+        if not match.group(3) and date < today:
+            date = date.replace(year=year + 1)
+        candidates.append(date)
+    for match in _WEEKDAY_RE.finditer(text):
+        ahead = (WEEKDAYS[match.group(1)] - today.weekday()) % 7 or 7
+        candidates.append(today + datetime.timedelta(days=ahead))
+
+    unique = set(candidates)
+    return (unique.pop(), 1) if len(unique) == 1 else (None, len(unique))
+
+
+def parse_time(text):
+    candidates = set()
+    global_period = _PERIOD_RE.search(text)
+    for match in _TIME_RE.finditer(text):
+        hour = _number(match.group(1))
+        if hour is None or hour > 24:
+            continue
+        minute = int(match.group(2)) if match.group(2) else 0
+        if match.group(3) == 'media':
+            minute = 30
+        elif match.group(3) == 'cuarto':
+            minute = 15
+        elif 'menos cuarto' in match.group(0):
+            hour, minute = hour - 1, 45
+        period = match.group(4) or (global_period.group(1) if global_period and not match.group(2) else None)
+        if period in ('tarde', 'noche') and hour < 12:
+            hour += 12
+        elif period == 'noche' and hour == 12:
+            hour = 0
+        if hour == 24:
+            hour = 0
+        if 0 <= hour < 24 and 0 <= minute < 60:
+            candidates.add((hour, minute))
+    return (candidates.pop(), 1) if len(candidates) == 1 else (None, len(candidates))
+
+
+def parse_body_part(text):
+    matched = [category for category, keywords in BODY_PARTS.items() if any(k in text for k in keywords)]
+    return (matched[0], 1) if len(matched) == 1 else (DEFAULT_BODY_PART, len(matched))
+
+
+def parse(transcript, today=None):
+    """
+    Analiza una transcripción. La confianza suma 0.4 por la frecuencia, 0.3 por la fecha y
+    0.3 por la hora de la primera toma; las coincidencias contradictorias restan.
+    """
+    today = today or datetime.date.today()
+    text = normalize(transcript)
+
+    frequency, freq_hits = parse_frequency(text)
+    date, date_hits = parse_date(text, today)
+    hour_minute, time_hits = parse_time(text)
+    body_part, body_hits = parse_body_part(text)
+
+    confidence = 0.4 * (frequency is not None) + 0.3 * (date is not None) + 0.3 * (hour_minute is not None)
+    # 🔹 Varias frecuencias/fechas/horas o varias categorías: mejor que decida el modelo
+    if freq_hits > 1 or date_hits > 1 or time_hits > 1 or body_hits > 1:
+        confidence -= 0.5
+
+    if date is not None and hour_minute is not None:
+        first = datetime.datetime.combine(date, datetime.time(*hour_minute)).strftime("%d/%m/%Y %H:%M")
+    elif date is not None:
+        first = date.strftime("%d/%m/%Y")
+    else:
+        first = NULL_VALUE
+
+    event = {
+        "frecuencia": str(frequency) if frequency is not None else NULL_VALUE,
+        "primera_ingestion": first,
+        "parte_afectada": body_part,
+    }
+    matched = [name for name, value in (('frecuencia', frequency), ('fecha', date), ('hora', hour_minute))
+               if value is not None]
+    return ParseResult(event, max(confidence, 0.0), matched)
+
+
+def evaluate(path=None, min_confidence=MIN_CONFIDENCE, repeat=200):
+    """
+    Precisión y latencia del parser sobre transcripciones grabadas con su salida esperada.
+    """
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Examples', 'transcripts.json')
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+
+    accepted = correct = field_total = field_correct = 0
+    timings = []
+    for entry in entries:
+        today = datetime.date.fromisoformat(entry['reference_date'])
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = parse(entry['transcript'], today)
+        timings.append((time.perf_counter() - start) / repeat)
+
+        expected = entry['expected']
+        fields_ok = {k: result.event[k] == v for k, v in expected.items()}
+        field_total += len(fields_ok)
+        field_correct += sum(fields_ok.values())
+        if result.confidence >= min_confidence:
+            accepted += 1
+            correct += all(fields_ok.values())
+            status = '✅' if all(fields_ok.values()) else '❌'
+        else:
+            status = '↪ modelo'
+        print(f"{status:9} conf={result.confidence:.1f}  {entry['transcript'][:70]}")
+        for key, ok in fields_ok.items():
+            if not ok and result.confidence >= min_confidence:
+                print(f"            {key}: {result.event[key]!r} != {expected[key]!r}")
+
+    timings.sort()
+    print(f"\nTranscripciones: {len(entries)}  resueltas sin modelo: {accepted} ({accepted / len(entries):.0%})")
+    print(f"Precisión en las resueltas: {correct}/{accepted}  |  campos correctos (todas): {field_correct}/{field_total}")
+    print(f"Latencia por transcripción: p50={timings[len(timings) // 2] * 1e6:.0f} µs  max={timings[-1] * 1e6:.0f} µs")
+    return {'entries': len(entries), 'accepted': accepted, 'correct': correct,
+            'field_accuracy': field_correct / field_total if field_total else 0.0}
+
+
+if __name__ == '__main__':
+    evaluate()
@@ -0,0 +1,213 @@
+"""
+Pool acotado para el trabajo de CPU con imágenes (decodificar, filtro bilateral, Canny,
+PNG, base64), fuera de los hilos de los requests, que quedan libres para esperar al modelo.
+
+- IMAGE_POOL=process (por defecto): procesos; la imagen se pasa por memoria compartida
+  (el worker la lee con np.frombuffer sin copiarla) y solo vuelve el resultado.
+- IMAGE_POOL=thread: hilos (OpenCV libera el GIL); IMAGE_POOL=off: en el propio request.
+
+Si hay IMAGE_POOL_WORKERS + IMAGE_POOL_QUEUE trabajos pendientes, los nuevos esperan como
+mucho IMAGE_POOL_MAX_WAIT segundos y después se rechazan con PoolSaturated (backpressure).
+
+Si un proceso worker muere (p. ej. por falta de memoria) el pool queda roto: se crea otro y
+los trabajos siguientes lo usan. Las etapas medidas en el worker (image_decode) vuelven con el
+resultado y se registran en /metrics del proceso del request.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import instrumentation
+
+MODE = os.getenv('IMAGE_POOL', 'process')
+WORKERS = int(os.getenv('IMAGE_POOL_WORKERS', '0')) or os.cpu_count() or 1
+QUEUE = int(os.getenv('IMAGE_POOL_QUEUE', str(2 * WORKERS)))
+MAX_WAIT = float(os.getenv('IMAGE_POOL_MAX_WAIT', '5'))
+
+
+class PoolSaturated(Exception):
+    """ No hay hueco en el pool ni en su cola: el cliente debe reintentar más tarde. """
+
+
+def _run_shared(fn, shm_name, size, submitted_at, args):
+    """ En el proceso worker: lee la imagen de la memoria compartida y ejecuta fn. """
+    started = time.time()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        with instrumentation.capture_stages() as stages:
+            value = fn(shm.buf[:size], *args)
+        return value, started - submitted_at, stages
+    finally:
+        try:
+            shm.close()
+        except BufferError:
+            pass  # Queda alguna vista viva (p. ej. en una traza); se libera al recolectarla
+
+
+def _run_direct(fn, data, submitted_at, args):
+    # 🔹 En hilos las etapas ya se registran en este proceso
+    return fn(data, *args), time.time() - submitted_at, []
+
+
+class ImagePool:
+    def __init__(self, mode=MODE, workers=WORKERS, queue=QUEUE, max_wait=MAX_WAIT):
+        self.mode = mode
+        self.workers = workers
+        self.capacity = workers + queue
+        self.max_wait = max_wait
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.mode == 'process':
+                        # 'spawn': seguro con los hilos de Flask/gunicorn
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                             mp_context=multiprocessing.get_context('spawn'))
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                            thread_name_prefix='omed-image')
+        return self._executor
+
+    def _discard_executor(self, broken):
+        """ Olvida un ProcessPoolExecutor roto (un worker murió); el siguiente submit crea otro. """
+        with self._lock:
+            if self._executor is not broken:
+                return  # otro hilo ya lo ha sustituido
+            self._executor = None
+        instrumentation.inc('omed_image_pool_broken_total')
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _submit_shared(self, fn, data, args):
+        """ Copia data a memoria compartida y lo envía al pool; reintenta una vez si el pool está roto. """
+        for attempt in range(2):
+            executor = self._get_executor()
+            shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+            try:
+                shm.buf[:len(data)] = data
+                return executor.submit(_run_shared, fn, shm.name, len(data), time.time(), args), shm, executor
+            except BaseException as e:
+                shm.close()
+                shm.unlink()
+                if isinstance(e, BrokenProcessPool) and attempt == 0:
+                    self._discard_executor(executor)
+                    continue
+                raise
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.max_wait):
+            with self._lock:
+                self.rejected += 1
+            instrumentation.inc('omed_image_pool_rejected_total')
+            raise PoolSaturated(f'El pool de imágenes está saturado ({self.capacity} trabajos pendientes).')
+        with self._lock:
+            self._pending += 1
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def submit(self, fn, data, *args):
+        """
+        Ejecuta fn(datos, *args) en el pool y devuelve un Future con el resultado.
+        `fn` debe ser una función de módulo (se serializa) y aceptar bytes o memoryview.
+        Lanza PoolSaturated si no hay hueco tras esperar max_wait.
+        """
+        self._acquire()
+        try:
+            if self.mode == 'process':
+                future, shm, executor = self._submit_shared(fn, data, args)
+            else:
+                shm = None
+                executor = self._get_executor()
+                future = executor.submit(_run_direct, fn, data, time.time(), args)
+        except BaseException:
+            self._release()
+            raise
+
+        def done(finished):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            self._release()
+            if not finished.cancelled() and isinstance(finished.exception(), BrokenProcessPool):
+                self._discard_executor(executor)
+
+        future.add_done_callback(done)
+        return _Result(future)
+
+    def run(self, fn, data, *args):
+        """ Como submit, esperando el resultado (o ejecutándolo aquí si IMAGE_POOL=off). """
+        if self.mode == 'off':
+            return fn(data, *args)
+        return self.submit(fn, data, *args).result()
+
+    def map(self, fn, items, *args):
+        """ fn sobre cada elemento de items, en paralelo y manteniendo el orden. """
+        if self.mode == 'off':
+            return [fn(item, *args) for item in items]
+        results = []
+        try:
+            for item in items:
+                results.append(self.submit(fn, item, *args))
+        except PoolSaturated:
+            for result in results:
+                result.cancel()
+            raise
+        return [result.result() for result in results]
+
+    def stats(self):
+        return {'mode': self.mode, 'workers': self.workers, 'capacity': self.capacity,
+                'pending': self._pending, 'rejected': self.rejected}
+
+
+class _Result:
+    """
+    Future que registra en /metrics la espera en cola del trabajo y las etapas medidas
+    en el worker al obtener su resultado.
+    """
+
+    def __init__(self, future):
+        self._future = future
+
+    def cancel(self):
+        return self._future.cancel()
+
+    def result(self, timeout=None):
+        value, queue_wait, stages = self._future.result(timeout)
+        instrumentation.histogram('omed_image_pool_queue_wait_seconds').observe(queue_wait)
+        for stage, seconds in stages:
+            instrumentation.observe(stage, seconds)
+        return value
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_pool():
+    """ Pool compartido del proceso, creado en el primer uso. """
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = ImagePool()
+    return _default
+
+
+@instrumentation.register_collector
+def _pool_samples():
+    if _default is None:
+        return []
+    return [('omed_image_pool_pending', {}, _default.stats()['pending']),
+            ('omed_image_pool_capacity', {}, _default.capacity)]
@@ -0,0 +1,288 @@
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# 🔹 Cuantiles que se publican en /metrics
+QUANTILES = (0.5, 0.95, 0.99)
+# 🔹 Número de muestras recientes que se guardan por histograma (memoria acotada)
+RESERVOIR_SIZE = 2048
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+_collectors = []
+_service = {'name': 'omed'}
+
+
+class Histogram:
+    """
+    Histograma de latencias: cuenta y suma totales más una ventana de las
+    últimas RESERVOIR_SIZE muestras para calcular p50/p95/p99.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=RESERVOIR_SIZE)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.sum
+        quantiles = {}
+        for q in QUANTILES:
+            if samples:
+                quantiles[q] = samples[min(len(samples) - 1, int(q * len(samples)))]
+            else:
+                quantiles[q] = 0.0
+        return {'count': count, 'sum': total, 'quantiles': quantiles}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def histogram(name, **labels):
+    key = _key(name, labels)
+    hist = _histograms.get(key)
+    if hist is None:
+        with _lock:
+            hist = _histograms.setdefault(key, Histogram())
+    return hist
+
+
+_capture = threading.local()
+
+
+def observe(stage, seconds):
+    """ Registra la duración (en segundos) de una etapa del pipeline. """
+    stages = getattr(_capture, 'stages', None)
+    if stages is not None:
+        stages.append((stage, seconds))
+        return
+    histogram('omed_stage_seconds', stage=stage).observe(seconds)
+
+
+@contextmanager
+def capture_stages():
+    """
+    Recoge las etapas medidas dentro del bloque como [(etapa, segundos)] en lugar de
+    registrarlas: en los procesos del pool de imágenes, que no sirven /metrics, para
+    devolverlas con el resultado y registrarlas en el proceso del request.
+    """
+    stages = []
+    _capture.stages = stages
+    try:
+        yield stages
+    finally:
+        _capture.stages = None
+
+
+@contextmanager
+def timer(stage):
+    """
+    Mide el bloque como una etapa: `with timer('vision_call'): ...`
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def register_collector(fn):
+    """
+    Registra una función que devuelve muestras adicionales para /metrics como
+    una lista de (nombre, labels, valor) o (nombre, labels, valor, tipo). El tipo es
+    'gauge' por defecto (estado, colas, lag); los totales que solo crecen usan 'counter'.
+    Se llama en cada scrape.
+    """
+    with _lock:
+        _collectors.append(fn)
+    return fn
+
+
+def reset():
+    """ Borra todas las métricas (útil entre escenarios del benchmark). """
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+
+
+def stage_summary():
+    """ Devuelve {stage: {count, sum, p50, p95, p99}} para informes. """
+    summary = {}
+    with _lock:
+        histograms = list(_histograms.items())
+    for (name, labels), hist in histograms:
+        snap = hist.snapshot()
+        label = ','.join(f'{k}={v}' for k, v in labels)
+        entry = {'count': snap['count'], 'sum': snap['sum']}
+        for q, v in snap['quantiles'].items():
+            entry[f'p{int(q * 100)}'] = v
+        summary[f'{name}{{{label}}}'] = entry
+    return summary
+
+
+def _format_labels(labels):
+    labels = {'service': _service['name'], **dict(labels)}
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+def render():
+    """ Genera el texto de /metrics en formato Prometheus. """
+    lines = []
+    seen = set()
+    # 🔹 Copia bajo el lock: otro hilo puede crear un histograma durante el scrape
+    with _lock:
+        histograms = sorted(_histograms.items())
+    for (name, labels), hist in histograms:
+        if name not in seen:
+            lines.append(f'# TYPE {name} summary')
+            seen.add(name)
+        snap = hist.snapshot()
+        for q, v in snap['quantiles'].items():
+            lines.append(f'{name}{_format_labels(labels + (("quantile", q),))} {v:.6f}')
+        lines.append(f'{name}_count{_format_labels(labels)} {snap["count"]}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {snap["sum"]:.6f}')
+
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        collectors = list(_collectors)
+    for kind, items in (('counter', counters), ('gauge', gauges)):
+        for (name, labels), value in items:
+            if name not in seen:
+                lines.append(f'# TYPE {name} {kind}')
+                seen.add(name)
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    for collect in collectors:
+        for name, labels, value, *kind in collect():
+            if name not in seen:
+                lines.append(f'# TYPE {name} {kind[0] if kind else "gauge"}')
+                seen.add(name)
+            lines.append(f'{name}{_format_labels(tuple(sorted(labels.items())))} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss():
+    """ RSS actual del proceso en bytes (Linux: /proc/self/statm; si no, el máximo histórico). """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss():
+    """ RSS máximo del proceso desde que arrancó, en bytes. """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+@register_collector
+def _rss_samples():
+    return [('omed_process_rss_bytes', {}, current_rss()), ('omed_process_peak_rss_bytes', {}, peak_rss())]
+
+
+def sample_rss():
+    """
+    Anota el RSS actual como posible pico del request en curso (p. ej. mientras se lee una subida).
+    """
+    from flask import g, has_request_context
+    if has_request_context() and 'rss_peak' in g:
+        g.rss_peak = max(g.rss_peak, current_rss())
+
+
+def current_request_id():
+    from flask import g, has_request_context
+    if has_request_context():
+        return g.get('request_id')
+    return None
+
+
+def request_headers():
+    """
+    Cabeceras a reenviar en las llamadas HTTP internas para propagar el request id.
+    """
+    request_id = current_request_id()
+    return {REQUEST_ID_HEADER: request_id} if request_id else {}
+
+
+def install(app, service):
+    """
+    Añade a la app Flask: request id (X-Request-ID), latencia por endpoint y /metrics.
+    """
+    from flask import Response, g, request
+
+    _service['name'] = service
+
+    @app.before_request
+    def _start_request():
+        g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        g.request_start = time.perf_counter()
+        g.rss_peak = current_rss()
+        g.rss_max_before = peak_rss()
+
+    @app.after_request
+    def _finish_request(response):
+        start = g.pop('request_start', None)
+        if start is not None:
+            histogram('omed_request_seconds', endpoint=request.endpoint or 'unknown') \
+                .observe(time.perf_counter() - start)
+            inc('omed_requests_total', endpoint=request.endpoint or 'unknown', status=response.status_code)
+            # 🔹 Pico de RSS del request: si el máximo del proceso subió durante el request, ese es el pico;
+            # si no, el mayor RSS observado (inicio, muestras durante la subida y final)
+            max_after = peak_rss()
+            peak = max_after if max_after > g.get('rss_max_before', max_after) else \
+                max(g.get('rss_peak', 0), current_rss())
+            histogram('omed_request_peak_rss_bytes', endpoint=request.endpoint or 'unknown').observe(peak)
+        response.headers[REQUEST_ID_HEADER] = g.get('request_id', '')
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """
+        Métricas del servicio en formato Prometheus
+        ---
+        responses:
+          200:
+            description: Histogramas por etapa (p50/p95/p99), contadores y gauges
+        """
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+
+    return app
@@ -0,0 +1,85 @@
+import importlib
+import sys
+import threading
+import time
+
+# 🔹 Tiempo de importación/construcción de cada dependencia pesada (segundos)
+IMPORT_TIMES = {}
+
+
+def timed_import(name):
+    """
+    Importa un módulo y registra cuánto tardó (solo la primera vez, cuando no
+    estaba ya en sys.modules).
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    IMPORT_TIMES.setdefault(f'import:{name}', time.perf_counter() - start)
+    return module
+
+
+class Lazy:
+    """
+    Proxy que construye el objeto real en el primer acceso a un atributo.
+    Se usa para los clientes (OpenAI, Supabase) y para módulos pesados (cv2, numpy).
+    """
+
+    def __init__(self, name, factory):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_target', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _resolve(self):
+        target = self._target
+        if target is None:
+            with self._lock:
+                target = self._target
+                if target is None:
+                    start = time.perf_counter()
+                    target = self._factory()
+                    IMPORT_TIMES.setdefault(f'init:{self._name}', time.perf_counter() - start)
+                    object.__setattr__(self, '_target', target)
+        return target
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._resolve(), attr, value)
+
+    def __repr__(self):
+        state = 'cargado' if self._target is not None else 'pendiente'
+        return f'<Lazy {self._name} ({state})>'
+
+    @property
+    def loaded(self):
+        return self._target is not None
+
+    def warm(self):
+        self._resolve()
+        return self
+
+
+def lazy_module(name):
+    """ `cv2 = lazy_module('cv2')`: el import real ocurre al usar `cv2.algo`. """
+    return Lazy(name, lambda: timed_import(name))
+
+
+def warm_in_background(*targets):
+    """
+    Carga los Lazy indicados en un hilo aparte para que el primer request no pague
+    el coste del import. Si el request llega antes, espera al mismo lock de import.
+    """
+    def run():
+        for target in targets:
+            try:
+                target.warm()
+            except Exception as e:
+                print(f"Error precargando {target!r}: {e}")
+
+    thread = threading.Thread(target=run, name='omed-warmup', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,153 @@
+"""
+Prueba de carga por HTTP: compara el servidor de desarrollo de Flask con serve.py
+(gunicorn gthread y, opcionalmente, gevent) para el mismo servicio con backends falsos.
+
+Uso:
+    python loadtest.py getPillInfo -c 1 8 32 -n 200
+    python loadtest.py img_to_text --modes dev gthread gevent --workers 4 --threads 8
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import fakes
+from bench import EXAMPLES, RESULTS_FOLDER, _percentile
+from services import BASE_DIR
+
+
+def _json_body(payload):
+    return json.dumps(payload).encode(), 'application/json'
+
+
+def _multipart_body(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def _pill_info(i):
+    entries = fakes.load_transcripts()
+    return _json_body({'transcript': entries[i % len(entries)]['transcript']})
+
+
+def _img_to_text(i):
+    with open(os.path.join(EXAMPLES, 'pill.jpg'), 'rb') as f:
+        return _multipart_body('photo', 'pill.jpg', f.read() + f'#{i}'.encode())
+
+
+# 🔹 Escenario -> (servicio, método, ruta, constructor del cuerpo)
+SCENARIOS = {
+    'getPillInfo': ('text_to_json', 'POST', '/getPillInfo', _pill_info),
+    'img_to_text': ('photo_to_name', 'POST', '/img_to_text', _img_to_text),
+    'medicamentos': ('query_text', 'GET', '/medicamentos', None),
+    'resumeDay': ('day_summary', 'POST', '/resumeDay', lambda i: _json_body({'schedule': fakes.load_schedule()})),
+}
+
+MODES = {
+    'dev': ['--server', 'dev'],
+    'gthread': ['--server', 'gunicorn'],
+    'gevent': ['--server', 'gunicorn', '--async'],
+}
+
+
+def _wait_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url + '/metrics', timeout=1).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError(f'El servidor {url} no arrancó en {timeout}s')
+
+
+def drive(url, scenario, concurrency, requests):
+    _, method, path, build = SCENARIOS[scenario]
+
+    def one(i):
+        body, content_type = build(i) if build else (None, None)
+        req = urllib.request.Request(url + path, data=body, method=method)
+        if content_type:
+            req.add_header('Content-Type', content_type)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except (urllib.error.URLError, ConnectionError):
+            status = 599
+        return time.perf_counter() - start, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    latencies = [elapsed for elapsed, _ in results]
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': sum(1 for _, status in results if status >= 400),
+        'throughput_rps': requests / wall,
+        'p50': _percentile(latencies, 0.5),
+        'p95': _percentile(latencies, 0.95),
+        'p99': _percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara el servidor de desarrollo con serve.py.')
+    parser.add_argument('scenario', choices=list(SCENARIOS))
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=['dev', 'gthread'])
+    parser.add_argument('-c', '--concurrency', nargs='+', type=int, default=[1, 8, 32])
+    parser.add_argument('-n', '--requests', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--port', type=int, default=5900)
+    parser.add_argument('--model-latency', type=float, default=0.2)
+    args = parser.parse_args()
+
+    service = SCENARIOS[args.scenario][0]
+    url = f'http://127.0.0.1:{args.port}'
+    report = {'scenario': args.scenario, 'args': vars(args), 'modes': {}}
+
+    print(f"{'modo':<10}{'conc':>5}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err':>5}")
+    for mode in args.modes:
+        cmd = [sys.executable, os.path.join(BASE_DIR, 'serve.py'), service, '--port', str(args.port),
+               '--bind', '127.0.0.1', '--workers', str(args.workers), '--threads', str(args.threads),
+               '--fake-backends', '--model-latency', str(args.model_latency)] + MODES[mode]
+        server = subprocess.Popen(cmd, cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_ready(url)
+            drive(url, args.scenario, 1, 2)  # 🔹 Calentamiento
+            rows = []
+            for concurrency in args.concurrency:
+                row = drive(url, args.scenario, concurrency, args.requests)
+                rows.append(row)
+                print(f"{mode:<10}{concurrency:>5}{row['throughput_rps']:>9.1f}{row['p50'] * 1000:>9.1f}"
+                      f"{row['p95'] * 1000:>9.1f}{row['p99'] * 1000:>9.1f}{row['errors']:>5}")
+            report['modes'][mode] = rows
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+
+    os.makedirs(RESULTS_FOLDER, exist_ok=True)
+    stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    output = os.path.join(RESULTS_FOLDER, f'loadtest_{args.scenario}_{stamp}.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Resultados guardados en {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Extracción local (Tesseract) de nombre, dosis y número de comprimidos de la caja.
+Basado en Examples/photoToNamePill_Tesseract.py, con puntuación de confianza para
+decidir si se puede evitar la llamada al modelo de visión.
+"""
+import os
+import re
+
+from drugIndex import default_index, normalize_dose
+from lazy import lazy_module
+
+cv2 = lazy_module('cv2')
+np = lazy_module('numpy')
+pytesseract = lazy_module('pytesseract')
+
+# 🔹 Confianza media mínima (0-100) de Tesseract en las palabras usadas para aceptar el resultado
+OCR_MIN_CONFIDENCE = float(os.getenv('OCR_MIN_CONFIDENCE', '70'))
+
+DOSE_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s?(mg|g|mcg|µg|ug)\b", re.IGNORECASE)
+COUNT_RE = re.compile(r"(\d+)\s?(comprimidos|comp\.?|tablets|capsulas|cápsulas|grageas|sobres)\b", re.IGNORECASE)
+# Palabras de la caja que nunca son el nombre del medicamento
+STOPWORDS = {
+    'comprimidos', 'comprimido', 'capsulas', 'cápsulas', 'recubiertos', 'película', 'pelicula',
+    'tablets', 'oral', 'via', 'vía', 'uso', 'medicamento', 'sobres', 'grageas', 'efg', 'cada',
+    'contiene', 'lote', 'cad', 'mg', 'g', 'blister', 'blíster',
+}
+
+
+def preprocess(image):
+    """ Escala de grises + umbral adaptativo (igual que el ejemplo de Tesseract). """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+
+
+def read_words(image_bytes):
+    """
+    Ejecuta Tesseract y devuelve una lista de palabras con su confianza y altura en píxeles.
+    """
+    if os.getenv('TESSERACT_CMD'):
+        pytesseract.pytesseract.tesseract_cmd = os.getenv('TESSERACT_CMD')
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("No se pudo decodificar la imagen.")
+    data = pytesseract.image_to_data(preprocess(image), lang=os.getenv('OCR_LANG', 'spa'),
+                                     output_type=pytesseract.Output.DICT)
+    words = []
+    for i, text in enumerate(data['text']):
+        text = text.strip()
+        conf = float(data['conf'][i])
+        if text and conf >= 0:
+            words.append({'text': text, 'conf': conf, 'height': int(data['height'][i]),
+                          'line': (data['block_num'][i], data['par_num'][i], data['line_num'][i])})
+    return words
+
+
+def _words_in(words, fragment):
+    """ Palabras de la línea que forman parte del fragmento reconocido por la regex. """
+    return [w for w in words if w['text'] in fragment or fragment in w['text']]
+
+
+def parse_medicine_info(words):
+    """
+    Devuelve (info, confianza) con las mismas claves que el modelo de visión:
+    nombre_del_medicamento, numero_de_comprimidos (entero) y cantidad_por_dosis (mg).
+    La confianza es la media de Tesseract sobre las palabras que aportan cada campo.
+    """
+    info = {"nombre_del_medicamento": None, "numero_de_comprimidos": None, "cantidad_por_dosis": None}
+    used = []
+
+    lines = {}
+    for word in words:
+        lines.setdefault(word['line'], []).append(word)
+    line_texts = [(' '.join(w['text'] for w in ws), ws) for ws in lines.values()]
+
+    for text, ws in line_texts:
+        if info["cantidad_por_dosis"] is None:
+            match = DOSE_RE.search(text)
+            if match:
+                info["cantidad_por_dosis"] = normalize_dose(match.group(0))  # "1.000 mg" -> 1000.0
+                used.extend(_words_in(ws, match.group(0)))
+        if info["numero_de_comprimidos"] is None:
+            match = COUNT_RE.search(text)
+            if match:
+                info["numero_de_comprimidos"] = int(match.group(1))
+                used.extend(_words_in(ws, match.group(0)))
+
+    # 🔹 El nombre suele ser el texto de mayor tamaño de la caja
+    candidates = [w for w in words
+                  if len(w['text']) > 3 and w['text'].isalpha() and w['text'].lower() not in STOPWORDS]
+    if candidates:
+        name = max(candidates, key=lambda w: (w['height'], w['conf']))
+        info["nombre_del_medicamento"] = name['text'].capitalize()
+        used.append(name)
+
+    confidence = sum(w['conf'] for w in used) / len(used) if used else 0.0
+    return info, confidence
+
+
+def fast_path(image_bytes, min_confidence=OCR_MIN_CONFIDENCE):
+    """
+    Intenta extraer la información solo con OCR. Devuelve el dict si los tres campos
+    se han leído con confianza suficiente y el nombre está tal cual en el catálogo local
+    (se devuelve ya canónico), o None para recurrir al modelo de visión. Un nombre que solo
+    se parece a uno del catálogo no basta: puede ser otro medicamento o un error del OCR.
+    """
+    info, confidence = parse_medicine_info(read_words(image_bytes))
+    if any(value is None for value in info.values()) or confidence < min_confidence:
+        return None
+    name = default_index().exact_name(info["nombre_del_medicamento"])
+    if name is None:
+        return None
+    info["nombre_del_medicamento"] = name
+    return info
@@ -0,0 +1,141 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+# 🔹 Configuración por variables de entorno
+#   PROFILING=on            -> activa los hooks (por defecto off: no se registra nada por petición)
+#   PROFILE_SAMPLE_RATE=0.01 -> fracción de peticiones perfiladas automáticamente
+#   PROFILE_DIR=profiles    -> carpeta donde se guardan los perfiles
+#   PROFILE_KEEP=50         -> número máximo de perfiles guardados (rotación)
+PROFILE_HEADER = 'X-Profile'
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
+
+# cProfile solo admite un perfilador activo a la vez: las peticiones concurrentes se saltan
+_profile_lock = threading.Lock()
+
+
+def enabled():
+    return os.getenv('PROFILING', 'off').lower() in ('1', 'on', 'true')
+
+
+def _should_profile(request, sample_rate):
+    if request.headers.get(PROFILE_HEADER, '').lower() in ('1', 'on', 'true'):
+        return True
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def _rotate(directory, keep):
+    profiles = sorted(
+        (f for f in os.listdir(directory) if f.endswith('.prof')),
+        key=lambda f: os.path.getmtime(os.path.join(directory, f)),
+    )
+    for name in profiles[:-keep] if keep > 0 else profiles:
+        for path in (name, name[:-len('.prof')] + '.txt'):
+            try:
+                os.remove(os.path.join(directory, path))
+            except FileNotFoundError:
+                pass
+
+
+def save_profile(profile, endpoint, request_id=None, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+    """
+    Guarda el perfil en formato pstats (.prof) junto a un resumen legible (.txt)
+    ordenado por tiempo acumulado, y rota la carpeta.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    # 🔹 El request id puede venir del cliente: solo se usan caracteres seguros en el nombre
+    suffix = re.sub(r'[^A-Za-z0-9_-]', '', request_id or '')[:32] or f'{random.getrandbits(32):08x}'
+    base = os.path.join(directory, f'{stamp}_{endpoint}_{suffix}')
+
+    profile.dump_stats(base + '.prof')
+    summary = io.StringIO()
+    pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(40)
+    with open(base + '.txt', 'w', encoding='utf-8') as f:
+        f.write(summary.getvalue())
+
+    _rotate(directory, keep)
+    return os.path.basename(base) + '.prof'
+
+
+def install(app):
+    """
+    Añade el modo de perfilado opcional a la app Flask y el listado /profiles.
+    Con PROFILING desactivado no se registra ningún hook por petición.
+    """
+    from flask import abort, g, jsonify, request, send_from_directory
+
+    @app.route('/profiles', methods=['GET'])
+    def list_profiles():
+        """
+        Lista los perfiles capturados (más recientes primero)
+        ---
+        responses:
+          200:
+            description: Nombre, tamaño y fecha de cada perfil guardado
+        """
+        if not os.path.isdir(PROFILE_DIR):
+            return jsonify([])
+        entries = []
+        for name in os.listdir(PROFILE_DIR):
+            if name.endswith('.prof') or name.endswith('.txt'):
+                path = os.path.join(PROFILE_DIR, name)
+                entries.append({'name': name, 'bytes': os.path.getsize(path), 'mtime': os.path.getmtime(path)})
+        entries.sort(key=lambda e: e['mtime'], reverse=True)
+        return jsonify(entries)
+
+    @app.route('/profiles/<name>', methods=['GET'])
+    def get_profile(name):
+        """
+        Descarga un perfil (.prof para snakeviz/pstats o .txt con el resumen)
+        ---
+        parameters:
+          - name: name
+            in: path
+            type: string
+            required: true
+        responses:
+          200:
+            description: Fichero del perfil
+          404:
+            description: El perfil no existe
+        """
+        if not (name.endswith('.prof') or name.endswith('.txt')):
+            abort(404)
+        return send_from_directory(os.path.abspath(PROFILE_DIR), name)
+
+    if not enabled():
+        return app
+
+    sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+
+    @app.before_request
+    def _start_profile():
+        if request.endpoint in ('list_profiles', 'get_profile', 'metrics'):
+            return
+        if not _should_profile(request, sample_rate):
+            return
+        if not _profile_lock.acquire(blocking=False):
+            return
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+    @app.teardown_request
+    def _stop_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        _profile_lock.release()
+        try:
+            save_profile(profile, request.endpoint or 'unknown', g.get('request_id'))
+        except Exception as e:
+            print(f"Error guardando el perfil: {e}")
+
+    return app
@@ -0,0 +1,191 @@
+"""
+Registro de prompts de los servicios (extracción de texto, visión y resumen del día).
+
+Cada prompt se compila una vez al importar: mensaje de sistema e instrucciones fijas
+primero y los datos de cada petición (fecha, transcripción, horario) al final, para que
+el prefijo sea idéntico entre llamadas y OpenAI pueda reutilizarlo (prompt caching
+automático a partir de 1024 tokens de prefijo común).
+
+`record_usage` registra por llamada los tokens de prompt, de respuesta y cacheados.
+"""
+import json
+import os
+import threading
+
+import instrumentation
+
+# 🔹 PROMPT_USAGE_LOG=0 desactiva la línea de log por llamada (las métricas se mantienen)
+USAGE_LOG = os.getenv('PROMPT_USAGE_LOG', '1') != '0'
+
+
+class Prompt:
+    """
+    Prompt precompilado: `messages(**datos)` devuelve la lista de mensajes para
+    chat.completions con la parte fija como prefijo y `suffix` formateado al final.
+    """
+
+    def __init__(self, name, model, system, prefix, suffix):
+        self.name = name
+        self.model = model
+        self.system = system
+        self.prefix = prefix.strip() + '\n\n'
+        self.suffix = suffix.strip()
+
+    def text(self, **data):
+        return self.prefix + self.suffix.format(**data)
+
+    def messages(self, image_url=None, **data):
+        content = self.text(**data)
+        if image_url is not None:
+            # 🔹 La imagen va después del texto fijo: el prefijo sigue siendo cacheable
+            content = [{"type": "text", "text": content},
+                       {"type": "image_url", "image_url": {"url": image_url}}]
+        messages = [{"role": "system", "content": self.system}] if self.system else []
+        messages.append({"role": "user", "content": content})
+        return messages
+
+
+_REGISTRY = {}
+
+
+def register(prompt):
+    _REGISTRY[prompt.name] = prompt
+    return prompt
+
+
+def get(name):
+    return _REGISTRY[name]
+
+
+# ---------------------------------------------------------------------------
+# 3_textToJson.py: transcripción -> frecuencia / primera ingestión / parte afectada
+# ---------------------------------------------------------------------------
+_EVENT_TEMPLATE = json.dumps({
+    "event_json": {
+        "frecuencia": "<horas entre cada ingestion (poner solo el número en horas)>",
+        "primera_ingestion": "<Fecha y hora de la primera toma (en formato local date time)>",
+        "parte_afectada": "<Parte del cuerpo afectada (clasificado en uno de estos: HEART_RELATED, DIGESTIVE, GENERAL_BODY, BRAIN_RELATED, PSYCHOLOGICAL)>"
+    }
+}, indent=4)
+
+TEXT_TO_JSON = register(Prompt(
+    name='text_to_json',
+    model='gpt-4o-mini',
+    system="Eres un asistente experto en interpretar instrucciones médicas de reconocimientode medicamentos desde transcripciones de audio. Tienes que tener en cuenta que el audio lo realiza una ",
+    prefix=f'''
+    A partir del texto de transcripción de un paciente que aparece al final, extrae la siguiente información y devuelve un JSON con estos campos:
+
+    1. **Frecuencia**: Cada vez que debe tomar la pastilla. Si te dice dos veces al dia será cada 12 horas o si te dice 3 veces al dia serán 8 horas).
+    2. **Día y hora de primera ingestión**: Fecha y hora en formato "DD/MM/YYYY HH:MM" si está disponible, o solo "DD/MM/YYYY". Para referirse a este punto, la transcripción puede decir frases como "Empezaré..." "La primera pastilla la tomaré...". En resumen toda frase que implique empezar a tomar las pastillas seguidas de una fecha. Ten en cuenta la fecha de hoy indicada al final.
+    3. **Parte del cuerpo afectada**: Indicar la parte del cuerpo a la que se refiere el medicamento. Es importante que se meta en alguna de estas categorías:**
+    - HEART_RELATED
+    - DIGESTIVE
+    - GENERAL_BODY
+    - BRAIN_RELATED
+    - PSYCHOLOGICAL
+
+    **Notas importantes:**
+    - La transcripción proviene de personas mayores o con dificultades de accesibilidad, por lo que el audio puede tener errores.
+    - Si no es posible extraer la información de un campo, devuelve "null_NoEspecify" en su lugar, excepto en "Parte del cuerpo afectada", que hay que poner "GENERAL_BODY"".
+    - Extrae exclusivamente la información mencionada en el audio sin añadir suposiciones.
+    - Devuelve **únicamente** un JSON válido con la estructura especificada.
+
+    Plantilla de JSON esperado:
+    {_EVENT_TEMPLATE}
+    ''',
+    suffix='''
+    Hoy es {today_date}.
+
+    **Texto de transcripción:**
+    "{transcript}"
+    ''',
+))
+
+# ---------------------------------------------------------------------------
+# 2_photoToNamePill_GPT.py: foto de la caja -> nombre / comprimidos / dosis
+# ---------------------------------------------------------------------------
+_MEDICINE_TEMPLATE = json.dumps({
+    "nombre_del_medicamento": "<Nombre>",
+    "numero_de_comprimidos": "<Numero entero>",
+    "cantidad_por_dosis": "<Numero real en mg, solo el numero>"
+}, indent=4)
+
+PHOTO_TO_NAME = register(Prompt(
+    name='photo_to_name',
+    model='gpt-4o-mini',
+    system=None,
+    prefix=f'''
+        A partir de la siguiente imagen, quiero que me extraigas la siguiente información relevante del medicamento de manera ordenada y la presentes en el siguiente formato JSON:
+
+            Nombre del medicamento (ejemplo: Paracetamol)
+            Cantidad de dosis del medicamento: (ejemplo: 50 capsulas, solo el numero)
+            Cantidad de cada dosis (ejemplo: 200mg, siempre lo quiero en miligramos)
+
+        Si alguno de los datos no está disponible o no se menciona explícitamente en la imagen ponlo como null.
+
+        El formato JSON debe ser el siguiente:
+        {_MEDICINE_TEMPLATE}
+
+        Instrucciones adicionales:
+
+    Si no hay información suficiente para completar un campo, ponlo como null.
+    Saca la información exclusivamente de la imagen, no añadas nada de tu propio conocimiento
+    Si un campo no es aplicable o no se menciona, omítelo del JSON.
+    El resultado debe ser exclusivamente el JSON solicitado.
+    ''',
+    suffix='',
+))
+
+# ---------------------------------------------------------------------------
+# 5_1_queryTextServerCHATG.py: horario del día -> resumen hablado
+# ---------------------------------------------------------------------------
+DAY_SUMMARY = register(Prompt(
+    name='day_summary',
+    model='gpt-4o-mini',
+    system="Eres un asistente experto en salud y bienestar con confianza como para tutear a tus pacientes. Hablas correctamente y formal",
+    prefix='''
+    A partir del listado de tomas de medicamentos del día de hoy que aparece al final, genera un texto sencillo hablando sobre los medicamentos del dia de hoy a modo de resumen para el paciente. Quiero que hagas alusion unicamente a que pastillas que va a tomar y brevemente a su propósito. No hace falta que hables de las dosis distante y refiere al paciente como su nombre de ser necesario. Tambien  quiero que hagas alusion al dia como algo que va a ocurrir, por ello solo habla de las pastillas que ocurran luego de la hora actual indicada al final.
+    ''',
+    suffix='''
+    Hora actual: {hour}
+
+    {summary_text}
+    ''',
+))
+
+
+# ---------------------------------------------------------------------------
+# Uso de tokens
+# ---------------------------------------------------------------------------
+_usage = {}
+_usage_lock = threading.Lock()
+
+
+def record_usage(prompt_name, response):
+    """
+    Registra los tokens de una llamada (prompt, respuesta y cacheados) en /metrics y,
+    salvo PROMPT_USAGE_LOG=0, en una línea de log. Devuelve el dict de uso o None.
+    """
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return None
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = (getattr(details, 'cached_tokens', 0) or 0) if details is not None else 0
+
+    instrumentation.inc('omed_prompt_tokens_total', prompt_tokens, prompt=prompt_name, kind='prompt')
+    instrumentation.inc('omed_prompt_tokens_total', completion_tokens, prompt=prompt_name, kind='completion')
+    instrumentation.inc('omed_prompt_tokens_total', cached_tokens, prompt=prompt_name, kind='cached')
+    with _usage_lock:
+        totals = _usage.setdefault(prompt_name, {'prompt': 0, 'cached': 0})
+        totals['prompt'] += prompt_tokens
+        totals['cached'] += cached_tokens
+        ratio = totals['cached'] / totals['prompt'] if totals['prompt'] else 0.0
+    instrumentation.set_gauge('omed_prompt_cached_ratio', round(ratio, 4), prompt=prompt_name)
+
+    if USAGE_LOG:
+        call_ratio = cached_tokens / prompt_tokens if prompt_tokens else 0.0
+        print(f"🔹 [{prompt_name}] tokens prompt={prompt_tokens} respuesta={completion_tokens} "
+              f"cacheados={cached_tokens} ({call_ratio:.0%}) request_id={instrumentation.current_request_id()}")
+    return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'cached_tokens': cached_tokens}
@@ -0,0 +1,473 @@
+"""
+Recordatorios de tomas a su hora.
+
+Cada tratamiento activo (`tratamiento`: paciente, medicamento, fecha_inicio, frecuencia en
+horas) ocupa una sola entrada en un heap ordenado por su próxima toma: al dispararse se
+calcula la siguiente y se vuelve a insertar. La memoria es proporcional al número de
+tratamientos, no al de tomas, y cada toma cuesta O(log n).
+
+Las tomas que vencen en el mismo tick se agrupan por paciente y se envían por lotes
+(REMINDER_BATCH_SIZE) a los sinks (log, webhook o cualquier objeto con `send(reminders)`).
+Los tratamientos nuevos se leen de Supabase de forma incremental (solo id > último visto)
+cada REMINDER_SYNC_SECONDS y se añaden al heap sin reconstruirlo.
+
+    python reminders.py run                          # motor real contra Supabase
+    python reminders.py bench --patients 50000       # reloj simulado, un día
+"""
+import argparse
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import NamedTuple
+
+import instrumentation
+import resilience
+from lazy import lazy_module
+
+requests = lazy_module('requests')
+
+BATCH_SIZE = int(os.getenv('REMINDER_BATCH_SIZE', '500'))
+# 🔹 Tomas que vencieron hace más de esto (motor parado) no se avisan: se salta a la siguiente
+GRACE_SECONDS = float(os.getenv('REMINDER_GRACE_SECONDS', '900'))
+SYNC_SECONDS = float(os.getenv('REMINDER_SYNC_SECONDS', '30'))
+PAGE_SIZE = 1000  # Filas por página al leer `tratamiento` (límite por defecto de Supabase)
+WEBHOOK_URL = os.getenv('REMINDER_WEBHOOK_URL')
+
+
+class Treatment(NamedTuple):
+    id: object
+    paciente: str
+    medicamento: str
+    start: float              # epoch de la primera toma
+    every: float              # segundos entre tomas
+    doses: object = None      # número total de tomas o None si no se conoce
+
+    def dose_at(self, now):
+        """ (índice, epoch) de la primera toma en o después de `now`; None si ya no quedan. """
+        index = 0 if now <= self.start else math.ceil((now - self.start) / self.every)
+        if self.doses is not None and index >= self.doses:
+            return None
+        return index, self.start + index * self.every
+
+
+def treatment_from_row(row):
+    """ Fila de `tratamiento` -> Treatment. Lanza ValueError si falta la fecha o la frecuencia. """
+    try:
+        start = datetime.fromisoformat(str(row['fecha_inicio'])).timestamp()
+        every = float(row['frecuencia']) * 3600
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Tratamiento no válido {row.get('id')}: {e}")
+    if every <= 0:
+        raise ValueError(f"Frecuencia no válida en el tratamiento {row.get('id')}: {row['frecuencia']}")
+    doses = row.get('numero_comprimidos') or row.get('dosis_restantes')
+    treatment_id = row.get('id', (row.get('nombre_paciente'), row.get('nombre_medicamento'), row['fecha_inicio']))
+    return Treatment(treatment_id, row.get('nombre_paciente'), row.get('nombre_medicamento'), start, every,
+                     int(doses) if doses else None)
+
+
+class Reminder(NamedTuple):
+    paciente: str
+    due: float
+    tomas: list  # [{"tratamiento_id", "medicamento", "toma"}]
+
+    def as_dict(self):
+        return {'paciente': self.paciente,
+                'hora': datetime.fromtimestamp(self.due).isoformat(timespec='seconds'),
+                'tomas': self.tomas}
+
+
+# ---------------------------------------------------------------------------
+# Sinks
+# ---------------------------------------------------------------------------
+class PrintSink:
+    def send(self, reminders):
+        for reminder in reminders:
+            meds = ', '.join(toma['medicamento'] for toma in reminder.tomas)
+            print(f"🔹 Recordatorio {reminder.paciente} {reminder.as_dict()['hora']}: {meds}")
+
+
+class CountingSink:
+    """ Solo cuenta (benchmark): memoria constante aunque se envíen millones de avisos. """
+
+    def __init__(self):
+        self.batches = 0
+        self.reminders = 0
+        self.tomas = 0
+
+    def send(self, reminders):
+        self.batches += 1
+        self.reminders += len(reminders)
+        self.tomas += sum(len(reminder.tomas) for reminder in reminders)
+
+
+class WebhookSink:
+    """ POST de cada lote como {"reminders": [...]} (timeout y circuit breaker de resilience). """
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        self.upstream = resilience.upstream('reminder_webhook', hedge=False, timeout=timeout)
+
+    def send(self, reminders):
+        body = {'reminders': [reminder.as_dict() for reminder in reminders]}
+        response = self.upstream.call(requests.post, self.url, json=body, timeout=self.timeout)
+        if response.status_code >= 400:
+            raise RuntimeError(f"Webhook de recordatorios: {response.status_code}")
+
+
+def default_sinks():
+    return [WebhookSink(WEBHOOK_URL)] if WEBHOOK_URL else [PrintSink()]
+
+
+# ---------------------------------------------------------------------------
+# Motor
+# ---------------------------------------------------------------------------
+class ReminderEngine:
+    """
+    Heap de (próxima toma, orden, id, versión, índice de toma). Quitar o reemplazar un
+    tratamiento sube su versión y la entrada antigua se descarta al salir del heap.
+    """
+
+    def __init__(self, sinks=None, clock=time.time, batch_size=BATCH_SIZE, grace=GRACE_SECONDS):
+        self.sinks = default_sinks() if sinks is None else list(sinks)
+        self.clock = clock
+        self.batch_size = batch_size
+        self.grace = grace
+        self._heap = []
+        self._treatments = {}  # id -> (Treatment, versión)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self.sent = 0
+        self.missed = 0
+        self.sink_errors = 0
+
+    def __len__(self):
+        return len(self._treatments)
+
+    def _entry(self, treatment, version, now):
+        dose = treatment.dose_at(now)
+        if dose is None:
+            return None
+        index, due = dose
+        return (due, next(self._seq), treatment.id, version, index)
+
+    def add(self, treatment, now=None):
+        """ Añade o reemplaza un tratamiento (O(log n)); despierta al hilo si vence antes. """
+        now = self.clock() if now is None else now
+        with self._cond:
+            version = self._treatments[treatment.id][1] + 1 if treatment.id in self._treatments else 0
+            entry = self._entry(treatment, version, now)
+            if entry is None:
+                self._treatments.pop(treatment.id, None)
+                return False
+            self._treatments[treatment.id] = (treatment, version)
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._cond.notify_all()
+        return True
+
+    def add_rows(self, rows, now=None):
+        """
+        Añade filas de `tratamiento`; las no válidas se cuentan y se ignoran, y las de tratamientos
+        ya terminados no se guardan. Devuelve las añadidas.
+        """
+        now = self.clock() if now is None else now
+        added = 0
+        for row in rows:
+            try:
+                added += self.add(treatment_from_row(row), now)
+            except ValueError as e:
+                print(f"Tratamiento ignorado: {e}")
+        return added
+
+    def load(self, treatments, now=None):
+        """ Carga inicial en bloque: heapify O(n) en lugar de n inserciones. """
+        now = self.clock() if now is None else now
+        with self._cond:
+            for treatment in treatments:
+                version = self._treatments[treatment.id][1] + 1 if treatment.id in self._treatments else 0
+                entry = self._entry(treatment, version, now)
+                if entry is not None:
+                    self._treatments[treatment.id] = (treatment, version)
+                    self._heap.append(entry)
+            heapq.heapify(self._heap)
+            self._cond.notify_all()
+
+    def remove(self, treatment_id):
+        with self._cond:
+            return self._treatments.pop(treatment_id, None) is not None
+
+    def next_due(self):
+        with self._cond:
+            while self._heap and self._is_stale(self._heap[0]):
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def _is_stale(self, entry):
+        current = self._treatments.get(entry[2])
+        return current is None or current[1] != entry[3]
+
+    def poll(self, now=None):
+        """
+        Dispara las tomas vencidas hasta `now`, reprograma cada tratamiento en su siguiente
+        toma y envía los avisos agrupados por paciente. Devuelve el número de avisos.
+        """
+        now = self.clock() if now is None else now
+        by_patient = {}
+        with self._cond:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                due, _, treatment_id, version, index = heapq.heappop(heap)
+                current = self._treatments.get(treatment_id)
+                if current is None or current[1] != version:
+                    continue
+                treatment = current[0]
+                if now - due > self.grace:
+                    # 🔹 Motor parado más que el margen: no se avisa tarde, se salta a la próxima toma
+                    self.missed += 1
+                    entry = self._entry(treatment, version, now)
+                else:
+                    by_patient.setdefault((treatment.paciente, due), []).append(
+                        {'tratamiento_id': treatment_id, 'medicamento': treatment.medicamento, 'toma': index + 1})
+                    entry = self._entry(treatment, version, due + treatment.every / 2)
+                if entry is None:
+                    del self._treatments[treatment_id]  # tratamiento terminado
+                else:
+                    heapq.heappush(heap, entry)
+
+        reminders = [Reminder(paciente, due, tomas) for (paciente, due), tomas in by_patient.items()]
+        self._dispatch(reminders)
+        return len(reminders)
+
+    def _dispatch(self, reminders):
+        for i in range(0, len(reminders), self.batch_size):
+            batch = reminders[i:i + self.batch_size]
+            for sink in self.sinks:
+                try:
+                    sink.send(batch)
+                except Exception as e:
+                    self.sink_errors += 1
+                    instrumentation.inc('omed_reminder_sink_errors_total', sink=type(sink).__name__)
+                    print(f"Error enviando {len(batch)} recordatorios a {type(sink).__name__}: {e}")
+            self.sent += len(batch)
+            instrumentation.inc('omed_reminders_sent_total', len(batch))
+
+    # -- hilo ---------------------------------------------------------------
+    def start(self, source=None, sync_seconds=SYNC_SECONDS):
+        """ Hilo que duerme hasta la próxima toma (o la próxima sincronización con `source`). """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(source, sync_seconds),
+                                        name='omed-reminders', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, source, sync_seconds):
+        next_sync = 0.0
+        while not self._stop.is_set():
+            now = self.clock()
+            if source is not None and now >= next_sync:
+                try:
+                    self.add_rows(source.fetch_new(), now)
+                except Exception as e:
+                    print(f"Error sincronizando tratamientos: {e}")
+                next_sync = now + sync_seconds
+            self.poll(now)
+            with self._cond:
+                # 🔹 Se calcula y se espera con el lock tomado: un add() no puede colarse sin despertar
+                due = self._heap[0][0] if self._heap else math.inf
+                wake = min(due, next_sync if source is not None else math.inf)
+                if not self._stop.is_set():
+                    self._cond.wait(None if wake == math.inf else max(0.0, wake - self.clock()))
+
+
+class TreatmentSource:
+    """
+    Lee `tratamiento` de Supabase de forma incremental: solo las filas con id mayor que
+    el último visto, paginadas por id.
+
+    Las filas de `tratamiento` no llevan el número de tomas: se completa con
+    `numero_comprimidos` del medicamento más reciente con ese nombre (como la réplica),
+    y así el motor descarta al cargar los tratamientos que ya terminaron.
+    """
+
+    def __init__(self, supabase, table='tratamiento', medicamentos='medicamento', page_size=PAGE_SIZE):
+        self.supabase = supabase
+        self.table = table
+        self.medicamentos = medicamentos
+        self.page_size = page_size
+        self.last_id = 0
+        self.last_medicamento_id = 0
+        self.doses = {}  # nombre del medicamento -> numero_comprimidos
+
+    def _pages(self, table, columns, after):
+        while True:
+            page = self.supabase.table(table).select(columns).gt('id', after) \
+                .order('id').limit(self.page_size).execute().data
+            yield from page
+            if page:
+                after = page[-1]['id']
+            if len(page) < self.page_size:
+                return
+
+    def fetch_new(self):
+        # 🔹 Primero los medicamentos: insert() escribe el medicamento antes que su tratamiento
+        for row in self._pages(self.medicamentos, 'id,nombre,numero_comprimidos', self.last_medicamento_id):
+            self.doses[row['nombre']] = row.get('numero_comprimidos')
+            self.last_medicamento_id = row['id']
+        rows = []
+        for row in self._pages(self.table, '*', self.last_id):
+            if row.get('numero_comprimidos') is None and row.get('dosis_restantes') is None:
+                row = {**row, 'numero_comprimidos': self.doses.get(row.get('nombre_medicamento'))}
+            rows.append(row)
+            self.last_id = row['id']
+        return rows
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def default_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = ReminderEngine()
+    return _engine
+
+
+@instrumentation.register_collector
+def _reminder_samples():
+    if _engine is None:
+        return []
+    return [('omed_reminder_treatments', {}, len(_engine)),
+            ('omed_reminder_heap_entries', {}, len(_engine._heap)),
+            ('omed_reminders_missed_total', {}, _engine.missed, 'counter')]
+
+
+# ---------------------------------------------------------------------------
+# Benchmark con reloj simulado
+# ---------------------------------------------------------------------------
+class SimulatedClock:
+    def __init__(self, start):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+
+def synthetic_treatments(patients, per_patient, start, seed=1):
+    rng = random.Random(seed)
+    meds = ('Lorazepam', 'Paracetamol', 'Omeprazol', 'Ibuprofeno', 'Enalapril', 'Metformina')
+    for p in range(patients):
+        for m in range(per_patient):
+            # 🔹 Primeras tomas en punto o y media, como las que dicta un paciente
+            first = start + rng.randrange(0, 24 * 2) * 1800
+            yield Treatment(p * per_patient + m, f'paciente_{p}', meds[m % len(meds)], first,
+                            rng.choice((6, 8, 12, 24)) * 3600, rng.choice((None, 30, 60)))
+
+
+def _simulate_day(patients, per_patient, hours, tick, added, seed):
+    start = datetime(2025, 3, 1).timestamp()
+    clock = SimulatedClock(start)
+    sink = CountingSink()
+    engine = ReminderEngine([sink], clock=clock)
+
+    t0 = time.perf_counter()
+    engine.load(synthetic_treatments(patients, per_patient, start, seed))
+    load_seconds = time.perf_counter() - t0
+
+    extra = list(synthetic_treatments(added, 1, start, seed + 1))
+    add_every = max(1, int(hours * 3600 / tick) // max(1, added))
+    add_seconds, ticks, busy = 0.0, 0, 0.0
+    end = start + hours * 3600
+    while clock.now < end:
+        clock.now += tick
+        ticks += 1
+        if extra and ticks % add_every == 0:
+            treatment = extra.pop()
+            t = time.perf_counter()
+            engine.add(treatment._replace(id=('nuevo', treatment.id), start=clock.now + 600))
+            add_seconds += time.perf_counter() - t
+        t = time.perf_counter()
+        engine.poll()
+        busy += time.perf_counter() - t
+    return {
+        'treatments': patients * per_patient + added,
+        'load_s': load_seconds,
+        'ticks': ticks,
+        'reminders': sink.reminders,
+        'tomas': sink.tomas,
+        'batches': sink.batches,
+        'poll_cpu_s': busy,
+        'tomas_per_cpu_s': sink.tomas / busy if busy else 0.0,
+        'add_us': add_seconds / max(1, added) * 1e6,
+        'heap_entries': len(engine._heap),
+    }
+
+
+def benchmark(patients=50000, per_patient=3, hours=24, tick=1.0, added=1000, seed=1):
+    """
+    Un día simulado en ticks de `tick` segundos: carga, tomas por segundo de CPU y coste
+    de añadir tratamientos en caliente. La memoria pico se mide en una segunda pasada con
+    tracemalloc (que ralentiza varias veces y falsearía los tiempos).
+    """
+    result = _simulate_day(patients, per_patient, hours, tick, added, seed)
+    tracemalloc.start()
+    _simulate_day(patients, per_patient, hours, tick, added, seed)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result['peak_mb'] = peak / 2**20
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Motor de recordatorios de tomas.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('run', help='Lee los tratamientos de Supabase y envía los recordatorios')
+    bench = sub.add_parser('bench', help='Benchmark con reloj simulado')
+    bench.add_argument('--patients', type=int, default=50000)
+    bench.add_argument('--per-patient', type=int, default=3)
+    bench.add_argument('--hours', type=float, default=24)
+    bench.add_argument('--tick', type=float, default=1.0, help='Segundos simulados por tick')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        result = benchmark(args.patients, args.per_patient, args.hours, args.tick)
+        print(json.dumps({k: round(v, 3) if isinstance(v, float) else v for k, v in result.items()}, indent=2))
+        return
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    from appFactory import supabase_client
+
+    engine = default_engine().start(TreatmentSource(supabase_client()))
+    print(f"🔹 Recordatorios en marcha (sincronización cada {SYNC_SECONDS:.0f} s)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        engine.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+"""
+Réplica local (SQLite) de las tablas `medicamento` y `tratamiento`.
+
+Un hilo en segundo plano trae de Supabase solo las filas nuevas (o modificadas si
+REPLICA_WATERMARK=updated_at) cada REPLICA_SYNC_SECONDS, paginando por la marca de agua
+(con updated_at, por el par (updated_at, id), porque varias filas pueden compartir el valor),
+y `tomas_por_franja` calcula localmente las tomas del día con el mismo formato que la RPC
+`get_tomas_por_franja`. Las consultas van por índices (paciente, fecha_inicio) y tardan
+microsegundos; si Supabase falla se sigue sirviendo lo último sincronizado
+(`omed_replica_lag_seconds` en /metrics indica su antigüedad).
+
+Limitaciones: los borrados en Supabase no se replican, y las imágenes de `tratamiento` no se copian.
+
+Diferencias con la RPC (su SQL no está en el repositorio; la referencia es la salida de ejemplo de
+Examples/ExampleOutputQuerysOfTheDay, que sirve el fake y que `bench` compara campo a campo):
+
+- la réplica devuelve todas las tomas del día en la ventana; el ejemplo de la RPC solo tiene las
+  de la tarde (desde las 17:30), así que la paridad se comprueba en la ventana 17:00-24:00,
+- deja de generar tomas cuando se han dado `numero_comprimidos` tomas desde fecha_inicio (la RPC
+  del ejemplo no muestra ningún tratamiento terminado).
+
+    REPLICA=sqlite python serve.py query_text       # /medicamentos servido desde la réplica
+    python replica.py sync                          # sincronización manual contra Supabase
+    python replica.py bench                         # RPC (fake con latencia) frente a réplica
+"""
+import argparse
+import json
+import math
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import instrumentation
+
+MODE = os.getenv('REPLICA', 'off')  # off | sqlite
+PATH = os.getenv('REPLICA_PATH', os.path.join('data', 'replica.sqlite'))
+SYNC_SECONDS = float(os.getenv('REPLICA_SYNC_SECONDS', '10'))
+# 🔹 'id' solo ve filas nuevas; 'updated_at' también ve las modificadas (si la tabla tiene esa columna)
+WATERMARK = os.getenv('REPLICA_WATERMARK', 'id')
+PAGE_SIZE = 1000
+
+TABLES = {
+    'medicamento': ('id', 'nombre', 'cantidad_por_dosis', 'numero_comprimidos', 'parte_afectada'),
+    'tratamiento': ('id', 'nombre_medicamento', 'nombre_paciente', 'fecha_inicio', 'frecuencia'),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS medicamento (
+    id INTEGER PRIMARY KEY,
+    nombre TEXT,
+    cantidad_por_dosis REAL,
+    numero_comprimidos INTEGER,
+    parte_afectada TEXT
+);
+CREATE INDEX IF NOT EXISTS medicamento_nombre ON medicamento (nombre, id);
+CREATE TABLE IF NOT EXISTS tratamiento (
+    id INTEGER PRIMARY KEY,
+    nombre_medicamento TEXT,
+    nombre_paciente TEXT,
+    fecha_inicio TEXT,
+    frecuencia REAL
+);
+CREATE INDEX IF NOT EXISTS tratamiento_paciente ON tratamiento (nombre_paciente, fecha_inicio);
+CREATE INDEX IF NOT EXISTS tratamiento_inicio ON tratamiento (fecha_inicio);
+CREATE TABLE IF NOT EXISTS sync_state (
+    tabla TEXT PRIMARY KEY,
+    marca TEXT,
+    sincronizado REAL
+);
+"""
+
+# 🔹 Medicamento más reciente con ese nombre (insert() deduplica por nombre y dosis)
+_TOMAS_SQL = """
+SELECT t.nombre_paciente, t.nombre_medicamento, t.fecha_inicio, t.frecuencia,
+       m.cantidad_por_dosis, m.numero_comprimidos, m.parte_afectada
+FROM tratamiento t
+LEFT JOIN medicamento m ON m.id = (SELECT MAX(id) FROM medicamento WHERE nombre = t.nombre_medicamento)
+WHERE t.fecha_inicio < ?
+"""
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(str(value).replace('T', ' '))
+
+
+def _normalize_datetime(value):
+    """
+    Fechas de Supabase ('2025-02-26T08:00:00+00:00') -> '2025-02-26 08:00:00', para que el
+    índice y las comparaciones de texto sigan el orden cronológico.
+    """
+    try:
+        return _parse_datetime(value).replace(tzinfo=None).strftime('%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return value
+
+
+def _seconds(value):
+    """ 'HH:MM:SS' (también '24:00:00') -> segundos desde medianoche. """
+    hours, minutes, seconds = (int(float(part)) for part in str(value).split(':'))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+class Replica:
+    def __init__(self, path=PATH, supabase=None, watermark=WATERMARK, page_size=PAGE_SIZE):
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.supabase = supabase
+        self.watermark = watermark
+        self.page_size = page_size
+        # 🔹 Una conexión compartida con lock: las lecturas tardan microsegundos
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        if path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_sync = self._last_sync()
+
+    def _last_sync(self):
+        row = self._db.execute('SELECT MIN(sincronizado) FROM sync_state').fetchone()
+        return row[0] if row and row[0] is not None else None
+
+    @property
+    def ready(self):
+        """ Hay datos sincronizados al menos una vez (en este proceso o en uno anterior). """
+        return self.last_sync is not None
+
+    def lag(self):
+        return time.time() - self.last_sync if self.last_sync is not None else math.inf
+
+    # -- sincronización -----------------------------------------------------
+    def _mark(self, table):
+        """
+        Última marca sincronizada: el id, o (marca, id) con otra marca de agua; None si nunca
+        se sincronizó con una marca que no es `id`.
+        """
+        row = self._db.execute('SELECT marca FROM sync_state WHERE tabla = ?', (table,)).fetchone()
+        if row is None or row[0] is None:
+            # 🔹 Postgres no compara un timestamp con '': la primera vez se lee sin filtro
+            return 0 if self.watermark == 'id' else None
+        if self.watermark == 'id':
+            return int(row[0])
+        # Las réplicas anteriores guardaban solo la marca: se releen las filas con esa marca
+        return tuple(json.loads(row[0])) if row[0].startswith('[') else (row[0], 0)
+
+    def _after(self, query, mark):
+        """
+        Filas posteriores a la marca. updated_at no es única (una actualización masiva en una
+        transacción comparte el valor): el cursor es (updated_at, id), y las filas con la misma
+        marca que la última de la página no se saltan.
+        """
+        if mark is None:
+            return query
+        if self.watermark == 'id':
+            return query.gt('id', mark)
+        value, last_id = mark
+        return query.or_(f'{self.watermark}.gt."{value}",and({self.watermark}.eq."{value}",id.gt.{last_id})')
+
+    def _store_mark(self, mark):
+        if mark is None or self.watermark == 'id':
+            return None if mark is None else str(mark)
+        return json.dumps(list(mark))
+
+    def sync_table(self, table):
+        """ Trae las filas posteriores a la marca guardada, por páginas. Devuelve cuántas. """
+        columns = TABLES[table]
+        select = ','.join(columns + ((self.watermark,) if self.watermark not in columns else ()))
+        mark = self._mark(table)
+        total = 0
+        while True:
+            query = self._after(self.supabase.table(table).select(select), mark).order(self.watermark)
+            if self.watermark != 'id':
+                query = query.order('id')
+            page = query.limit(self.page_size).execute().data
+            if page:
+                last = page[-1]
+                mark = last['id'] if self.watermark == 'id' else (last[self.watermark], last['id'])
+                with self._lock, self._db:  # una transacción por página (rollback si falla)
+                    self._db.execute('BEGIN')
+                    self._db.executemany(
+                        f"INSERT OR REPLACE INTO {table} ({','.join(columns)}) VALUES ({','.join('?' * len(columns))})",
+                        [tuple(_normalize_datetime(row.get(column)) if column == 'fecha_inicio' else row.get(column)
+                               for column in columns) for row in page])
+                    self._db.execute('INSERT OR REPLACE INTO sync_state (tabla, marca, sincronizado) VALUES (?, ?, ?)',
+                                     (table, self._store_mark(mark), time.time()))
+                total += len(page)
+            if len(page) < self.page_size:
+                break
+        with self._lock:
+            self._db.execute('INSERT INTO sync_state (tabla, marca, sincronizado) VALUES (?, ?, ?) '
+                             'ON CONFLICT (tabla) DO UPDATE SET sincronizado = excluded.sincronizado',
+                             (table, self._store_mark(mark), time.time()))
+        return total
+
+    def sync(self):
+        """ Sincroniza las dos tablas; devuelve {tabla: filas nuevas}. """
+        with instrumentation.timer('replica_sync'):
+            counts = {table: self.sync_table(table) for table in TABLES}
+        self.last_sync = time.time()
+        for table, count in counts.items():
+            instrumentation.inc('omed_replica_rows_synced_total', count, table=table)
+        return counts
+
+    def start(self, interval=SYNC_SECONDS):
+        """ Hilo de sincronización; los errores (Supabase caído) se cuentan y se reintenta. """
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.sync()
+                except Exception as e:
+                    instrumentation.inc('omed_replica_sync_errors_total')
+                    print(f"Error sincronizando la réplica (se sirve lo último sincronizado): {e}")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='omed-replica', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    # -- consultas ----------------------------------------------------------
+    def tomas_por_franja(self, start_time, end_time, day=None, paciente=None):
+        """
+        Tomas del día `day` (hoy por defecto) con hora en [start_time, end_time), con los
+        campos de la RPC get_tomas_por_franja. `dosis_restantes` es `numero_comprimidos` del
+        medicamento, como lo devuelve la RPC (no se descuentan las tomas ya pasadas).
+        """
+        day = day or datetime.now().date()
+        day_start = datetime.combine(day, datetime.min.time())
+        window_start = day_start + timedelta(seconds=_seconds(start_time))
+        window_end = day_start + timedelta(seconds=_seconds(end_time))
+
+        sql, params = _TOMAS_SQL, [window_end.strftime('%Y-%m-%d %H:%M:%S')]
+        if paciente:
+            sql += ' AND t.nombre_paciente = ?'
+            params.append(paciente)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+
+        tomas = []
+        for row in rows:
+            try:
+                start = _parse_datetime(row['fecha_inicio'])
+                every = float(row['frecuencia']) * 3600
+            except (TypeError, ValueError):
+                continue
+            if every <= 0:
+                continue
+            taken = max(0, math.ceil((day_start - start).total_seconds() / every))
+            total = row['numero_comprimidos']
+            if total is not None and taken >= total:
+                continue  # tratamiento terminado
+            index = max(0, math.ceil((window_start - start).total_seconds() / every))
+            due = start + timedelta(seconds=index * every)
+            while due < window_end and (total is None or index < total):
+                tomas.append({
+                    'cantidad_por_dosis': row['cantidad_por_dosis'],
+                    'dosis_restantes': total,
+                    'fecha_inicio': start.isoformat(),
+                    'hora_toma': due.strftime('%H:%M:%S'),
+                    'medicamento': row['nombre_medicamento'],
+                    'paciente': row['nombre_paciente'],
+                    'parte_afectada': row['parte_afectada'],
+                })
+                index += 1
+                due = start + timedelta(seconds=index * every)
+        tomas.sort(key=lambda toma: toma['hora_toma'])
+        return tomas
+
+
+_replica = None
+_replica_lock = threading.Lock()
+
+
+def default_replica(supabase=None):
+    """ Réplica compartida del proceso; la primera llamada con `supabase` arranca la sincronización. """
+    global _replica
+    if _replica is None:
+        with _replica_lock:
+            if _replica is None:
+                _replica = Replica(supabase=supabase)
+                if supabase is not None:
+                    _replica.start()
+    return _replica
+
+
+@instrumentation.register_collector
+def _replica_samples():
+    if _replica is None or not _replica.ready:
+        return []
+    return [('omed_replica_lag_seconds', {}, f'{_replica.lag():.3f}')]
+
+
+# 🔹 Día y ventana que cubre la salida de ejemplo de la RPC (la que sirve el fake)
+FIXTURE_DAY = date(2025, 2, 26)
+FIXTURE_WINDOW = ('17:00:00', '24:00:00')
+
+
+def check_parity(replica, supabase, day=FIXTURE_DAY, window=FIXTURE_WINDOW):
+    """ Lanza AssertionError si la réplica y la RPC no devuelven las mismas tomas en `window`. """
+    def key(toma):
+        return tuple(sorted(toma.items()))
+
+    expected = supabase.rpc('get_tomas_por_franja', {'start_time': window[0], 'end_time': window[1]}).execute().data
+    got = replica.tomas_por_franja(*window, day=day)
+    missing = set(map(key, expected)) - set(map(key, got))
+    extra = set(map(key, got)) - set(map(key, expected))
+    assert not missing and not extra and len(got) == len(expected), \
+        f"La réplica no coincide con la RPC el {day}: faltan {sorted(missing)}, sobran {sorted(extra)}"
+    return len(got)
+
+
+def benchmark(runs=200, db_latency=0.02):
+    """
+    Latencia de get_tomas_por_franja: RPC contra el fake con latencia frente a la réplica, en el
+    día y la ventana del ejemplo (con otro día la réplica no tendría tomas y se mediría una consulta vacía).
+    """
+    import fakes
+
+    supabase = fakes.FakeSupabase(latency=db_latency, jitter=0.3, seed=1)
+    replica = Replica(':memory:', supabase=supabase)
+    replica.sync()
+    rows = check_parity(replica, fakes.FakeSupabase())
+
+    def measure(fn):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings), sorted(timings)[int(runs * 0.99) - 1]
+
+    start, end = FIXTURE_WINDOW
+    rpc = measure(lambda: supabase.rpc('get_tomas_por_franja', {'start_time': start, 'end_time': end}).execute())
+    local = measure(lambda: replica.tomas_por_franja(start, end, day=FIXTURE_DAY))
+    print(f"{FIXTURE_DAY} {start}-{end}: {rows} tomas, iguales en la RPC y en la réplica")
+    print(f"{'origen':<10}{'p50 µs':>12}{'p99 µs':>12}")
+    for name, (p50, p99) in (('rpc', rpc), ('réplica', local)):
+        print(f"{name:<10}{p50 * 1e6:>12.1f}{p99 * 1e6:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Réplica local de medicamento/tratamiento.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('sync', help='Sincroniza una vez contra Supabase')
+    bench = sub.add_parser('bench', help='RPC (fake) frente a réplica')
+    bench.add_argument('--runs', type=int, default=200)
+    bench.add_argument('--db-latency', type=float, default=0.02)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        benchmark(args.runs, args.db_latency)
+        return
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    from appFactory import supabase_client
+
+    print(Replica(supabase=supabase_client()).sync())
+
+
+if __name__ == '__main__':
+    main()
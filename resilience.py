@@ -0,0 +1,281 @@
+"""
+Resiliencia frente a los upstreams (OpenAI y Supabase).
+
+- Hedging: si la llamada no ha terminado tras el percentil UPSTREAM_HEDGE_QUANTILE de las
+  latencias recientes, se lanza un duplicado y gana la primera respuesta correcta; la otra
+  se cancela si aún no ha empezado y, si ya está en curso, su resultado se descarta.
+  Solo para llamadas idempotentes (lecturas, modelos); las escrituras usan hedge=False.
+- Timeout por llamada: una llamada que no responde cuenta como fallo en lugar de colgar el request.
+  El hilo que la ejecuta no se puede interrumpir: los clientes (appFactory) reciben el mismo
+  timeout para que la llamada abandonada termine y no llene el pool de UPSTREAM_THREADS.
+- Circuit breaker: con una proporción de fallos sostenida se abre y falla al instante
+  (CircuitOpen) durante UPSTREAM_RESET_TIMEOUT; después deja pasar una llamada de prueba
+  (half-open) y se cierra si va bien.
+
+El estado de cada upstream se publica en /metrics (omed_upstream_state: 0 cerrado, 1 half-open, 2 abierto).
+
+    python resilience.py     # simulación con latencias y errores inyectados (fakes.Latency)
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import instrumentation
+
+HEDGE_QUANTILE = float(os.getenv('UPSTREAM_HEDGE_QUANTILE', '0.95'))
+# 🔹 Retardo del hedge mientras no hay suficientes muestras, y mínimo absoluto
+HEDGE_INITIAL_DELAY = float(os.getenv('UPSTREAM_HEDGE_INITIAL_DELAY', '5'))
+HEDGE_MIN_DELAY = float(os.getenv('UPSTREAM_HEDGE_MIN_DELAY', '0.05'))
+HEDGE_MIN_SAMPLES = 20
+TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', '60'))
+FAILURE_RATIO = float(os.getenv('UPSTREAM_FAILURE_RATIO', '0.5'))
+WINDOW = int(os.getenv('UPSTREAM_WINDOW', '20'))
+MIN_CALLS = int(os.getenv('UPSTREAM_MIN_CALLS', '10'))
+RESET_TIMEOUT = float(os.getenv('UPSTREAM_RESET_TIMEOUT', '30'))
+# 🔹 UPSTREAM_HEDGING=off desactiva los duplicados (timeouts y breaker siguen activos)
+HEDGING = os.getenv('UPSTREAM_HEDGING', 'on') != 'off'
+THREADS = int(os.getenv('UPSTREAM_THREADS', '64'))
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """ El upstream está marcado como caído: se falla sin llamarlo. `retry_after` en segundos. """
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamTimeout(Exception):
+    pass
+
+
+def is_failure(exc):
+    """
+    Los errores del cliente (4xx salvo 429) no indican que el upstream esté caído
+    y no cuentan para el breaker.
+    """
+    status = getattr(exc, 'status_code', None)
+    return not (isinstance(status, int) and 400 <= status < 500 and status != 429)
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_ratio=FAILURE_RATIO, window=WINDOW, min_calls=MIN_CALLS,
+                 reset_timeout=RESET_TIMEOUT, clock=time.monotonic):
+        self.name = name
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)  # True = fallo
+        self._opened_at = 0.0
+        self._probing = False
+        # 🔹 Cambia con cada transición: el resultado de una llamada admitida en un estado
+        # anterior (un timeout o un hedge lento que acaba ahora) no cuenta para el actual
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Lanza CircuitOpen si no se debe llamar; en half-open deja pasar una sola prueba.
+        Devuelve el token que hay que pasar a record() con el resultado.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.reset_timeout - (self.clock() - self._opened_at)
+                if remaining > 0:
+                    raise CircuitOpen(f'Upstream {self.name} no disponible (circuito abierto).',
+                                      retry_after=math.ceil(remaining))
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpen(f'Upstream {self.name} no disponible (probando recuperación).')
+                self._probing = True
+            return self._generation
+
+    def record(self, token, failed):
+        with self._lock:
+            if token != self._generation:
+                return  # admitida antes de la última transición: en half-open no es la prueba
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._open()
+                else:
+                    self._outcomes.clear()
+                    self._set_state(CLOSED)
+                return
+            self._outcomes.append(failed)
+            failures = sum(self._outcomes)
+            if (self.state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_ratio):
+                self._open()
+
+    def _open(self):
+        self._opened_at = self.clock()
+        self._outcomes.clear()
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        if state != self.state:
+            print(f"🔹 Circuito {self.name}: {self.state} -> {state}")
+            instrumentation.inc('omed_upstream_transitions_total', upstream=self.name, state=state)
+            self._generation += 1
+        self.state = state
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='omed-upstream')
+    return _executor
+
+
+class Upstream:
+    """
+    Un upstream con breaker, timeout y (opcionalmente) hedging:
+    `upstream('openai_chat').call(client.chat.completions.create, model=..., messages=...)`.
+    """
+
+    def __init__(self, name, hedge=True, hedge_quantile=HEDGE_QUANTILE, timeout=TIMEOUT, breaker=None,
+                 initial_delay=HEDGE_INITIAL_DELAY):
+        self.name = name
+        self.hedge = hedge and HEDGING
+        self.hedge_quantile = hedge_quantile
+        self.initial_delay = initial_delay
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker(name)
+        self._latencies = deque(maxlen=512)
+        self._lock = threading.Lock()
+
+    def hedge_delay(self):
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return self.initial_delay
+        return max(HEDGE_MIN_DELAY, samples[min(len(samples) - 1, int(self.hedge_quantile * len(samples)))])
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Ejecuta fn(*args, **kwargs) con las protecciones del upstream. Lanza CircuitOpen,
+        UpstreamTimeout o la excepción de la llamada.
+        """
+        try:
+            token = self.breaker.before_call()
+        except CircuitOpen:
+            instrumentation.inc('omed_upstream_calls_total', upstream=self.name, result='rejected')
+            raise
+
+        start = time.perf_counter()
+        futures = [_pool().submit(fn, *args, **kwargs)]
+        if self.hedge:
+            done, _ = wait(futures, timeout=self.hedge_delay())
+            if not done:
+                futures.append(_pool().submit(fn, *args, **kwargs))
+                instrumentation.inc('omed_upstream_hedges_total', upstream=self.name)
+
+        pending = set(futures)
+        error = None
+        while pending:
+            remaining = None if self.timeout is None else max(0.0, start + self.timeout - time.perf_counter())
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                for future in pending:
+                    future.cancel()
+                self._finish(token, 'timeout', True)
+                raise UpstreamTimeout(f'Upstream {self.name} sin respuesta en {self.timeout:.0f} s.')
+            for future in done:
+                if future.exception() is None:
+                    # 🔹 Gana la primera respuesta correcta; la otra se cancela o se descarta
+                    for other in pending:
+                        other.cancel()
+                    winner = 'primary' if future is futures[0] else 'hedge'
+                    if len(futures) > 1:
+                        instrumentation.inc('omed_upstream_hedge_wins_total', upstream=self.name, winner=winner)
+                    with self._lock:
+                        self._latencies.append(time.perf_counter() - start)
+                    self._finish(token, 'ok', False)
+                    return future.result()
+                error = future.exception()
+
+        self._finish(token, 'error', is_failure(error))
+        raise error
+
+    def _finish(self, token, result, failed):
+        instrumentation.inc('omed_upstream_calls_total', upstream=self.name, result=result)
+        self.breaker.record(token, failed)
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def upstream(name, **options):
+    """ Upstream compartido por nombre (las opciones solo se aplican la primera vez). """
+    found = _upstreams.get(name)
+    if found is None:
+        with _upstreams_lock:
+            found = _upstreams.setdefault(name, Upstream(name, **options))
+    return found
+
+
+@instrumentation.register_collector
+def _upstream_samples():
+    samples = []
+    for name, up in sorted(_upstreams.items()):
+        samples.append(('omed_upstream_state', {'upstream': name}, _STATE_VALUE[up.breaker.state]))
+        samples.append(('omed_upstream_hedge_delay_seconds', {'upstream': name}, f'{up.hedge_delay():.6f}'))
+    return samples
+
+
+def simulate(calls=400, latency=0.02, tail_rate=0.02, tail_latency=0.5, error_rate=0.0, hedge=True,
+             recover_after=None, seed=1):
+    """
+    Llama `calls` veces a un upstream falso (fakes.Latency) y devuelve latencias y resultados.
+    Con `recover_after`, el upstream deja de fallar tras esas llamadas (para ver el half-open).
+    """
+    from fakes import FakeUpstreamError, Latency
+
+    fake = Latency(latency, jitter=0.2, error_rate=error_rate, seed=seed, tail_rate=tail_rate,
+                   tail_latency=tail_latency)
+    up = Upstream(f'sim_{"hedge" if hedge else "plain"}', hedge=hedge, timeout=5, initial_delay=0.1,
+                  breaker=CircuitBreaker('sim', reset_timeout=0.2))
+    timings, results = [], {'ok': 0, 'error': 0, 'rejected': 0}
+    for i in range(calls):
+        if i == recover_after:
+            fake.error_rate = 0.0
+        start = time.perf_counter()
+        try:
+            up.call(fake.wait, 'sim')
+            results['ok'] += 1
+        except CircuitOpen:
+            results['rejected'] += 1
+            time.sleep(0.005)  # el cliente reintenta más tarde
+        except FakeUpstreamError:
+            results['error'] += 1
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {'p50': timings[len(timings) // 2], 'p99': timings[int(len(timings) * 0.99)],
+            'max': timings[-1], **results, 'state': up.breaker.state}
+
+
+if __name__ == '__main__':
+    for hedge in (False, True):
+        r = simulate(hedge=hedge)
+        print(f"hedge={'sí' if hedge else 'no'}  p50={r['p50'] * 1000:.0f} ms  p99={r['p99'] * 1000:.0f} ms  "
+              f"max={r['max'] * 1000:.0f} ms  ok={r['ok']}")
+    r = simulate(calls=200, tail_rate=0.0, error_rate=0.6, recover_after=100)
+    print(f"60% de errores y recuperación a las 100 llamadas: ok={r['ok']} errores={r['error']} "
+          f"rechazadas por el breaker={r['rejected']} (estado final: {r['state']})")
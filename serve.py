@@ -0,0 +1,119 @@
+"""
+Punto de entrada de producción para los servicios (en lugar de `app.run(debug=True)`).
+
+Uso:
+    python serve.py photo_to_name                       # gunicorn, 2 workers x 8 hilos, puerto 5001
+    python serve.py transcribe --workers 4 --threads 16
+    python serve.py text_to_json --async                # workers gevent para servicios de I/O (OpenAI)
+    python serve.py query_text --server waitress        # sin fork (Windows o contenedores mínimos)
+    python serve.py day_summary --server dev            # servidor de desarrollo de Flask (comparación)
+
+Variables de entorno equivalentes: OMED_WORKERS, OMED_THREADS, OMED_PORT, OMED_BIND,
+OMED_GRACEFUL_TIMEOUT. SIGTERM cierra de forma ordenada: se deja de aceptar conexiones
+y se esperan las peticiones en curso hasta el timeout.
+"""
+import argparse
+import os
+import signal
+import sys
+
+from services import SERVICES, load_service, use_fake_credentials
+
+
+def build_app(name, fake_backends=False, model_latency=0.2, db_latency=0.02):
+    """
+    Carga la app Flask del servicio; con `fake_backends` sustituye OpenAI y Supabase
+    por los fakes (solo para pruebas de carga).
+    """
+    if fake_backends:
+        use_fake_credentials()
+    module = load_service(name)
+    if fake_backends:
+        import fakes
+        fakes.install(module,
+                      openai=fakes.FakeOpenAI(latency=model_latency, jitter=0.3),
+                      supabase=fakes.FakeSupabase(latency=db_latency, jitter=0.3))
+    return module.app
+
+
+def serve_gunicorn(name, args):
+    from gunicorn.app.base import BaseApplication
+
+    class OmedApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': f'{args.bind}:{args.port}',
+                'workers': args.workers,
+                'threads': args.threads,
+                'worker_class': 'gevent' if args.use_async else 'gthread',
+                'graceful_timeout': args.graceful_timeout,
+                'timeout': args.timeout,
+                'keepalive': 5,
+                'accesslog': '-' if args.access_log else None,
+                'proc_name': f'omed-{name}',
+            }
+            if args.use_async:
+                options['worker_connections'] = args.threads * 32
+            for key, value in options.items():
+                if value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            # 🔹 Se carga dentro de cada worker (sin preload): gevent parchea la E/S antes del import
+            return build_app(name, args.fake_backends, args.model_latency, args.db_latency)
+
+    OmedApplication().run()
+
+
+def serve_waitress(name, args):
+    from waitress import serve
+
+    app = build_app(name, args.fake_backends, args.model_latency, args.db_latency)
+    # waitress no captura SIGTERM: lo convertimos en salida ordenada
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    serve(app, host=args.bind, port=args.port, threads=args.threads,
+          channel_timeout=args.timeout, ident=f'omed-{name}')
+
+
+def serve_dev(name, args):
+    app = build_app(name, args.fake_backends, args.model_latency, args.db_latency)
+    app.run(host=args.bind, port=args.port, debug=False, threaded=True)
+
+
+SERVERS = {'gunicorn': serve_gunicorn, 'waitress': serve_waitress, 'dev': serve_dev}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Servidor de producción de los servicios oMed.')
+    parser.add_argument('service', choices=list(SERVICES))
+    parser.add_argument('--server', choices=list(SERVERS), default=os.getenv('OMED_SERVER', 'gunicorn'))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('OMED_WORKERS', '2')),
+                        help='Procesos worker (solo gunicorn)')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('OMED_THREADS', '8')),
+                        help='Hilos por worker (con --async, escala las conexiones concurrentes)')
+    parser.add_argument('--port', type=int, default=None, help='Por defecto el puerto propio del servicio')
+    parser.add_argument('--bind', default=os.getenv('OMED_BIND', '0.0.0.0'))
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Workers gevent: recomendado para servicios que esperan a OpenAI/Supabase')
+    parser.add_argument('--graceful-timeout', type=int, default=int(os.getenv('OMED_GRACEFUL_TIMEOUT', '30')))
+    parser.add_argument('--timeout', type=int, default=120, help='Tiempo máximo por petición (s)')
+    parser.add_argument('--access-log', action='store_true')
+    parser.add_argument('--fake-backends', action='store_true', help='OpenAI/Supabase falsos (pruebas de carga)')
+    parser.add_argument('--model-latency', type=float, default=0.2)
+    parser.add_argument('--db-latency', type=float, default=0.02)
+    args = parser.parse_args(argv)
+
+    if args.port is None:
+        args.port = int(os.getenv('OMED_PORT', SERVICES[args.service][1]))
+    # 🔹 El control de admisión (admission.py) dimensiona los límites por ruta con la concurrencia por worker
+    os.environ.setdefault('ADMISSION_THREADS', str(args.threads * 32 if args.use_async else args.threads))
+    if args.use_async and args.server != 'gunicorn':
+        parser.error('--async requiere --server gunicorn (workers gevent)')
+    if args.server == 'gunicorn' and sys.platform == 'win32':
+        args.server = 'waitress'
+
+    SERVERS[args.server](args.service, args)
+
+
+if __name__ == '__main__':
+    main()
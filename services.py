@@ -0,0 +1,50 @@
+import importlib.util
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 🔹 Servicios del proyecto: nombre -> (script, puerto por defecto)
+SERVICES = {
+    'transcribe': ('1_audioToText.py', 5000),
+    'photo_to_name': ('2_photoToNamePill_GPT.py', 5001),
+    'text_to_json': ('3_textToJson.py', 5002),
+    'audio_to_text': ('4_audioToTextoSOLO.py', 5003),
+    'query_text': ('5_queryText.py', 5006),
+    'day_summary': ('5_1_queryTextServerCHATG.py', 5007),
+}
+
+
+def load_service(name):
+    """
+    Importa el script de un servicio (sus nombres empiezan por número, así que no
+    se pueden importar con `import`) y devuelve el módulo. Se cachea en sys.modules.
+    """
+    if name not in SERVICES:
+        raise KeyError(f'Servicio desconocido: {name}. Opciones: {", ".join(SERVICES)}')
+    module_name = f'omed_{name}'
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    script, _ = SERVICES[name]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(BASE_DIR, script))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
+
+
+def use_fake_credentials():
+    """
+    Rellena las variables de entorno con valores ficticios para poder importar
+    los servicios sin credenciales reales (los clientes se sustituyen por fakes).
+    """
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-fake')
+    os.environ.setdefault('SUPABASE_URL', 'http://localhost:54321')
+    os.environ.setdefault('SUPABASE_KEY', 'fake.fake.fake')
@@ -0,0 +1,89 @@
+import hashlib
+import threading
+
+import instrumentation
+
+
+def content_key(*parts):
+    """
+    Genera una clave estable (sha256) a partir del contenido de la petición.
+    Acepta bytes o str; el resto se convierte con str().
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        elif not isinstance(part, (bytes, bytearray, memoryview)):
+            part = str(part).encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave: solo la primera ejecuta
+    la función y el resto espera su resultado (o su excepción).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0  # 🔹 Llamadas que realmente llegaron al upstream
+        self.coalesced = 0  # 🔹 Llamadas que reutilizaron una en curso
+        instrumentation.register_collector(self._collect)
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+            }
+
+    def _collect(self):
+        stats = self.stats()
+        return [
+            ('omed_single_flight_total', {'name': self.name, 'result': 'leader'}, stats['leaders'], 'counter'),
+            ('omed_single_flight_total', {'name': self.name, 'result': 'coalesced'}, stats['coalesced'], 'counter'),
+            ('omed_single_flight_in_flight', {'name': self.name}, stats['in_flight']),
+        ]
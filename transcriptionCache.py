@@ -0,0 +1,393 @@
+"""
+Caché de transcripciones de Whisper.
+
+Cuando un request falla después de transcribir (5001 o 5002 caídos), el cliente reenvía la
+misma nota de voz y se volvía a pagar y esperar a whisper-1, la etapa más lenta. Ahora:
+
+- clave: sha256 del audio tal como se subió (uploadStream lo calcula mientras llega),
+- LRU en memoria (TRANSCRIPTION_CACHE_ITEMS) delante de una tabla SQLite en disco
+  (TRANSCRIPTION_CACHE_PATH) que sobrevive a reinicios y se comparte entre procesos,
+- las entradas caducan a las TRANSCRIPTION_CACHE_TTL segundos (son datos del paciente:
+  no se guardan para siempre) y se borran del disco al leer o escribir, como mucho cada
+  TRANSCRIPTION_CACHE_PURGE_SECONDS.
+
+Con TRANSCRIPTION_CACHE_KEY=pcm, si el hash no está, se busca además por la huella del audio
+decodificado: si la energía sube o baja en 100 ms, en frames de 20 ms desde el primer sonido. No cambia
+al recodificar (otro formato, frecuencia o volumen), así que una copia convertida de la misma
+nota también acierta. Dos huellas coinciden si difieren en menos de FINGERPRINT_MAX_DISTANCE
+de sus bits (con ±3 frames de desfase por el retardo de los códecs).
+
+⚠️ El umbral solo está validado con envolventes sintéticas (ruido modulado recodificado), no con
+notas de voz reales. Un falso acierto devolvería la transcripción de otra nota (de otro paciente):
+antes de activar pcm en producción hay que medir `compare` con grabaciones reales.
+
+    python transcriptionCache.py bench          # fallo, acierto en memoria, en disco y por huella
+    python transcriptionCache.py compare a.ogg b.wav
+    python transcriptionCache.py purge          # borra las entradas caducadas
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import chunkedWhisper
+import instrumentation
+from lazy import lazy_module
+
+np = lazy_module('numpy')
+
+ENABLED = os.getenv('TRANSCRIPTION_CACHE', 'on') != 'off'
+KEY = os.getenv('TRANSCRIPTION_CACHE_KEY', 'hash')  # hash | pcm
+PATH = os.getenv('TRANSCRIPTION_CACHE_PATH', os.path.join('data', 'transcriptions.sqlite'))
+TTL = float(os.getenv('TRANSCRIPTION_CACHE_TTL', str(7 * 24 * 3600)))
+MEMORY_ITEMS = int(os.getenv('TRANSCRIPTION_CACHE_ITEMS', '256'))
+# 🔹 Cada cuánto (como mucho) se borran las entradas caducadas, al leer o escribir
+PURGE_SECONDS = float(os.getenv('TRANSCRIPTION_CACHE_PURGE_SECONDS', '3600'))
+
+FINGERPRINT_FRAME_SECONDS = 0.02
+# 🔹 El sonido empieza (y acaba) en el primer (último) frame a menos de 30 dB del más fuerte
+FINGERPRINT_FLOOR_DB = 30
+# Cada bit compara un frame con el de FINGERPRINT_LAG frames antes (pendiente en 100 ms): con frames
+# cortos y pendiente larga, el desfase de los códecs dentro de un frame apenas cambia bits
+FINGERPRINT_LAG = 5
+# Por debajo de este número de bits (~2 s de sonido) la huella no distingue bien: solo vale el hash
+FINGERPRINT_MIN_BITS = 100
+FINGERPRINT_MAX_DISTANCE = float(os.getenv('TRANSCRIPTION_CACHE_MAX_DISTANCE', '0.15'))
+FINGERPRINT_MAX_SHIFT = 3
+# 🔹 Tolerancia de duración (s) al buscar candidatos por huella
+DURATION_TOLERANCE = 0.25
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcripcion (
+    clave TEXT PRIMARY KEY,
+    texto TEXT NOT NULL,
+    huella BLOB,
+    bits INTEGER,
+    duracion REAL,
+    creado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transcripcion_duracion ON transcripcion (duracion);
+CREATE INDEX IF NOT EXISTS transcripcion_creado ON transcripcion (creado);
+"""
+
+
+class Fingerprint:
+    __slots__ = ('bits', 'duration')
+
+    def __init__(self, bits, duration):
+        self.bits = bits  # array bool: la energía sube (True) o baja respecto a FINGERPRINT_LAG frames antes
+        self.duration = duration
+
+    def pack(self):
+        return np.packbits(self.bits).tobytes(), len(self.bits)
+
+    @classmethod
+    def unpack(cls, blob, bits, duration):
+        return cls(np.unpackbits(np.frombuffer(blob, np.uint8))[:bits].astype(bool), duration)
+
+    def distance(self, other, max_shift=FINGERPRINT_MAX_SHIFT):
+        """ Fracción de bits distintos con el mejor desfase en [-max_shift, max_shift] frames. """
+        best = 1.0
+        for shift in range(-max_shift, max_shift + 1):
+            a = self.bits[max(shift, 0):]
+            b = other.bits[max(-shift, 0):]
+            n = min(len(a), len(b))
+            if n >= FINGERPRINT_MIN_BITS:
+                best = min(best, float(np.count_nonzero(a[:n] != b[:n])) / n)
+        return best
+
+
+def fingerprint_samples(samples, rate):
+    """ Huella de muestras PCM mono; None si hay muy poco sonido para distinguirla. """
+    frame = int(rate * FINGERPRINT_FRAME_SECONDS)
+    frames = len(samples) // frame
+    if frames < 2:
+        return None
+    blocks = samples[:frames * frame].astype(np.float64).reshape(frames, frame)
+    energy = 10 * np.log10((blocks ** 2).mean(axis=1) + 1.0)
+    floor = energy.max() - FINGERPRINT_FLOOR_DB
+    loud = np.flatnonzero(energy >= floor)
+    # 🔹 Los silencios se igualan al suelo: el ruido del códec en las pausas no cambia bits
+    energy = np.maximum(energy[loud[0]:loud[-1] + 1], floor)
+    if len(energy) - FINGERPRINT_LAG < FINGERPRINT_MIN_BITS:
+        return None
+    return Fingerprint(energy[FINGERPRINT_LAG:] > energy[:-FINGERPRINT_LAG], len(energy) * FINGERPRINT_FRAME_SECONDS)
+
+
+def fingerprint(path):
+    """ Huella del audio en `path`; None si no se puede decodificar (sin ffmpeg) o es muy corto. """
+    try:
+        samples, rate = chunkedWhisper.decode(path)
+    except ValueError:
+        return None
+    return fingerprint_samples(samples, rate)
+
+
+def _whisper(client, path):
+    if chunkedWhisper.MODE == 'chunked':
+        return chunkedWhisper.transcribe(client, path)
+    return chunkedWhisper.transcribe_whole(client, path)
+
+
+class TranscriptionCache:
+    def __init__(self, path=PATH, ttl=TTL, memory_items=MEMORY_ITEMS, key=KEY, clock=time.time,
+                 purge_every=PURGE_SECONDS):
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.use_fingerprint = key == 'pcm'
+        self.clock = clock
+        self.purge_every = purge_every
+        self._last_purge = None
+        self._memory = OrderedDict()  # sha256 -> (texto, creado)
+        # 🔹 Una conexión compartida con lock, como la réplica: las consultas tardan microsegundos
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self.purge()
+
+    def _remember(self, key, text, created):
+        with self._lock:
+            self._memory[key] = (text, created)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _from_memory(self, key, now):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if now - entry[1] > self.ttl:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return entry[0]
+
+    def _from_disk(self, key, now):
+        with self._lock:
+            row = self._db.execute('SELECT texto, creado FROM transcripcion WHERE clave = ? AND creado >= ?',
+                                   (key, now - self.ttl)).fetchone()
+        return row
+
+    def _from_fingerprint(self, print_, now):
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT texto, creado, huella, bits, duracion FROM transcripcion '
+                'WHERE huella IS NOT NULL AND duracion BETWEEN ? AND ? AND creado >= ?',
+                (print_.duration - DURATION_TOLERANCE, print_.duration + DURATION_TOLERANCE,
+                 now - self.ttl)).fetchall()
+        best = None
+        for text, created, blob, bits, duration in rows:
+            distance = print_.distance(Fingerprint.unpack(blob, bits, duration))
+            if distance <= FINGERPRINT_MAX_DISTANCE and (best is None or distance < best[0]):
+                best = (distance, text, created)
+        return best
+
+    def lookup(self, sha256, path=None):
+        """
+        Devuelve (texto o None, huella). La huella solo se calcula en modo pcm y si el hash no
+        está; se devuelve para pasarla a `store` sin decodificar el audio otra vez.
+        """
+        now = self.clock()
+        self._maybe_purge(now)
+        text = self._from_memory(sha256, now)
+        if text is not None:
+            instrumentation.inc('omed_transcription_cache_total', result='hit_memory')
+            return text, None
+        row = self._from_disk(sha256, now)
+        if row is not None:
+            instrumentation.inc('omed_transcription_cache_total', result='hit_disk')
+            self._remember(sha256, row[0], row[1])
+            return row[0], None
+
+        print_ = None
+        if self.use_fingerprint and path is not None:
+            with instrumentation.timer('transcription_fingerprint'):
+                print_ = fingerprint(path)
+            match = self._from_fingerprint(print_, now) if print_ is not None else None
+            if match is not None:
+                distance, text, created = match
+                instrumentation.inc('omed_transcription_cache_total', result='hit_fingerprint')
+                # 🔹 Esta copia se guarda también por su hash: si se reenvía, acierta sin decodificar
+                self.store(sha256, text, print_, created=created)
+                return text, print_
+        instrumentation.inc('omed_transcription_cache_total', result='miss')
+        return None, print_
+
+    def store(self, sha256, text, print_=None, created=None):
+        self._maybe_purge(self.clock())
+        created = self.clock() if created is None else created
+        blob, bits = print_.pack() if print_ is not None else (None, None)
+        duration = print_.duration if print_ is not None else None
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO transcripcion (clave, texto, huella, bits, duracion, creado) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', (sha256, text, blob, bits, duration, created))
+        self._remember(sha256, text, created)
+
+    def transcribe(self, client, path, sha256):
+        """ Transcripción de `path` desde la caché o, si no está, con Whisper (y se guarda). """
+        text, print_ = self.lookup(sha256, path)
+        if text is not None:
+            return text
+        text = _whisper(client, path)
+        self.store(sha256, text, print_)
+        return text
+
+    def _maybe_purge(self, now):
+        if self._last_purge is None or now - self._last_purge >= self.purge_every:
+            self.purge()
+
+    def purge(self):
+        """ Borra las entradas caducadas del disco y de la memoria; devuelve cuántas había en disco. """
+        now = self.clock()
+        with self._lock:
+            self._last_purge = now
+            for key in [key for key, (_, created) in self._memory.items() if now - created > self.ttl]:
+                del self._memory[key]
+            removed = self._db.execute('DELETE FROM transcripcion WHERE creado < ?', (now - self.ttl,)).rowcount
+        if removed:
+            instrumentation.inc('omed_transcription_cache_expired_total', removed)
+        return removed
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM transcripcion').fetchone()[0]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def default_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TranscriptionCache()
+    return _cache
+
+
+def transcribe(client, path, sha256):
+    """ Lo que usan los servicios: con caché salvo TRANSCRIPTION_CACHE=off. """
+    if not ENABLED:
+        return _whisper(client, path)
+    return default_cache().transcribe(client, path, sha256)
+
+
+def lookup(sha256, path=None):
+    """ Para quien transcribe por su cuenta (SSE): (texto o None, huella para `store`). """
+    if not ENABLED:
+        return None, None
+    return default_cache().lookup(sha256, path)
+
+
+def store(sha256, text, print_=None):
+    if ENABLED:
+        default_cache().store(sha256, text, print_)
+
+
+@instrumentation.register_collector
+def _cache_samples():
+    if _cache is None:
+        return []
+    return [('omed_transcription_cache_memory_items', {}, len(_cache._memory))]
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+def _synthetic_note(seconds, rate, seed):
+    """ Ruido modulado por sílabas de 80-300 ms con pausas: la envolvente de una nota de voz. """
+    rng = np.random.default_rng(seed)
+    envelope = []
+    while sum(len(part) for part in envelope) < seconds * rate:
+        syllable = int(rng.uniform(0.08, 0.3) * rate)
+        envelope.append(np.sin(np.linspace(0, np.pi, syllable)) * rng.uniform(0.2, 1.0))
+        envelope.append(np.zeros(int(rng.uniform(0.02, 0.25) * rate)))
+    envelope = np.concatenate(envelope)[:int(seconds * rate)]
+    return envelope * rng.normal(0, 8000, len(envelope))
+
+
+def _reencode(samples, rate, new_rate, gain=0.6, delay=0.03, noise=60, seed=0):
+    """ Copia «recodificada»: otra frecuencia, otro volumen, retardo inicial y ruido del códec. """
+    t = np.arange(int(len(samples) * new_rate / rate)) * rate / new_rate
+    copy = np.interp(t, np.arange(len(samples)), samples) * gain
+    copy = np.concatenate([np.zeros(int(delay * new_rate)), copy])
+    return copy + np.random.default_rng(seed).normal(0, noise, len(copy))
+
+
+def _write_wav(path, samples, rate):
+    with open(path, 'wb') as f:
+        f.write(chunkedWhisper.to_wav(np.clip(samples, -32768, 32767).astype(np.int16), rate))
+
+
+def benchmark(whisper_latency=1.5, seconds=12.0):
+    """ Latencia de cada camino (fallo con Whisper fake, memoria, disco y huella) y distancias de huella. """
+    import fakes
+
+    client = fakes.FakeOpenAI(latency=whisper_latency)
+    rate = chunkedWhisper.SAMPLE_RATE
+    note = _synthetic_note(seconds, rate, seed=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {'original': os.path.join(tmp, 'nota.wav'),
+                 'recodificada': os.path.join(tmp, 'nota_44k.wav'),
+                 'otra nota': os.path.join(tmp, 'otra.wav')}
+        _write_wav(paths['original'], note, rate)
+        _write_wav(paths['recodificada'], _reencode(note, rate, 44100), 44100)
+        _write_wav(paths['otra nota'], _synthetic_note(seconds, rate, seed=2), rate)
+
+        original = fingerprint(paths['original'])
+        for name in ('recodificada', 'otra nota'):
+            print(f"distancia original - {name}: {original.distance(fingerprint(paths[name])):.3f} "
+                  f"(umbral {FINGERPRINT_MAX_DISTANCE})")
+
+        db = os.path.join(tmp, 'cache.sqlite')
+        cache = TranscriptionCache(db, key='pcm')
+
+        def measure(name, cache, path, sha256):
+            start = time.perf_counter()
+            text = cache.transcribe(client, path, sha256)
+            print(f"{name:<18}{(time.perf_counter() - start) * 1000:>10.2f} ms  {text[:40]!r}")
+
+        print(f"{'camino':<18}{'latencia':>13}")
+        measure('fallo (whisper)', cache, paths['original'], 'sha-original')
+        measure('memoria', cache, paths['original'], 'sha-original')
+        measure('disco', TranscriptionCache(db, key='pcm'), paths['original'], 'sha-original')
+        measure('huella', cache, paths['recodificada'], 'sha-recodificada')
+        measure('fallo (otra)', cache, paths['otra nota'], 'sha-otra')
+    print(f"llamadas a whisper: {client.whisper_latency.calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Caché de transcripciones de Whisper.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    bench = sub.add_parser('bench', help='Latencia de fallo y aciertos con Whisper fake')
+    bench.add_argument('--whisper-latency', type=float, default=1.5)
+    compare = sub.add_parser('compare', help='Distancia entre las huellas de dos audios')
+    compare.add_argument('a')
+    compare.add_argument('b')
+    sub.add_parser('purge', help='Borra las entradas caducadas')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        benchmark(args.whisper_latency)
+    elif args.command == 'compare':
+        a, b = fingerprint(args.a), fingerprint(args.b)
+        if a is None or b is None:
+            print('No se pudo calcular la huella (audio muy corto o sin ffmpeg).')
+            return
+        distance = a.distance(b)
+        print(f"distancia {distance:.3f}: {'misma nota' if distance <= FINGERPRINT_MAX_DISTANCE else 'distintas'}")
+    else:
+        print(f"{TranscriptionCache().purge()} entradas caducadas borradas")
+
+
+if __name__ == '__main__':
+    main()
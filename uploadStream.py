@@ -0,0 +1,269 @@
+"""
+Lectura en streaming de subidas multipart/form-data.
+
+En lugar de dejar que Flask lea y guarde todo el cuerpo antes de validar, el cuerpo se
+lee por trozos (parser sans-IO de Werkzeug) y cada archivo:
+
+- se identifica por sus bytes mágicos en el primer trozo (no por la extensión),
+- se corta en cuanto supera el límite de su campo,
+- se resume con sha256 mientras llega (clave para las cachés y la deduplicación),
+- se guarda en memoria o directamente en disco (audios) sin pasar por memoria entera.
+
+Cualquier fallo lanza UploadRejected con el código HTTP (400/413/415) antes de leer
+el resto del cuerpo; la respuesta debe cerrar la conexión (ver `error_response`).
+"""
+import hashlib
+import io
+import os
+import uuid
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.utils import secure_filename
+
+import instrumentation
+
+CHUNK_SIZE = 64 * 1024
+# 🔹 Se anota el RSS cada tantos trozos leídos (pico de memoria del request)
+RSS_SAMPLE_EVERY = 16
+MAX_FORM_FIELD_BYTES = 64 * 1024
+
+IMAGE_KINDS = {'jpeg', 'png', 'webp'}  # Los que aceptan OpenCV y el modelo de visión
+AUDIO_KINDS = {'ogg', 'mp3', 'wav', 'm4a', 'webm', 'flac'}
+
+
+def sniff(head):
+    """ Tipo de archivo a partir de sus primeros bytes, o None si no se reconoce. """
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head.startswith(b'OggS'):
+        return 'ogg'
+    if head.startswith(b'fLaC'):
+        return 'flac'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'webm'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in (b'heic', b'heix', b'mif1', b'msf1', b'heim', b'heis'):
+            return 'heic'
+        return 'm4a'  # M4A/MP4/3GP: contenedor ISO de audio (notas de voz de iOS/Android)
+    if head.startswith(b'ID3') or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    return None
+
+
+class UploadRejected(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class FieldLimit:
+    """
+    Reglas de un campo de archivo: tamaño máximo, tipos aceptados (bytes mágicos), si es
+    obligatorio, cuántos archivos admite, si se guarda en disco (`to_disk`) o en memoria y,
+    opcionalmente, las extensiones de nombre permitidas (se comprueban antes de leer datos).
+    """
+
+    def __init__(self, max_bytes, kinds, required=True, max_files=1, to_disk=False, extensions=None):
+        self.max_bytes = max_bytes
+        self.kinds = set(kinds)
+        self.extensions = set(extensions) if extensions else None
+        self.required = required
+        self.max_files = max_files
+        self.to_disk = to_disk
+
+
+class UploadedFile:
+    def __init__(self, field, filename, kind, size, sha256, data=None, path=None):
+        self.field = field
+        self.filename = filename
+        self.kind = kind
+        self.size = size
+        self.sha256 = sha256
+        self.data = data    # bytes si se guardó en memoria
+        self.path = path    # ruta si se guardó en disco
+
+    def read(self):
+        if self.data is not None:
+            return self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def remove(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Upload:
+    """ Resultado de `parse`: archivos por campo (listas) y campos de texto. """
+
+    def __init__(self):
+        self.files = {}
+        self.form = {}
+
+    def file(self, field):
+        files = self.files.get(field)
+        return files[0] if files else None
+
+    def remove(self):
+        """ Borra los archivos guardados en disco. """
+        for files in self.files.values():
+            for uploaded in files:
+                uploaded.remove()
+
+
+class _Part:
+    def __init__(self, field, filename, limit, directory):
+        self.field = field
+        self.filename = filename
+        self.limit = limit
+        self.size = 0
+        self.kind = None
+        self.head = b''
+        self.hash = hashlib.sha256()
+        self.path = None
+        if limit.to_disk:
+            name = f"{uuid.uuid4().hex}_{secure_filename(filename) or 'upload'}"
+            self.path = os.path.join(directory, name)
+            self.sink = open(self.path, 'wb')
+        else:
+            self.sink = io.BytesIO()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit.max_bytes:
+            raise UploadRejected(f"El archivo '{self.field}' supera el máximo de {self.limit.max_bytes} bytes.", 413)
+        if self.kind is None:
+            # 🔹 Tipo por bytes mágicos en cuanto hay suficientes (normalmente el primer trozo)
+            self.head += data[:32 - len(self.head)]
+            if len(self.head) >= 12:
+                self._check_kind()
+        self.hash.update(data)
+        self.sink.write(data)
+
+    def _check_kind(self):
+        self.kind = sniff(self.head)
+        if self.kind not in self.limit.kinds:
+            raise UploadRejected(f"Tipo de archivo no permitido en '{self.field}' "
+                                 f"(aceptados: {', '.join(sorted(self.limit.kinds))}).", 415)
+
+    def finish(self):
+        if self.size == 0:
+            raise UploadRejected(f"El archivo '{self.field}' está vacío.", 400)
+        if self.kind is None:
+            self._check_kind()
+        if self.path:
+            self.sink.close()
+            return UploadedFile(self.field, self.filename, self.kind, self.size, self.hash.hexdigest(), path=self.path)
+        return UploadedFile(self.field, self.filename, self.kind, self.size, self.hash.hexdigest(),
+                            data=self.sink.getvalue())
+
+    def abort(self):
+        self.sink.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def parse(request, limits, directory='uploads', chunk_size=CHUNK_SIZE):
+    """
+    Lee el multipart de `request` en streaming aplicando `limits` ({campo: FieldLimit}).
+    Los campos de archivo no declarados se rechazan. Devuelve un Upload o lanza UploadRejected.
+    """
+    mimetype, options = parse_options_header(request.headers.get('Content-Type', ''))
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise UploadRejected("Se esperaba multipart/form-data.", 400)
+
+    # 🔹 Content-Length declarado mayor que la suma de límites: se rechaza sin leer nada
+    declared = request.content_length
+    if declared is not None and declared > sum(l.max_bytes * l.max_files for l in limits.values()) + 64 * 1024:
+        raise UploadRejected("La petición supera el tamaño máximo permitido.", 413)
+
+    if any(limit.to_disk for limit in limits.values()):
+        os.makedirs(directory, exist_ok=True)
+
+    upload = Upload()
+    decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=MAX_FORM_FIELD_BYTES)
+    stream = request.stream
+    part = None
+    field_name, field_value = None, []
+    chunks = 0
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            decoder.receive_data(chunk or None)
+            chunks += 1
+            if chunks % RSS_SAMPLE_EVERY == 0:
+                instrumentation.sample_rss()
+
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File):
+                    limit = limits.get(event.name)
+                    if limit is None:
+                        raise UploadRejected(f"Campo de archivo inesperado: '{event.name}'.", 400)
+                    if len(upload.files.get(event.name, [])) >= limit.max_files:
+                        raise UploadRejected(f"Demasiados archivos en '{event.name}' (máximo {limit.max_files}).", 400)
+                    filename = event.filename or ''
+                    if limit.extensions is not None and filename.rsplit('.', 1)[-1].lower() not in limit.extensions:
+                        raise UploadRejected(f"Extensión de archivo no permitida en '{event.name}'.", 415)
+                    part = _Part(event.name, filename, limit, directory)
+                elif isinstance(event, Field):
+                    field_name, field_value = event.name, []
+                elif isinstance(event, Data):
+                    if part is not None:
+                        part.write(event.data)
+                        if not event.more_data:
+                            upload.files.setdefault(part.field, []).append(part.finish())
+                            part = None
+                    else:
+                        field_value.append(event.data)
+                        if not event.more_data:
+                            upload.form[field_name] = b''.join(field_value).decode('utf-8', 'replace')
+                event = decoder.next_event()
+
+            if isinstance(event, Epilogue) or not chunk:
+                break
+    except UploadRejected:
+        if part is not None:
+            part.abort()
+        upload.remove()
+        raise
+    except RequestEntityTooLarge:  # MAX_CONTENT_LENGTH de la app o campo de texto demasiado grande
+        if part is not None:
+            part.abort()
+        upload.remove()
+        raise UploadRejected("La petición supera el tamaño máximo permitido.", 413)
+    except ValueError as e:  # multipart mal formado
+        if part is not None:
+            part.abort()
+        upload.remove()
+        raise UploadRejected(f"Cuerpo multipart no válido: {e}", 400)
+
+    for field, limit in limits.items():
+        if limit.required and not upload.files.get(field):
+            upload.remove()
+            raise UploadRejected(f"No se encontró el archivo '{field}'.", 400)
+    return upload
+
+
+def error_response(error):
+    """
+    Respuesta JSON para un UploadRejected. Se cierra la conexión porque puede quedar
+    cuerpo sin leer en el socket.
+    """
+    from flask import jsonify
+
+    instrumentation.inc('omed_upload_rejected_total', status=error.status)
+    response = jsonify({'error': str(error)})
+    response.status_code = error.status
+    response.headers['Connection'] = 'close'
+    return response